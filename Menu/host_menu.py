@@ -1,8 +1,9 @@
 import pygame
 import sys
 import socket
+import time
 from Menu.button import Button
-from Menu.stream_game import StreamGame
+from Menu.stream_async import AsyncStreamGame
 
 pygame.init()
 
@@ -19,7 +20,7 @@ WIDTH, HEIGHT = screen.get_size()
 pygame.display.set_caption("Lobby")
 
 
-streamer: StreamGame | None = None
+streamer: AsyncStreamGame | None = None
 
 # ---------- Fonts & Colours ----------
 TITLE_FONT = pygame.font.SysFont(None, 80)
@@ -39,6 +40,13 @@ START_BTN_W, START_BTN_H = 220, 70
 # ---------- Networking ----------
 DEFAULT_PORT = 9999
 
+# The lobby only redraws and streams when something on it changes. In between it
+# sleeps in pygame.event.wait, waking every LOBBY_POLL seconds to catch new viewers,
+# and re-sends the unchanged screen every LOBBY_KEEPALIVE seconds.
+LOBBY_FPS = 60
+LOBBY_POLL = 0.1
+LOBBY_KEEPALIVE = 1.0
+
 def _get_local_ip():
     ip = "0.0.0.0"
     try:
@@ -72,6 +80,16 @@ def _scan_existing_controllers(connected_map, players_list):
     return added
 
 # ---------- Draw ----------
+def _lobby_state(add_btn, start_btn, players, awaiting_controller):
+    """Everything _draw_lobby depends on; the screen only needs redrawing when it changes."""
+    mouse = pygame.mouse.get_pos()
+    return (
+        tuple(players),
+        awaiting_controller,
+        add_btn.rect.collidepoint(mouse),
+        start_btn.rect.collidepoint(mouse),
+    )
+
 def _draw_lobby(host_ip, host_port, add_btn, start_btn, players, awaiting_controller):
     screen.fill(BLACK)
 
@@ -119,7 +137,7 @@ def lobby_menu_loop(port: int = DEFAULT_PORT):
     host_port = port
 
     if streamer is None:
-        streamer = StreamGame(host=host_ip, port=host_port, max_clients=3, target_fps=60)
+        streamer = AsyncStreamGame(host=host_ip, port=host_port, target_fps=60)
         streamer.start_server()
 
     # Buttons
@@ -156,6 +174,13 @@ def lobby_menu_loop(port: int = DEFAULT_PORT):
 
     clock = pygame.time.Clock()
 
+    # Change tracking: `version` goes up whenever the lobby looks different
+    version = 0
+    drawn_version = -1
+    streamed_version = -1
+    last_state = None
+    last_stream = time.monotonic() - LOBBY_KEEPALIVE   # due: the first pass streams the lobby
+
     # Allow hotplug events to come through
     pygame.event.set_allowed([
         pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN,
@@ -166,7 +191,19 @@ def lobby_menu_loop(port: int = DEFAULT_PORT):
     _scan_existing_controllers(connected_joysticks, players)
 
     while True:
-        for event in pygame.event.get():
+        # Sleep until something happens; a pending frame only waits one frame time
+        now = time.monotonic()
+        timeout = min(LOBBY_POLL, max(0.0, last_stream + LOBBY_KEEPALIVE - now))
+        if streamed_version != version:
+            timeout = min(timeout, 1.0 / LOBBY_FPS)
+        # at least 1 ms: event.wait(0) would block until the next event, keepalive or not
+        events = [pygame.event.wait(max(1, int(timeout * 1000)))] + pygame.event.get()
+
+        for event in events:
+            # Window uncovered or resized: the pixels on screen are gone
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                drawn_version = -1
+
             # Window close
             if event.type == pygame.QUIT:
                 pygame.quit()
@@ -218,12 +255,25 @@ def lobby_menu_loop(port: int = DEFAULT_PORT):
                     del connected_joysticks[iid]
                     # Keep labels stable; do not renumber existing players.
 
-        _draw_lobby(host_ip, host_port, add_player_btn, start_btn, players, awaiting_controller)
+        state = _lobby_state(add_player_btn, start_btn, players, awaiting_controller)
+        if state != last_state:
+            last_state = state
+            version += 1
+
+        if drawn_version != version:
+            _draw_lobby(host_ip, host_port, add_player_btn, start_btn, players, awaiting_controller)
+            drawn_version = version
+            clock.tick(LOBBY_FPS)   # cap redraws while the mouse sweeps over the buttons
 
         if streamer:
-            streamer.stream_surface(screen)
-        
-        clock.tick(60)
+            now = time.monotonic()
+            if (streamed_version != version or now - last_stream >= LOBBY_KEEPALIVE
+                    or streamer.needs_keyframe()):
+                # the keepalive re-sends the unchanged screen so the viewer's picture and
+                # the periodic keyframe stay fresh; new viewers are caught by needs_keyframe
+                if streamer.stream_surface(screen) or streamer.client_count == 0:
+                    streamed_version = version
+                last_stream = now
 
 # Standalone test
 if __name__ == "__main__":
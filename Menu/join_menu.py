@@ -36,15 +36,15 @@ CONNECT_W, CONNECT_H = 220, 70
 def join_menu_loop():
     """
     Join screen:
-    - Two centred text fields (Server IP, Port) stacked vertically.
+    - Three centred text fields (Server IP, Port, Screen) stacked vertically.
     - Connect button bottom-right.
     Returns:
-        ("connect", ip_str, port_str) on connect
+        ("connect", ip_str, port_str, channel_str) on connect
         "back" on ESC
     """
     # Position fields (centred horizontally, stacked)
     ip_field = TextField(
-        x=WIDTH // 2, y=(HEIGHT // 2) - (FIELD_H + GAP//2),
+        x=WIDTH // 2, y=(HEIGHT // 2) - (FIELD_H + GAP),
         width=FIELD_W, height=FIELD_H,
         font=FIELD_FONT,
         text_colour=WHITE,
@@ -57,7 +57,7 @@ def join_menu_loop():
     )
 
     port_field = TextField(
-        x=WIDTH // 2, y=(HEIGHT // 2) + (FIELD_H + GAP//2),
+        x=WIDTH // 2, y=HEIGHT // 2,
         width=FIELD_W, height=FIELD_H,
         font=FIELD_FONT,
         text_colour=WHITE,
@@ -69,6 +69,23 @@ def join_menu_loop():
         # validator=_digits_only,  # digits only
     )
 
+    channel_field = TextField(
+        x=WIDTH // 2, y=(HEIGHT // 2) + (FIELD_H + GAP),
+        width=FIELD_W, height=FIELD_H,
+        font=FIELD_FONT,
+        text_colour=WHITE,
+        bg_colour=FIELD_BG,
+        border_colour=(90, 90, 90),
+        active_border_colour=WHITE,
+        placeholder="Screen (e.g., green)",
+        align="center",
+    )
+    fields = [ip_field, port_field, channel_field]
+
+    def _connect_result():
+        return ("connect", ip_field.get_value().strip(), port_field.get_value().strip(),
+                channel_field.get_value().strip())
+
     connect_btn = Button(
         text="Connect",
         x=WIDTH - MARGIN - CONNECT_W,
@@ -116,42 +133,34 @@ def join_menu_loop():
                 return "back"
 
             if connect_btn.is_clicked(event):
-                return ("connect", ip_field.get_value().strip(), port_field.get_value().strip())
+                return _connect_result()
 
             # Route events to fields
-            submit_ip = ip_field.handle_event(event)
-            submit_port = port_field.handle_event(event)
+            submits = [f.handle_event(event) for f in fields]
 
             # Tab / Shift+Tab focus switch
             if event.type == pygame.KEYDOWN and event.key == pygame.K_TAB:
-                if pygame.key.get_mods() & pygame.KMOD_SHIFT:
-                    # Reverse
-                    if port_field.active:
-                        port_field.active = False; ip_field.active = True
-                    else:
-                        ip_field.active = False; port_field.active = True
-                else:
-                    if ip_field.active:
-                        ip_field.active = False; port_field.active = True
-                    else:
-                        port_field.active = False; ip_field.active = True
-
-            # Enter behaviour: move to next, or connect if on port
-            if submit_ip == "submit":
-                ip_field.active = False
-                port_field.active = True
-            if submit_port == "submit":
-                return ("connect", ip_field.get_value().strip(), port_field.get_value().strip())
-
-            # Clicking the connect button
-            if connect_btn.is_clicked(event):
-                return ("connect", ip_field.get_value().strip(), port_field.get_value().strip())
+                current = next((i for i, f in enumerate(fields) if f.active), 0)
+                step = -1 if pygame.key.get_mods() & pygame.KMOD_SHIFT else 1
+                for f in fields:
+                    f.active = False
+                fields[(current + step) % len(fields)].active = True
+
+            # Enter behaviour: move to next, or connect if on the last field
+            for i, submit in enumerate(submits):
+                if submit != "submit":
+                    continue
+                if i == len(fields) - 1:
+                    return _connect_result()
+                fields[i].active = False
+                fields[i + 1].active = True
+                break
 
             # Clicking outside: focus set by click is handled inside TextField already
 
         # Update blinking carets
-        ip_field.update(dt)
-        port_field.update(dt)
+        for f in fields:
+            f.update(dt)
 
         # --------- Draw ---------
         screen.fill(BLACK)
@@ -160,8 +169,8 @@ def join_menu_loop():
         title_rect = title.get_rect(center=(WIDTH // 2, HEIGHT // 6))
         screen.blit(title, title_rect)
 
-        ip_field.draw(screen)
-        port_field.draw(screen)
+        for f in fields:
+            f.draw(screen)
 
         connect_btn.draw(screen)
         back_btn.draw(screen)
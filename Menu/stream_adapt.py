@@ -0,0 +1,95 @@
+# stream_adapt.py
+# Adaptive quality for StreamGame: trade frame rate, codec quality and resolution
+# for latency when the network can't keep up.
+from typing import List, Tuple
+
+# Steps from best to cheapest: (fps factor, codec quality factor, pixel decimation).
+# Decimation k keeps every k-th pixel in each direction, which suits pixel art and
+# keeps delta encoding a pure view of the captured frame.
+DEFAULT_LADDER: List[Tuple[float, float, int]] = [
+    (1.0, 1.0, 1),
+    (1.0, 0.75, 1),
+    (0.75, 0.6, 1),
+    (0.5, 0.5, 1),
+    (0.5, 0.5, 2),
+    (0.34, 0.35, 2),
+    (0.25, 0.25, 3),
+]
+
+
+class QualityController:
+    """
+    Walks a quality ladder for one stream, driven by its worst subscriber.
+
+    update() steps down (cheaper) as soon as latency goes over `latency_budget`, the
+    viewer starts dropping frames, or the stream sends more bytes per second than the
+    viewer's measured throughput. It only steps back up after latency has stayed well
+    under budget for `recover_after` seconds, and only if the better step is expected to
+    fit in `headroom` of that throughput, so it doesn't oscillate on a noisy link.
+    """
+
+    def __init__(self, latency_budget: float, ladder: List[Tuple[float, float, int]] | None = None,
+                 degrade_cooldown: float = 0.5, recover_after: float = 3.0, headroom: float = 0.8):
+        self.latency_budget = float(latency_budget)
+        self.ladder = ladder or DEFAULT_LADDER
+        self.degrade_cooldown = degrade_cooldown
+        self.recover_after = recover_after
+        self.headroom = headroom
+        self.step = 0
+        self._last_change = 0.0
+        self._good_since: float | None = None
+
+    @property
+    def fps_scale(self) -> float:
+        return self.ladder[self.step][0]
+
+    @property
+    def quality_scale(self) -> float:
+        return self.ladder[self.step][1]
+
+    @property
+    def decimation(self) -> int:
+        return self.ladder[self.step][2]
+
+    def cost(self, step: int) -> float:
+        """Rough bytes per second of `step` relative to step 0: frame rate times pixels."""
+        fps, _, decimation = self.ladder[step]
+        return fps / (decimation * decimation)
+
+    def update(self, latency: float, dropping: bool, now: float, byte_rate: float = 0.0,
+               throughput: float = 0.0) -> bool:
+        """
+        Feed the latest measurements: `byte_rate` is what the stream sends and `throughput`
+        what the slowest viewer takes, in bytes/second (0 while not measured yet).
+        Returns True if the step changed.
+        """
+        # down past the measured link rate, back up only with headroom to spare: a step
+        # that lands between the two stays put
+        saturated = bool(byte_rate and throughput) and byte_rate > throughput
+        capacity = throughput * self.headroom
+        if latency > self.latency_budget or dropping or saturated:
+            self._good_since = None
+            if self.step < len(self.ladder) - 1 and now - self._last_change >= self.degrade_cooldown:
+                self.step += 1
+                self._last_change = now
+                return True
+            return False
+
+        if latency < self.latency_budget * 0.4:
+            if self._good_since is None:
+                self._good_since = now
+            elif (self.step > 0 and now - self._good_since >= self.recover_after
+                  and self._fits(self.step - 1, byte_rate, capacity)):
+                self.step -= 1
+                self._last_change = now
+                self._good_since = now
+                return True
+        else:
+            self._good_since = None
+        return False
+
+    def _fits(self, step: int, byte_rate: float, capacity: float) -> bool:
+        """Would `step` stay within `capacity`, scaling today's byte rate by the cost ratio?"""
+        if not (byte_rate and capacity):
+            return True
+        return byte_rate * self.cost(step) / self.cost(self.step) <= capacity
@@ -0,0 +1,205 @@
+# stream_async.py
+# AsyncStreamGame: StreamGame with every viewer connection served from one asyncio loop.
+import asyncio
+import threading
+import time
+
+from Menu.stream_game import StreamGame, _ClientConn, limit_unsent
+from Menu.stream_protocol import encode_msg, read_msg
+
+
+class _AsyncClientConn(_ClientConn):
+    """
+    A _ClientConn driven by coroutines on the server's event loop instead of two threads.
+    offer() still runs on the dispatcher thread and wakes the writer through the loop.
+    Flow control is StreamWriter.drain(): a slow viewer parks its writer on a full
+    socket buffer, and its bounded queue overflows exactly as with the threaded server.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 loop: asyncio.AbstractEventLoop, max_queue: int, default_channel: str,
+                 on_hello, udp_transport: asyncio.DatagramTransport | None = None,
+                 allow_shm: bool = False):
+        self._stream_reader = reader
+        self._stream_writer = writer
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._done = threading.Event()
+        # a DatagramTransport has the same sendto(data, addr) as a socket
+        super().__init__(None, writer.get_extra_info("peername"), max_queue, default_channel,
+                         on_hello, udp_transport, allow_shm)
+
+    def _start(self) -> None:
+        pass   # the server's connection handler awaits run()
+
+    def _local_address(self) -> str | None:
+        try:
+            return self._stream_writer.get_extra_info("sockname")[0]
+        except Exception:
+            return None
+
+    def _wake(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass   # loop already closed
+
+    def close(self) -> None:
+        self._mark_dead()
+        try:
+            self._loop.call_soon_threadsafe(self._stream_writer.close)
+        except RuntimeError:
+            pass
+
+    def join(self, timeout: float) -> None:
+        self._done.wait(timeout)
+
+    async def run(self) -> None:
+        try:
+            try:
+                hello = await asyncio.wait_for(read_msg(self._stream_reader), 5.0)
+                self._apply_hello(hello)
+                self._stream_writer.write(encode_msg(self._on_hello(self)))
+                await self._stream_writer.drain()
+            except Exception:
+                return
+            reader = asyncio.ensure_future(self._read_loop())
+            try:
+                await self._write_loop()
+            except Exception:
+                pass
+            finally:
+                reader.cancel()
+        finally:
+            self._mark_dead()
+            self._stream_writer.close()
+            self._release_shm()
+            self._done.set()
+
+    async def _read_loop(self) -> None:
+        while self.alive:
+            try:
+                msg = await read_msg(self._stream_reader)
+            except Exception:
+                break
+            self._handle_msg(msg)
+        self._mark_dead()
+
+    async def _write_loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self.alive:
+                    return
+                item = self._next_packet()
+            if item is None:
+                # offer() appends before it schedules the set(), so nothing slips in here
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            packet, queued_at = item
+            started = time.monotonic()
+            if self.transport == "udp":
+                self._send_udp(packet)
+            else:
+                self._stream_writer.write(self._shm_notice(packet) if self.transport == "shm" else packet)
+                await self._stream_writer.drain()
+            self._record_sent(packet, queued_at, started)
+
+
+class AsyncStreamGame(StreamGame):
+    """
+    Drop-in StreamGame for many viewers: same start_server() / stream_surface() /
+    stream_world() / stop_server(), but instead of an accept thread plus a writer and a
+    reader thread per viewer, every connection lives on one asyncio loop running in a
+    background thread. Dozens of viewers cost a few coroutines each, not threads.
+
+    The game loop stays synchronous: stream_surface() snapshots and queues the frame
+    exactly as before, the encode pool and dispatcher are shared with StreamGame, and
+    the dispatcher hands finished packets to the connections thread-safely.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 9999, max_clients: int = 64, **kwargs):
+        super().__init__(host=host, port=port, max_clients=max_clients, **kwargs)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: threading.Thread | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._udp_transport: asyncio.DatagramTransport | None = None
+
+    # ---- lifecycle ----
+    def start_server(self) -> None:
+        if self._loop is not None:
+            return
+        self._stop_flag.clear()
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        self._loop_thread = threading.Thread(target=self._run_loop, args=(loop,), name="StreamGameLoop", daemon=True)
+        self._loop_thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._open(), loop).result(timeout=5.0)
+        except Exception:
+            self.stop_server()
+            raise
+        self._open_multicast()
+        self._open_metrics()
+        self._start_pipeline()
+
+    def stop_server(self) -> None:
+        self._stop_flag.set()
+        loop = self._loop
+        if loop is None:
+            return
+        self._stop_pipeline()
+        self.stop_recording()
+        self._close_clients()
+        self._close_multicast()
+        self._close_metrics()
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result(timeout=2.0)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        if self._loop_thread and self._loop_thread.is_alive():
+            self._loop_thread.join(timeout=2.0)
+        self._loop_thread = None
+        self._loop = None
+
+    # ---- internals ----
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        finally:
+            loop.close()
+
+    async def _open(self) -> None:
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port,
+                                                  backlog=self.max_clients, reuse_address=True)
+        u = self._bind_udp()
+        if u is not None:
+            self._udp_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                asyncio.DatagramProtocol, sock=u)
+
+    async def _close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+            self._udp_transport = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        with self._clients_lock:
+            if len(self._clients) >= self.max_clients or self._stop_flag.is_set():
+                writer.close()
+                return
+            limit_unsent(writer.get_extra_info("socket"))
+            client = self._track(_AsyncClientConn(reader, writer, asyncio.get_running_loop(), self.send_queue,
+                                                  self.default_channel, self._hello_reply, self._udp_transport,
+                                                  self.allow_shm))
+            self._clients.append(client)
+        await client.run()
@@ -0,0 +1,120 @@
+# stream_clock.py
+# Presentation sync across screens: frames carry the host's monotonic time and game tick
+# (see stream_protocol), viewers estimate the host clock with ping / pong round trips and
+# show every frame `present_delay` after the host rendered it.
+import struct
+import time
+from bisect import insort
+from collections import deque
+from typing import Any, List, Tuple
+
+from Menu.stream_protocol import _HEADER_FMT, FRAME_PONG
+
+MSG_PING = "ping"      # viewer -> host {"type": "ping", "t": viewer microseconds}; answered by FRAME_PONG
+_PONG_FMT = "!Q"       # FRAME_PONG payload: the ping's "t", echoed (host time is in the header)
+
+
+def now_us() -> int:
+    """This machine's monotonic clock in microseconds (shared by every process on it)."""
+    return time.monotonic_ns() // 1000
+
+
+def pack_pong(sent_us: int, host_us: int) -> bytes:
+    payload = struct.pack(_PONG_FMT, sent_us & 0xFFFFFFFFFFFFFFFF)
+    return struct.pack(_HEADER_FMT, FRAME_PONG, 0, 0, 0, len(payload), host_us, 0) + payload
+
+
+def unpack_pong(payload: bytes) -> int:
+    return struct.unpack_from(_PONG_FMT, payload)[0]
+
+
+class ClockSync:
+    """
+    Viewer-side estimate of (host clock - local clock).
+
+    Each pong gives offset = host_time - (sent + received) / 2, which is off by at most half
+    the round trip's asymmetry, e.g. the pong waiting behind a frame in the host's send
+    queue. Of the last `window` samples the one with the shortest round trip is trusted:
+    it is the one that waited least on either side. Pings go out `burst` times in quick
+    succession after connecting, then every `interval` seconds to follow drift.
+    """
+
+    def __init__(self, window: int = 16, burst: int = 8, burst_interval: float = 0.05,
+                 interval: float = 1.0, min_samples: int = 3):
+        self.burst = burst
+        self.burst_interval = burst_interval
+        self.interval = interval
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)   # (rtt_us, offset_us)
+        self._pings = 0
+        self._next_ping = 0
+
+    @property
+    def synced(self) -> bool:
+        return len(self._samples) >= self.min_samples
+
+    @property
+    def offset_us(self) -> int:
+        return min(self._samples)[1] if self._samples else 0
+
+    @property
+    def rtt_us(self) -> int:
+        return min(self._samples)[0] if self._samples else 0
+
+    def ping(self, now: int) -> dict | None:
+        """The ping message to send at local time `now` (now_us()), or None if not due."""
+        if now < self._next_ping:
+            return None
+        self._pings += 1
+        gap = self.burst_interval if self._pings < self.burst else self.interval
+        self._next_ping = now + int(gap * 1_000_000)
+        return {"type": MSG_PING, "t": now}
+
+    def on_pong(self, sent_us: int, host_us: int, now: int) -> None:
+        rtt = now - sent_us
+        if rtt < 0 or rtt > 5_000_000:
+            return   # not one of ours, or hopelessly stale
+        self._samples.append((rtt, host_us - (sent_us + now) // 2))
+
+    def local_time(self, host_us: int) -> float:
+        """Host timestamp -> this machine's time.monotonic()."""
+        return (host_us - self.offset_us) / 1_000_000
+
+
+class PresentQueue:
+    """
+    Frames waiting for their presentation time (time.monotonic()). take() returns the
+    newest frame that is due and discards the older due ones: a screen that fell behind
+    catches up instead of replaying the backlog.
+    """
+
+    def __init__(self, max_frames: int = 32):
+        self.max_frames = max_frames
+        self._items: List[Tuple[float, int, Any]] = []
+        self._count = 0   # tie-breaker: equal times keep arrival order
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, at: float, item) -> None:
+        self._count += 1
+        insort(self._items, (at, self._count, item))
+        if len(self._items) > self.max_frames:
+            del self._items[0]
+
+    def next_due(self) -> float | None:
+        return self._items[0][0] if self._items else None
+
+    def take(self, now: float, slack: float = 0.0):
+        """The newest item due by `now` (+ `slack`), or None."""
+        due = 0
+        while due < len(self._items) and self._items[due][0] <= now + slack:
+            due += 1
+        if not due:
+            return None
+        item = self._items[due - 1][2]
+        del self._items[:due]
+        return item
+
+    def clear(self) -> None:
+        self._items = []
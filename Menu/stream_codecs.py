@@ -0,0 +1,499 @@
+# stream_codecs.py
+# Frame codecs StreamGame and the viewer can agree on at connect time.
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+from Menu.stream_protocol import _TILE_FMT, iter_tiles
+
+try:
+    import cv2   # optional: PNG / JPEG / WebP
+except ImportError:
+    cv2 = None
+
+# codec ids as carried in every frame header
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_PNG = 2
+CODEC_JPEG = 3
+CODEC_WEBP = 4
+CODEC_PALETTE = 5
+CODEC_YUV420 = 6
+
+DEFAULT_CODEC = "zlib"   # every viewer can decode this one
+
+# Banded zlib: a big buffer is cut into byte ranges deflated side by side (zlib drops the
+# GIL while it works), and the payload starts with a table of band lengths:
+#   0x00, count:uint8, count x length:uint32, then the zlib streams back to back.
+# A plain zlib stream never starts with 0x00 (its low nibble is always 8, "deflate"),
+# so small payloads stay a single ordinary stream.
+_BAND_MARK = 0
+_BAND_FMT = "!BB"
+MIN_BAND_BYTES = 256 * 1024   # below this a band isn't worth a thread hop
+
+ZDICT_SIZE = 32 * 1024   # deflate's window: preset dictionary bytes beyond this are never used
+
+_band_pool: ThreadPoolExecutor | None = None
+_band_pool_lock = threading.Lock()
+
+
+def _bands() -> ThreadPoolExecutor:
+    """Process-wide pool the zlib bands run on (host encoders and the viewer share nothing else)."""
+    global _band_pool
+    with _band_pool_lock:
+        if _band_pool is None:
+            _band_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1),
+                                            thread_name_prefix="StreamCodecBand")
+        return _band_pool
+
+
+class RawCodec:
+    """Uncompressed RGB bytes. Cheapest on loopback, where bandwidth is free."""
+
+    name = "raw"
+    codec_id = CODEC_RAW
+    byte_stream = True   # works on arbitrary byte blobs, so tile frames can use it
+    stateful = False     # encodes don't depend on each other, so they may run in any order
+
+    def compress(self, data) -> bytes:
+        return bytes(data)
+
+    def set_quality_scale(self, scale: float) -> None:
+        pass
+
+    def decompress(self, payload: bytes) -> bytes:
+        return payload
+
+
+class ZlibCodec:
+    """zlib over RGB bytes (or a tile blob). Lossless, moderate CPU."""
+
+    name = "zlib"
+    codec_id = CODEC_ZLIB
+    byte_stream = True
+    stateful = False
+
+    def __init__(self, level: int = 3, threads: int | None = None):
+        # lvl 3 - good balance between speed and size
+        self.base_level = self.level = max(0, min(9, int(level)))
+        # most bands one buffer is split into; default: one per core, up to 8
+        self.threads = max(1, int(threads if threads is not None else min(8, os.cpu_count() or 1)))
+        # preset dictionary (see StreamGame's zdict): both ends must hold the same bytes
+        self.zdict: bytes | None = None
+
+    def set_zdict(self, zdict: bytes | None) -> None:
+        self.zdict = zdict[-ZDICT_SIZE:] if zdict else None
+
+    def compress(self, data) -> bytes:
+        return self._deflate(data)
+
+    def set_quality_scale(self, scale: float) -> None:
+        # lossless, so "lower quality" means spending more CPU for fewer bytes (capped at 6)
+        top = max(self.base_level, 6)
+        self.level = self.base_level + round((1.0 - scale) * (top - self.base_level))
+
+    def decompress(self, payload: bytes) -> bytes:
+        return self._inflate(payload)
+
+    def _deflate(self, data) -> bytes:
+        view = memoryview(data).cast("B")
+        bands = min(self.threads, len(view) // MIN_BAND_BYTES)
+        if bands < 2:
+            return self._deflate_one(view, self.level)
+        step = -(-len(view) // bands)
+        level = self.level
+        parts = list(_bands().map(lambda off: self._deflate_one(view[off:off + step], level),
+                                  range(0, len(view), step)))
+        table = struct.pack(_BAND_FMT, _BAND_MARK, len(parts))
+        table += struct.pack(f"!{len(parts)}I", *(len(p) for p in parts))
+        return table + b"".join(parts)
+
+    def _inflate(self, payload: bytes) -> bytes:
+        if not payload or payload[0] != _BAND_MARK:
+            return self._inflate_one(payload)
+        _, count = struct.unpack_from(_BAND_FMT, payload)
+        off = struct.calcsize(_BAND_FMT)
+        lengths = struct.unpack_from(f"!{count}I", payload, off)
+        off += 4 * count
+        view = memoryview(payload)
+        bands = []
+        for n in lengths:
+            bands.append(view[off:off + n])
+            off += n
+        return b"".join(_bands().map(self._inflate_one, bands))
+
+    def _deflate_one(self, data, level: int) -> bytes:
+        if self.zdict is None:
+            return zlib.compress(data, level=level)
+        c = zlib.compressobj(level, zdict=self.zdict)
+        return c.compress(data) + c.flush()
+
+    def _inflate_one(self, data) -> bytes:
+        if self.zdict is None:
+            return zlib.decompress(data)
+        d = zlib.decompressobj(zdict=self.zdict)
+        return d.decompress(data) + d.flush()
+
+
+# palette payload prefix: mode flags, palette epoch, first slot updated, slots updated
+_PAL_FMT = "!BBHH"
+_PAL_SIZE = struct.calcsize(_PAL_FMT)
+_PAL_RGB = 1     # body is plain RGB (the frame had more colours than the palette holds)
+_PAL_TILES = 2   # body is a tile blob rather than a whole frame
+PALETTE_SIZE = 256
+
+
+class PaletteCodec(ZlibCodec):
+    """
+    zlib over 8-bit palette indices instead of RGB, a third of the bytes before zlib
+    even runs. Tile art only has a few dozen colours, so the palette is built up per
+    stream as colours appear and then reused; each frame carries just the slots it added.
+
+    A full frame carries the whole palette, and when a full frame no longer fits it
+    starts a new palette (epoch). A frame with more colours than PALETTE_SIZE goes out as
+    RGB. The decoder keeps the palette between frames and returns None, like a broken
+    tile chain, for a frame using a slot it never received; the viewer then asks for a
+    keyframe.
+    """
+
+    name = "palette"
+    codec_id = CODEC_PALETTE
+    stateful = True   # each frame builds on the palette the frames before it set up
+
+    def __init__(self, level: int = 3, threads: int | None = None):
+        super().__init__(level, threads)
+        self._lock = threading.Lock()   # encodes run on pool workers (in order, see `stateful`)
+        self._epoch = 0
+        self._colors = np.empty(0, dtype=np.uint32)   # 0xRRGGBB per slot, in slot order
+        self._sorted = np.empty(0, dtype=np.uint32)   # the same keys sorted, for searchsorted
+        self._slots = np.empty(0, dtype=np.uint8)     # slot of each sorted key
+        # decoder state
+        self._palette = np.zeros((PALETTE_SIZE, 3), dtype=np.uint8)
+        self._known = np.zeros(PALETTE_SIZE, dtype=bool)
+
+    def set_zdict(self, zdict: bytes | None) -> None:
+        """
+        `zdict` is RGB pixels, but this codec deflates indices: the dictionary becomes the
+        same pixels as indices into their own colours, which also seed the first palette.
+        Encoder and decoder derive the identical bytes from the identical RGB.
+        """
+        if not zdict:
+            super().set_zdict(None)
+            return
+        px = np.frombuffer(zdict, dtype=np.uint8)[:len(zdict) // 3 * 3].reshape(-1, 3)
+        keys = (px[:, 0].astype(np.uint32) << 16) | (px[:, 1].astype(np.uint32) << 8) | px[:, 2]
+        colors = np.unique(keys)
+        if len(colors) > PALETTE_SIZE:
+            super().set_zdict(None)   # too colourful to index; frames will mostly go RGB anyway
+            return
+        with self._lock:
+            if not len(self._colors):
+                self._set_colors(colors)
+        super().set_zdict(np.searchsorted(colors, keys).astype(np.uint8).tobytes())
+
+    # ---- encoder ----
+    def compress(self, frame) -> bytes:
+        pixels = frame.reshape(-1, 3)
+        with self._lock:
+            idx = self._lookup(pixels)
+            if idx is None:
+                # the scene moved on to other colours: start over from this frame's
+                self._epoch = (self._epoch + 1) & 0xFF
+                self._set_colors(np.empty(0, dtype=np.uint32))
+                idx = self._lookup(pixels)
+            if idx is None:
+                return self._pack(_PAL_RGB, 0, 0, frame)
+            return self._pack(0, 0, len(self._colors), idx)
+
+    def compress_tiles(self, frame: np.ndarray, rects) -> bytes:
+        """Tile frame: the changed tiles' indices, with pack_tiles() layout but one byte per pixel."""
+        blocks = [frame[y:y + h, x:x + w].reshape(-1, 3) for x, y, w, h in rects]
+        pixels = np.concatenate(blocks) if blocks else np.empty((0, 3), dtype=np.uint8)
+        with self._lock:
+            first = len(self._colors)
+            idx = self._lookup(pixels)
+            if idx is None:
+                rgb = []
+                for x, y, w, h in rects:
+                    rgb.append(struct.pack(_TILE_FMT, x, y, w, h))
+                    rgb.append(frame[y:y + h, x:x + w].tobytes())
+                return self._pack(_PAL_RGB | _PAL_TILES, 0, 0, b"".join(rgb))
+            parts = []
+            off = 0
+            for x, y, w, h in rects:
+                parts.append(struct.pack(_TILE_FMT, x, y, w, h))
+                parts.append(idx[off:off + w * h].tobytes())
+                off += w * h
+            return self._pack(_PAL_TILES, first, len(self._colors) - first, b"".join(parts))
+
+    def _lookup(self, pixels: np.ndarray) -> np.ndarray | None:
+        """Slot of every (n, 3) pixel, adding new colours; None if they don't all fit."""
+        keys = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+        pos, hit = self._find(keys)
+        if not hit.all():
+            missing = keys[~hit]
+            room = PALETTE_SIZE - len(self._colors)
+            # a strided sample already over the limit settles it without hashing a noisy frame
+            if len(np.unique(missing[::max(1, len(missing) // 4096)])) > room:
+                return None
+            new = np.unique(missing)
+            if len(new) > room:
+                return None
+            self._set_colors(np.concatenate([self._colors, new]))
+            pos, _ = self._find(keys)
+        return self._slots[pos]
+
+    def _find(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if not len(self._sorted):
+            return np.zeros(len(keys), dtype=np.intp), np.zeros(len(keys), dtype=bool)
+        pos = np.minimum(np.searchsorted(self._sorted, keys), len(self._sorted) - 1)
+        return pos, self._sorted[pos] == keys
+
+    def _set_colors(self, colors: np.ndarray) -> None:
+        self._colors = colors
+        order = np.argsort(colors, kind="stable")
+        self._sorted = colors[order]
+        self._slots = order.astype(np.uint8)
+
+    def _pack(self, mode: int, start: int, count: int, body) -> bytes:
+        c = self._colors[start:start + count]
+        rgb = np.stack([(c >> 16) & 0xFF, (c >> 8) & 0xFF, c & 0xFF], axis=1).astype(np.uint8)
+        head = struct.pack(_PAL_FMT, mode, self._epoch, start, count) + rgb.tobytes()
+        body = body.tobytes() if isinstance(body, np.ndarray) else body
+        return self._deflate(head + body)
+
+    # ---- decoder ----
+    def decompress(self, payload: bytes) -> bytes | None:
+        """RGB bytes (full frame) or an RGB pack_tiles() blob, as ZlibCodec returns them."""
+        data = self._inflate(payload)
+        mode, epoch, start, count = struct.unpack_from(_PAL_FMT, data)
+        body = memoryview(data)[_PAL_SIZE + 3 * count:]
+        if not mode & _PAL_TILES:
+            if epoch != self._epoch:
+                self._epoch = epoch
+                self._known[:] = False
+        elif epoch != self._epoch and not mode & _PAL_RGB:
+            return None   # tiles indexed into a palette we no longer have
+        if count:
+            rgb = np.frombuffer(data, dtype=np.uint8, count=3 * count, offset=_PAL_SIZE)
+            self._palette[start:start + count] = rgb.reshape(count, 3)
+            self._known[start:start + count] = True
+        if mode & _PAL_RGB:
+            return bytes(body)
+        if not mode & _PAL_TILES:
+            idx = np.frombuffer(body, dtype=np.uint8)
+            return self._palette[idx].tobytes() if self._known[idx].all() else None
+        parts = []
+        for x, y, w, h, tile in iter_tiles(body, channels=1):
+            idx = np.frombuffer(tile, dtype=np.uint8)
+            if not self._known[idx].all():
+                return None
+            parts.append(struct.pack(_TILE_FMT, x, y, w, h))
+            parts.append(self._palette[idx].tobytes())
+        return b"".join(parts)
+
+
+# YUV payload prefix: mode flags, then width and height of a full frame (0 for tiles)
+_YUV_FMT = "!BHH"
+_YUV_SIZE = struct.calcsize(_YUV_FMT)
+_YUV_TILES = 1
+
+# full-range BT.601 (JPEG), the same YCrCb cv2 uses; rows give Y, Cr, Cb
+_RGB2YCC = np.array([[0.299, 0.587, 0.114],
+                     [0.5, -0.418688, -0.081312],
+                     [-0.168736, -0.331264, 0.5]], dtype=np.float32)
+_YCC2RGB = np.array([[1.0, 1.402, 0.0],
+                     [1.0, -0.714136, -0.344136],
+                     [1.0, 0.0, 1.772]], dtype=np.float32)
+
+
+def _to_planes(rgb: np.ndarray) -> bytes:
+    """(h, w, 3) RGB -> Y plane, then Cb and Cr at half resolution (odd edges rounded up)."""
+    h, w = rgb.shape[:2]
+    if cv2 is not None:
+        y, cr, cb = cv2.split(cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2YCrCb))
+    else:
+        ycc = rgb.reshape(-1, 3).astype(np.float32) @ _RGB2YCC.T
+        ycc[:, 1:] += 128.0
+        ycc = np.clip(ycc + 0.5, 0, 255).astype(np.uint8).reshape(h, w, 3)
+        y, cr, cb = (np.ascontiguousarray(ycc[:, :, i]) for i in range(3))
+    return b"".join((y.tobytes(), _half(cb).tobytes(), _half(cr).tobytes()))
+
+
+def _half(plane: np.ndarray) -> np.ndarray:
+    """Average each 2x2 block of a chroma plane: 4:2:0."""
+    h, w = plane.shape
+    if h % 2 or w % 2:
+        plane = np.pad(plane, ((0, h % 2), (0, w % 2)), mode="edge")
+    rows = plane[0::2].astype(np.uint16)
+    rows += plane[1::2]
+    block = rows[:, 0::2] + rows[:, 1::2]
+    block += 2
+    block >>= 2
+    return block.astype(np.uint8)
+
+
+def _planes_size(w: int, h: int) -> int:
+    return w * h + 2 * ((w + 1) // 2) * ((h + 1) // 2)
+
+
+def _from_planes(data, w: int, h: int) -> bytes:
+    """Inverse of _to_planes: RGB bytes of the (w, h) picture."""
+    ch, cw = (h + 1) // 2, (w + 1) // 2
+    planes = np.frombuffer(data, dtype=np.uint8, count=_planes_size(w, h))
+    y = planes[:w * h].reshape(h, w)
+    cb = planes[w * h:w * h + ch * cw].reshape(ch, cw)
+    cr = planes[w * h + ch * cw:].reshape(ch, cw)
+    # nearest, not bilinear: tile art has hard edges, and a block's colour stays in the block
+    if cv2 is not None:
+        up = cv2.resize(np.dstack([cr, cb]), (cw * 2, ch * 2), interpolation=cv2.INTER_NEAREST)
+        ycc = np.dstack([y, up[:h, :w]])
+        return cv2.cvtColor(ycc, cv2.COLOR_YCrCb2RGB).tobytes()
+    up = np.dstack([cr, cb]).repeat(2, axis=0).repeat(2, axis=1)[:h, :w]
+    ycc = np.dstack([y, up]).reshape(-1, 3).astype(np.float32)
+    ycc[:, 1:] -= 128.0
+    return np.clip(ycc @ _YCC2RGB.T + 0.5, 0, 255).astype(np.uint8).tobytes()
+
+
+class Yuv420Codec(ZlibCodec):
+    """
+    Frames as YUV 4:2:0 planes, deflated: full-resolution luma plus one chroma sample per
+    2x2 block, 1.5 bytes a pixel instead of 3. Lossy (colour edges soften), so it suits
+    the game's world channels rather than the text-heavy lobby; pick it per channel with
+    StreamGame.set_codec(). Keep tile_size even so tiles stay on the chroma grid.
+    """
+
+    name = "yuv420"
+    codec_id = CODEC_YUV420
+
+    def set_zdict(self, zdict: bytes | None) -> None:
+        super().set_zdict(None)   # RGB rows never occur in the planes
+
+    def compress(self, frame) -> bytes:
+        h, w = frame.shape[:2]
+        return self._deflate(struct.pack(_YUV_FMT, 0, w, h) + _to_planes(frame))
+
+    def compress_tiles(self, frame: np.ndarray, rects) -> bytes:
+        parts = [struct.pack(_YUV_FMT, _YUV_TILES, 0, 0)]
+        for x, y, w, h in rects:
+            parts.append(struct.pack(_TILE_FMT, x, y, w, h))
+            parts.append(_to_planes(frame[y:y + h, x:x + w]))
+        return self._deflate(b"".join(parts))
+
+    def decompress(self, payload: bytes) -> bytes:
+        """RGB bytes (full frame) or an RGB pack_tiles() blob, as ZlibCodec returns them."""
+        data = memoryview(self._inflate(payload))
+        mode, w, h = struct.unpack_from(_YUV_FMT, data)
+        if not mode & _YUV_TILES:
+            return _from_planes(data[_YUV_SIZE:], w, h)
+        parts = []
+        off = _YUV_SIZE
+        while off < len(data):
+            x, y, w, h = struct.unpack_from(_TILE_FMT, data, off)
+            off += struct.calcsize(_TILE_FMT)
+            parts.append(struct.pack(_TILE_FMT, x, y, w, h))
+            parts.append(_from_planes(data[off:], w, h))
+            off += _planes_size(w, h)
+        return b"".join(parts)
+
+
+class ImageCodec:
+    """
+    Whole-frame image formats through cv2.imencode / imdecode.
+    These only ever carry full frames; `quality` is JPEG/WebP quality (1-100)
+    or PNG compression (0-9).
+    """
+
+    byte_stream = False
+    stateful = False
+
+    _FORMATS = {
+        "png": (CODEC_PNG, ".png", "IMWRITE_PNG_COMPRESSION", 3),
+        "jpeg": (CODEC_JPEG, ".jpg", "IMWRITE_JPEG_QUALITY", 80),
+        "webp": (CODEC_WEBP, ".webp", "IMWRITE_WEBP_QUALITY", 80),
+    }
+
+    def __init__(self, name: str, quality: int | None = None):
+        if cv2 is None:
+            raise RuntimeError(f"Codec '{name}' needs opencv-python (cv2).")
+        self.name = name
+        self.codec_id, self._ext, flag, default = self._FORMATS[name]
+        self.base_quality = self.quality = default if quality is None else int(quality)
+        self._flag = getattr(cv2, flag)
+        self._params = [self._flag, self.quality]
+
+    def set_quality_scale(self, scale: float) -> None:
+        if self.codec_id == CODEC_PNG:
+            self.quality = self.base_quality + round((1.0 - scale) * (9 - self.base_quality))
+        else:
+            self.quality = max(15, round(self.base_quality * scale))
+        self._params = [self._flag, self.quality]
+
+    def encode_image(self, frame: np.ndarray) -> bytes:
+        ok, buf = cv2.imencode(self._ext, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR), self._params)
+        if not ok:
+            raise ValueError(f"cv2.imencode failed for {self.name}")
+        return buf.tobytes()
+
+    def decode_image(self, payload: bytes) -> np.ndarray:
+        bgr = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            raise ValueError(f"cv2.imdecode failed for {self.name}")
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+
+def available_codecs() -> List[str]:
+    """Names this process can both encode and decode."""
+    names = ["raw", "zlib", "palette", "yuv420"]
+    if cv2 is not None:
+        names += list(ImageCodec._FORMATS)
+    return names
+
+
+def make_codec(name: str, **params):
+    """make_codec("zlib", level=6), make_codec("jpeg", quality=70), ..."""
+    if name == "raw":
+        return RawCodec()
+    if name == "zlib":
+        return ZlibCodec(**params)
+    if name == "palette":
+        return PaletteCodec(**params)
+    if name == "yuv420":
+        return Yuv420Codec(**params)
+    if name in ImageCodec._FORMATS:
+        return ImageCodec(name, **params)
+    raise ValueError(f"Unknown stream codec: {name}")
+
+
+# one decoder per wire id; compression level / quality never matter when decoding.
+# The palette decoder keeps its palette here too, which is fine for one stream per viewer.
+_DECODERS: Dict[int, object] = {}
+_ZDICT: bytes | None = None
+
+
+def use_zdict(zdict: bytes | None) -> None:
+    """Viewer side: the preset dictionary the host sent in its hello reply (None: none)."""
+    global _ZDICT
+    _ZDICT = zdict
+    for dec in _DECODERS.values():
+        if hasattr(dec, "set_zdict"):
+            dec.set_zdict(zdict)
+
+
+def decoder_for(codec_id: int):
+    dec = _DECODERS.get(codec_id)
+    if dec is None:
+        for name in available_codecs():
+            codec = make_codec(name)
+            if hasattr(codec, "set_zdict"):
+                codec.set_zdict(_ZDICT)
+            _DECODERS[codec.codec_id] = codec
+        dec = _DECODERS.get(codec_id)
+        if dec is None:
+            raise ValueError(f"Unsupported codec id {codec_id}")
+    return dec
@@ -1,16 +1,628 @@
 # stream_game.py
 # Library-only: StreamGame class. No CLI, no viewer.
+import base64
+import ipaddress
+import math
+import queue
 import socket
 import struct
+import sys
 import threading
 import time
-import zlib
-from typing import List
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Set, Tuple
 
+import numpy as np
 import pygame
 
-_HEADER_FMT = "!III"   # width, height, payload_len (u32, network byte order)
-_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
+try:
+    import cv2   # optional: fastest swizzle from 32-bit surfaces
+except ImportError:
+    cv2 = None
+
+from Menu.stream_adapt import QualityController
+from Menu.stream_codecs import (
+    CODEC_RAW, CODEC_ZLIB, DEFAULT_CODEC, ZDICT_SIZE, available_codecs, make_codec,
+)
+from Menu.stream_clock import MSG_PING, now_us, pack_pong
+from Menu.stream_input import MSG_INPUT, InputState, controller_keys
+from Menu.stream_metrics import BYTES_BUCKETS, RATIO_BUCKETS, Histogram, MetricsRegistry, MetricsServer
+from Menu.stream_pacing import FramePacer
+from Menu.stream_protocol import (
+    _HEADER_FMT, _HEADER_SIZE, ALL_CHANNELS, FRAME_ENTITIES, FRAME_FULL, FRAME_PONG, FRAME_SCENE, FRAME_TILES,
+    KEY_FRAMES, MSG_KEYFRAME, dirty_tiles, encode_msg, pack_entities, pack_scene, pack_tiles, parse_rect_channel,
+    recv_msg, send_msg,
+)
+from Menu.stream_record import StreamRecorder
+from Menu.stream_shm import MSG_SHM_FRAME, ShmRing, shm_available
+from Menu.stream_udp import fragment
+
+# (codec name, sorted params) - hashable description of how a stream is encoded
+CodecSpec = Tuple[str, Tuple[Tuple[str, object], ...]]
+
+# a viewer's throughput is only measured while its link is the bottleneck
+THROUGHPUT_WINDOW = 2.0    # seconds of sends each estimate covers
+THROUGHPUT_BUSY = 0.5      # share of the window the writer must have spent blocked in sends
+THROUGHPUT_STALE = 30.0    # forget the estimate after this long without a backlog
+SEND_LOWAT = 32 * 1024     # unsent bytes a viewer's socket may hold; the rest waits in its send queue
+
+
+def build_zdict(samples: List["pygame.Surface"], limit: int = ZDICT_SIZE) -> bytes:
+    """
+    Preset zlib dictionary from pixels that keep turning up in frames (rendered tiles,
+    sprites), most important first. Their RGB rows go in back to front, so the most
+    important end up nearest the data, where deflate reaches them cheapest.
+    """
+    parts = []
+    size = 0
+    for surface in samples:
+        data = pygame.image.tobytes(surface, "RGB")
+        if size + len(data) > limit:
+            data = data[:(limit - size) // 3 * 3]
+        if data:
+            parts.append(data)
+            size += len(data)
+        if size >= limit:
+            break
+    return b"".join(reversed(parts))
+
+
+def limit_unsent(sock: socket.socket) -> None:
+    """
+    Cap the bytes the kernel holds unsent for a viewer at SEND_LOWAT. Left alone, the send
+    buffer grows to megabytes on a slow link: frames then queue where we can't see or drop
+    them, and a send only times a copy. (Linux / macOS; elsewhere a no-op.)
+    """
+    option = getattr(socket, "TCP_NOTSENT_LOWAT", None)
+    if option is None or sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, option, SEND_LOWAT)
+    except OSError:
+        pass
+
+
+def _pass_result(src: Future, dst: Future) -> None:
+    """Settle `dst` the way `src` settled."""
+    if src.cancelled():
+        dst.cancel()
+    elif src.exception() is not None:
+        dst.set_exception(src.exception())
+    else:
+        dst.set_result(src.result())
+
+
+class _ClientConn:
+    """
+    One connected viewer: its socket plus a writer thread draining a small bounded queue.
+    The game thread only calls offer(); a slow viewer loses frames instead of stalling it.
+
+    The writer thread first reads the viewer's hello ({"channel": ..., "codecs": [...]})
+    and answers with `on_hello(client)`; until then the client is not subscribed to anything.
+    After that a reader thread handles the viewer's control messages.
+
+    If the hello asks for {"transport": "udp", "udp_port": n} (and the host has a UDP
+    socket) frames go out as fragmented datagrams to that port instead of over TCP, and
+    the TCP connection only carries control messages.
+
+    {"transport": "shm"} (viewer on the same machine) puts raw frame packets in a
+    shared-memory ring owned by this connection; TCP then carries one short notice per frame.
+    Viewers connecting from another address keep TCP, whatever they ask for.
+    """
+
+    def __init__(self, sock: socket.socket, addr, max_queue: int, default_channel: str,
+                 on_hello: Callable[["_ClientConn"], dict], udp_sock: socket.socket | None = None,
+                 allow_shm: bool = False):
+        self.sock = sock
+        self.addr = addr
+        self.transport = "tcp"   # how frames reach the viewer: "tcp", "udp", "shm" or "multicast"
+        self.requested_transport: str | None = None
+        self.udp_sock = udp_sock
+        self.udp_target: tuple | None = None   # (ip, port) when frames go over UDP
+        self._udp_seq = 0
+        self.allow_shm = allow_shm and shm_available()
+        self._shm: ShmRing | None = None
+        self._shm_seq = 0
+        self.max_queue = max(1, int(max_queue))
+        self.default_channel = default_channel
+        self.channel: str | None = None
+        self.codecs: List[str] = [DEFAULT_CODEC]   # what the viewer says it can decode
+        self.display: tuple[int, int] | None = None   # viewer screen size, if it told us
+        self.mode = "pixels"   # or "scene": the viewer draws the level from scene state itself
+        self.dropped_frames = 0     # lost to backpressure: the send queue was full
+        self.discarded_frames = 0   # left out on purpose: superseded by a keyframe, or tiles with nothing to patch
+        self.alive = True
+        # nothing on screen to patch yet, so tile frames are useless until a full one lands
+        self.needs_full = True
+        self.base_stream = None   # stream of the last full frame queued
+        self.input = InputState()   # what the viewer is holding, fed by its input messages
+        self._on_hello = on_hello
+        self.send_latency_metric: Histogram | None = None   # set by the server that owns us
+
+        # measured by the writer thread
+        self.latency = 0.0      # seconds from enqueue to sendall returning (EMA)
+        self.throughput = 0.0   # bytes/second the link carried while frames were waiting, 0 if unknown
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self._sending_since: float | None = None   # enqueue time of the frame in sendall
+        self._sends = deque()   # (done, bytes, seconds in send) over the last THROUGHPUT_WINDOW
+        self._throughput_at = 0.0
+
+        self._queue = deque()
+        self._tail_absolute = False
+        self._cond = threading.Condition()
+        self._reader: threading.Thread | None = None
+        self._thread: threading.Thread | None = None
+        self._start()
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(target=self._writer_loop, name=f"StreamGameWriter-{self.addr}", daemon=True)
+        self._thread.start()
+
+    @property
+    def name(self) -> str:
+        try:
+            return f"{self.addr[0]}:{self.addr[1]}"
+        except Exception:
+            return str(self.addr)
+
+    def queue_latency(self, now: float) -> float:
+        """Smoothed send latency, or the age of the oldest unsent frame if that is worse."""
+        with self._cond:
+            oldest = self._sending_since
+            if oldest is None and self._queue:
+                oldest = self._queue[0][1]
+        return max(self.latency, now - oldest if oldest is not None else 0.0)
+
+    @property
+    def queue_depth(self) -> int:
+        """Frames waiting to be sent (the one in flight not included)."""
+        with self._cond:
+            return len(self._queue)
+
+    def wants(self, channel: str) -> bool:
+        return self.channel is not None and (channel == ALL_CHANNELS or channel == self.channel)
+
+    def offer(self, stream_key, kind: int, packet: bytes, absolute: bool = False) -> None:
+        """
+        Queue a frame. `absolute` frames (scene entity state) don't depend on each other,
+        only on the keyframe, so when the queue is full the newest one just replaces the
+        one still waiting instead of resetting the chain.
+        """
+        with self._cond:
+            if not self.alive:
+                return
+            if kind in KEY_FRAMES:
+                # a full frame supersedes everything still waiting
+                self.discarded_frames += len(self._queue)
+                self._queue.clear()
+                self.needs_full = False
+                self.base_stream = stream_key
+            elif self.needs_full or stream_key != self.base_stream:
+                # tiles from another stream (channel or codec switch) don't patch our picture
+                self.discarded_frames += 1
+                return
+            elif len(self._queue) >= self.max_queue and absolute:
+                self.dropped_frames += 1
+                if self._tail_absolute:
+                    self._queue[-1] = (packet, self._queue[-1][1])
+                    self._wake()
+                return
+            elif len(self._queue) >= self.max_queue:
+                # losing one tile frame breaks the chain behind it, so drop the whole
+                # backlog and wait for the next full frame
+                self.dropped_frames += len(self._queue) + 1
+                self._queue.clear()
+                self.needs_full = True
+                return
+            self._queue.append((packet, time.monotonic()))
+            self._tail_absolute = absolute
+            self._wake()
+
+    def _wake(self) -> None:
+        """Tell the writer there is work (or that it should stop). Called with _cond held."""
+        self._cond.notify()
+
+    def _mark_dead(self) -> None:
+        with self._cond:
+            self.alive = False
+            self._queue.clear()
+            self._wake()
+        self.input.clear()   # don't leave a key held down after a disconnect
+
+    def close(self) -> None:
+        self._mark_dead()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+    def join(self, timeout: float) -> None:
+        for t in (self._thread, self._reader):
+            if t and t.is_alive() and t is not threading.current_thread():
+                t.join(timeout=timeout)
+
+    def request_full(self) -> None:
+        with self._cond:
+            self.needs_full = True
+
+    def _handshake(self) -> bool:
+        try:
+            self.sock.settimeout(5.0)
+            hello = recv_msg(self.sock)
+            self.sock.settimeout(None)
+        except Exception:
+            return False
+        self._apply_hello(hello)
+        try:
+            send_msg(self.sock, self._on_hello(self))
+        except Exception:
+            return False
+        return True
+
+    def _apply_hello(self, hello: dict) -> None:
+        display = hello.get("display")
+        try:
+            dw, dh = (int(v) for v in display)
+            self.display = (dw, dh) if dw > 0 and dh > 0 else None
+        except (TypeError, ValueError):
+            self.display = None
+        if hello.get("mode") == "scene":
+            self.mode = "scene"
+        codecs = hello.get("codecs")
+        if isinstance(codecs, list):
+            self.codecs = [str(c) for c in codecs] or [DEFAULT_CODEC]
+        transport = self.requested_transport = hello.get("transport")
+        if transport == "udp" and self.udp_sock is not None:
+            try:
+                self.udp_target = (self.addr[0], int(hello["udp_port"]))
+                self.transport = "udp"
+            except (KeyError, TypeError, ValueError):
+                self.udp_target = None
+        elif transport == "shm" and self.allow_shm and self._same_host():
+            self.transport = "shm"
+        channel = str(hello.get("channel") or "").strip()
+        self.channel = channel or self.default_channel
+
+    def _same_host(self) -> bool:
+        """Is the viewer on this machine: loopback, or connected from our own address?"""
+        try:
+            peer = self.addr[0]
+            if ipaddress.ip_address(peer).is_loopback:
+                return True
+        except (TypeError, ValueError, IndexError):
+            return False
+        # a connection to one of our own interfaces comes from that same address
+        return peer == self._local_address()
+
+    def _local_address(self) -> str | None:
+        """Our end of the viewer's connection."""
+        try:
+            return self.sock.getsockname()[0]
+        except Exception:
+            return None
+
+    def _handle_msg(self, msg: dict) -> None:
+        kind = msg.get("type")
+        if kind == MSG_INPUT:
+            # applied as it arrives, so the game loop sees it at its very next tick
+            self.input.apply(msg)
+        elif kind == MSG_KEYFRAME:
+            # e.g. a UDP viewer lost a fragment: its tile chain is broken
+            self.request_full()
+        elif kind == MSG_PING:
+            self._pong(msg.get("t"))
+
+    def _pong(self, sent) -> None:
+        """Answer a clock ping ahead of any queued frames, over the viewer's frame transport."""
+        try:
+            packet = pack_pong(int(sent), now_us())
+        except (TypeError, ValueError):
+            return
+        with self._cond:
+            if not self.alive:
+                return
+            if not self._queue:
+                self._tail_absolute = False   # the pong is the tail now; don't overwrite it
+            self._queue.appendleft((packet, time.monotonic()))
+            self._wake()
+
+    def _reader_loop(self) -> None:
+        while self.alive:
+            try:
+                msg = recv_msg(self.sock)
+            except Exception:
+                break
+            self._handle_msg(msg)
+        self._mark_dead()
+
+    def _send(self, packet: bytes) -> None:
+        if self.transport == "udp":
+            self._send_udp(packet)
+        elif self.transport == "shm":
+            self.sock.sendall(self._shm_notice(packet))
+        else:
+            self.sock.sendall(packet)
+
+    def _send_udp(self, packet: bytes) -> None:
+        for dgram in fragment(self._udp_seq, packet):
+            self.udp_sock.sendto(dgram, self.udp_target)
+        self._udp_seq += 1
+
+    def _shm_notice(self, packet: bytes) -> bytes:
+        """Copy `packet` into this viewer's ring; returns the control message pointing at it."""
+        if self._shm is None or not self._shm.fits(len(packet)):
+            # room for a raw full frame at the frame's width and height, even if a tile frame
+            # opened the ring, plus headroom so small size changes don't reallocate. A pong
+            # sent before any frame carries no size; the first frame replaces its small ring.
+            # (the viewer re-attaches when the notice names a new ring)
+            need = len(packet)
+            kind, _, w, h = struct.unpack_from("!BBII", packet)
+            if kind in (FRAME_FULL, FRAME_TILES):
+                need = max(need, _HEADER_SIZE + w * h * 3)
+            old, self._shm = self._shm, ShmRing.create(need * 5 // 4)
+            if old is not None:
+                old.close()
+        self._shm_seq += 1   # 0 marks a slot being written
+        slot = self._shm.write(self._shm_seq, packet)
+        return encode_msg({"type": MSG_SHM_FRAME, "name": self._shm.name, "slot": slot, "seq": self._shm_seq})
+
+    def _release_shm(self) -> None:
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def _next_packet(self) -> tuple | None:
+        """Pop the oldest queued (packet, queued_at) and mark it in flight. Called with _cond held."""
+        if not self._queue:
+            return None
+        item = self._queue.popleft()
+        self._sending_since = item[1]
+        return item
+
+    def _record_sent(self, packet: bytes, queued_at: float, started: float) -> None:
+        done = time.monotonic()
+        with self._cond:
+            self._sending_since = None
+        if packet[0] == FRAME_PONG:
+            return   # not a frame; its queueing would skew the measurements
+        self.latency += 0.2 * ((done - queued_at) - self.latency)
+        if self.send_latency_metric is not None:
+            self.send_latency_metric.observe(done - queued_at, channel=self.channel, transport=self.transport)
+        self._measure_throughput(len(packet), started, done)
+        self.bytes_sent += len(packet)
+        self.frames_sent += 1
+
+    def _measure_throughput(self, size: int, started: float, done: float) -> None:
+        """
+        Bytes per second over the last THROUGHPUT_WINDOW of wall-clock time, taken only
+        when the writer spent at least THROUGHPUT_BUSY of it blocked in sends: then the link
+        set the pace. A single send just times a copy into the socket buffer.
+        """
+        self._sends.append((done, size, done - started))
+        since = done - THROUGHPUT_WINDOW
+        while self._sends and self._sends[0][0] <= since:
+            self._sends.popleft()
+        busy = sum(min(secs, end - since) for end, _, secs in self._sends)
+        if busy >= THROUGHPUT_BUSY * THROUGHPUT_WINDOW:
+            self.throughput = sum(n for _, n, _ in self._sends) / THROUGHPUT_WINDOW
+            self._throughput_at = done
+        elif self.throughput and done - self._throughput_at > THROUGHPUT_STALE:
+            # no backlog for a long while; let the controller try better steps again
+            self.throughput = 0.0
+
+    def _writer_loop(self) -> None:
+        try:
+            self._write_frames()
+        finally:
+            self._release_shm()
+
+    def _write_frames(self) -> None:
+        if not self._handshake():
+            self._mark_dead()
+            return
+        self._reader = threading.Thread(target=self._reader_loop, name=f"StreamGameReader-{self.addr}", daemon=True)
+        self._reader.start()
+        while True:
+            with self._cond:
+                while self.alive and not self._queue:
+                    self._cond.wait()
+                if not self.alive:
+                    return
+                packet, queued_at = self._next_packet()
+            started = time.monotonic()
+            try:
+                self._send(packet)
+            except Exception:
+                self._mark_dead()
+                return
+            self._record_sent(packet, queued_at, started)
+
+
+class _MulticastGroup(_ClientConn):
+    """
+    Stands in for every multicast viewer of one channel: queued frames are sent once,
+    to the channel's group, however many spectators joined it. Viewers' keyframe
+    requests reach it through StreamGame, which calls request_full().
+    """
+
+    def __init__(self, sock: socket.socket, group: str, port: int, channel: str, max_queue: int):
+        super().__init__(None, (group, port), max_queue, channel, on_hello=None, udp_sock=sock)
+        self.channel = channel
+        self.codecs = available_codecs()   # members were only let in if they decode the channel codec
+        self.transport = "udp"
+        self.udp_target = (group, port)
+
+    def _handshake(self) -> bool:
+        return True   # nobody to greet; viewers did that over their own TCP connections
+
+    def _reader_loop(self) -> None:
+        pass
+
+
+class _CaptureRing:
+    """
+    Copies surface pixels straight into preallocated (h, w, 3) RGB staging buffers,
+    reused round-robin. With `slots` >= max_inflight + 2 the buffer handed out next is
+    never one an encode job or the previous-frame reference is still reading.
+
+    capture() can also resample to a smaller output size (area average with cv2,
+    nearest pixel without), going through one full-size scratch buffer.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = max(2, int(slots))
+        self._bufs: List[np.ndarray] = []
+        self._size: tuple[int, int] | None = None
+        self._next = 0
+        self._scratch: np.ndarray | None = None
+        self._nearest: tuple | None = None   # (src size, out size, row idx, col idx)
+
+    def take(self, size: tuple[int, int]) -> np.ndarray:
+        """The next (h, w, 3) staging buffer for output `size` (w, h)."""
+        if self._size != size:
+            # only (re)allocate when the streamed size changes
+            w, h = size
+            self._bufs = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(self.slots)]
+            self._size = size
+            self._next = 0
+        buf = self._bufs[self._next]
+        self._next = (self._next + 1) % self.slots
+        return buf
+
+    def copy(self, frame: np.ndarray) -> np.ndarray:
+        """Stage a copy of a frame another stream already captured at this size."""
+        buf = self.take((frame.shape[1], frame.shape[0]))
+        np.copyto(buf, frame)
+        return buf
+
+    def capture(self, surface: "pygame.Surface", size: tuple[int, int] | None = None) -> np.ndarray:
+        w, h = surface.get_size()
+        size = size or (w, h)
+        buf = self.take(size)
+        if size == (w, h):
+            return self._grab(surface, buf)
+
+        if self._scratch is None or self._scratch.shape[:2] != (h, w):
+            self._scratch = np.empty((h, w, 3), dtype=np.uint8)
+        full = self._grab(surface, self._scratch)
+        if cv2 is not None:
+            cv2.resize(full, size, dst=buf, interpolation=cv2.INTER_AREA)
+            return buf
+        if self._nearest is None or self._nearest[:2] != ((w, h), size):
+            rows = (np.arange(size[1]) * h // size[1])[:, None]
+            cols = np.arange(size[0]) * w // size[0]
+            self._nearest = ((w, h), size, rows, cols)
+        np.copyto(buf, full[self._nearest[2], self._nearest[3]])
+        return buf
+
+    def _grab(self, surface: "pygame.Surface", buf: np.ndarray) -> np.ndarray:
+        w, h = surface.get_size()
+        if surface.get_bytesize() == 4 and cv2 is not None:
+            code = self._cv2_code(surface)
+            if code is not None:
+                # (w, h) uint32 view honours the pitch of subsurfaces; viewed as (h, w, 4) bytes
+                px = np.asarray(surface.get_view("2")).T
+                cv2.cvtColor(px.view(np.uint8).reshape(h, w, 4), code, dst=buf)
+                return buf
+
+        if surface.get_bytesize() in (3, 4):
+            # strided (w, h, 3) view in R, G, B order whatever the byte layout
+            px = pygame.surfarray.pixels3d(surface).transpose(1, 0, 2)
+            for c in range(3):
+                np.copyto(buf[:, :, c], px[:, :, c])
+            del px   # releases the surface lock
+            return buf
+
+        # 8/16-bit surfaces have no direct RGB view
+        np.copyto(buf, np.frombuffer(pygame.image.tostring(surface, "RGB"), dtype=np.uint8).reshape(h, w, 3))
+        return buf
+
+    @staticmethod
+    def _cv2_code(surface: "pygame.Surface"):
+        if sys.byteorder != "little":
+            return None
+        r, g, b, _ = surface.get_shifts()
+        if (r, g, b) == (16, 8, 0):
+            return cv2.COLOR_BGRA2RGB
+        if (r, g, b) == (0, 8, 16):
+            return cv2.COLOR_RGBA2RGB
+        return None
+
+
+class _Stream:
+    """
+    Encoder state for one channel in one codec at one output size. Encoded once, however
+    many viewers subscribe; a channel only has more than one stream while some viewer
+    can't decode the channel's codec and gets the zlib fallback, or has a display small
+    enough to warrant a downscaled copy.
+    """
+
+    def __init__(self, channel: str, spec: CodecSpec, size: tuple[int, int], max_inflight: int,
+                 latency_budget: float | None, target_fps: float):
+        self.channel = channel
+        self.spec = spec
+        self.size = size   # output (w, h), after resampling to the viewers' displays
+        self.key = (channel, spec, size)
+        self.codec = make_codec(spec[0], **dict(spec[1]))
+        self.prev_frame: np.ndarray | None = None
+        self.pacer = FramePacer(target_fps)   # thins the channel's frames when adapt lowers fps
+        self.target_fps = target_fps
+        self.last_keyframe = 0.0   # monotonic time the last full frame was encoded
+        self.last_decimation = 1
+        self.controller = QualityController(latency_budget) if latency_budget else None
+        self._dropped_seen = 0
+        self.byte_rate = 0.0   # bytes/second of packets encoded, smoothed over ~1 s windows
+        self._rate_bytes = 0
+        self._rate_since: float | None = None
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+        self.capture = _CaptureRing(max_inflight + 2)
+        self.last_encode: Future | None = None   # for stateful codecs, which encode in order
+
+    def adapt(self, members: List[_ClientConn], now: float) -> None:
+        """Let the controller react to the slowest subscriber and apply its quality step."""
+        if self.controller is None:
+            return
+        latency = max(c.queue_latency(now) for c in members)
+        # only backpressure: keyframe supersession and discarded tiles happen on any lossy link
+        dropped = sum(c.dropped_frames for c in members)
+        dropping = dropped > self._dropped_seen
+        self._dropped_seen = dropped
+        # the slowest link measured so far; 0 until something has gone out
+        throughput = min((c.throughput for c in members if c.throughput > 0), default=0.0)
+        step = self.controller.step
+        if self.controller.update(latency, dropping, now, self.byte_rate, throughput):
+            # expect the new step's rate until a window of it has been counted; the old
+            # one would keep reading as saturated and push further down
+            self.byte_rate *= self.controller.cost(self.controller.step) / self.controller.cost(step)
+            self.codec.set_quality_scale(self.controller.quality_scale)
+            self.pacer.set_rate(self.target_fps * self.controller.fps_scale)
+
+    def count_bytes(self, n: int, now: float) -> None:
+        """Called by the dispatcher for every packet encoded; updates byte_rate once a second."""
+        if self._rate_since is None:
+            self._rate_since = now
+        self._rate_bytes += n
+        if now - self._rate_since >= 1.0:
+            rate = self._rate_bytes / (now - self._rate_since)
+            # halfway to the new window: a keyframe landing in one window doesn't swing it
+            self.byte_rate = rate if not self.byte_rate else 0.5 * (self.byte_rate + rate)
+            self._rate_bytes = 0
+            self._rate_since = now
+
+    @property
+    def fps_scale(self) -> float:
+        return self.controller.fps_scale if self.controller else 1.0
+
+    @property
+    def decimation(self) -> int:
+        return self.controller.decimation if self.controller else 1
+
 
 class StreamGame:
 
@@ -18,29 +630,432 @@ class StreamGame:
     Stream Pygame surfaces (frames) to multiple TCP clients.
 
     Protocol per frame:
-      header (12 bytes): width:uint32, height:uint32, payload_len:uint32 (big-endian)
-      payload: zlib-compressed RGB bytes (len = w*h*3 before compression)
+      header (26 bytes): kind:uint8, codec:uint8, width:uint32, height:uint32, payload_len:uint32,
+                         host_time_us:uint64, tick:uint32 (big-endian)
+      payload (FRAME_FULL):  codec-compressed RGB bytes (len = w*h*3 before compression)
+      payload (FRAME_TILES): codec-compressed run of tiles, each x,y,w,h:uint16 + RGB bytes
+
+    With delta=True only the tiles that changed since the previous frame are sent.
+    FRAME_FULL is the keyframe and FRAME_TILES the delta frame patching it. A keyframe goes
+    out whenever a client joins or asks for one (MSG_KEYFRAME, e.g. after UDP loss), the
+    size changes, most tiles changed, or `keyframe_interval` seconds passed since the last
+    one, so a viewer whose picture went wrong unnoticed is repaired within that time.
+
+    Each client gets its own writer thread with at most `send_queue` frames waiting.
+    When a client falls behind and its queue is full, the backlog is dropped and counted
+    in dropped_frames. Frames left out on purpose (superseded by a keyframe, or tiles
+    that can't patch the viewer's picture) count in discarded_frames instead.
+
+    Pacing: each channel has a token bucket on the monotonic clock (see stream_pacing) that
+    picks evenly spaced game ticks for `target_fps`; pacing_stats() reports the achieved rate.
+
+    stream_surface only snapshots the pixels; diffing and compression run on a pool of
+    `encode_workers` threads (zlib releases the GIL) and a dispatcher hands the results to
+    the clients in frame order. If `max_inflight` frames of a channel are still encoding,
+    the new frame is skipped rather than queued.
+
+    Channels: right after connecting a viewer sends a hello message
+      length:uint32 + JSON {"channel": "green"}
+    and from then on only receives frames streamed to that channel (plus ALL_CHANNELS).
+    A channel named "x,y,w,h" is that rectangle of the surface given to stream_world().
+    Viewers that name no channel get `default_channel`.
+
+    Codecs: the hello also lists the codecs the viewer can decode and the host answers
+    {"codec": name} with what that viewer's channel will use. The frame header carries the
+    codec id, so set_codec() can switch a channel at runtime. raw, zlib, palette and yuv420
+    (4:2:0 planes, lossy, for world channels) support tile frames; png/jpeg/webp (cv2)
+    always send full frames. A viewer that can't decode its
+    channel's codec gets zlib instead. zlib and palette cut big frames into bands that are
+    deflated (and inflated by the viewer) on all cores at once; codec_params={"threads": n}
+    caps the band count.
+
+    Display size: viewers may send {"display": [w, h]} in the hello. A channel larger than
+    a viewer's screen is then resampled on the host to just fit it (one stream, and one
+    resampled buffer per frame, per distinct size), saving bytes and viewer-side scaling.
+
+    Adaptive quality: with `latency_budget` (seconds) set, each stream watches the queue
+    latency and backpressure drops of its slowest viewer, and compares its own byte rate
+    with that viewer's measured throughput. It steps frame rate, codec quality and
+    resolution down until that viewer is back under budget (see stream_adapt).
+
+    UDP: with allow_udp the host also binds a UDP socket on `port`. Viewers that ask for
+    it get frames as MTU-sized datagrams (see stream_udp); a lost fragment costs that one
+    frame instead of stalling every later one, and the viewer asks for a full frame over
+    its TCP connection when its tile chain breaks.
+
+    Input: viewers send their key / controller changes back as {"type": "input"} messages;
+    remote_keys() gives the game loop what they're holding (see stream_input).
+
+    Scene state: viewers that send {"mode": "scene"} get no pixels. stream_scene() sends
+    them the level grid once and then only the players' state per tick; they render
+    with the game's own TileSprites / PlayerSprites at their native resolution.
+
+    Multicast: with `multicast_group` set (e.g. "239.255.42.99") viewers may ask for
+    "multicast". Each channel's frames are then sent once to that group on its own port
+    (told to the viewer in the hello reply), so the host's upload stays flat however many
+    spectators join. Their TCP connections only carry keyframe requests and input.
+
+    Preset dictionary: with `zdict` (see build_zdict) the zlib-based codecs deflate every
+    frame against pixels both ends already hold, e.g. the level's rendered tiles. It goes
+    to each viewer once, base64 in the hello reply.
+
+    Shared memory: with allow_shm a viewer on the same machine (loopback, or connected from
+    one of the host's own addresses) can ask for "shm"; anyone else stays on TCP. Its
+    frames are then raw (no compression) and written to a multiprocessing.shared_memory
+    ring; the TCP connection only carries {"type": "shm", slot, seq} notices (see stream_shm).
+
+    Presentation sync: frame headers carry the host's time.monotonic() (microseconds) and
+    the game tick the frame was rendered at. With `present_delay` set, viewers estimate the
+    host clock with {"type": "ping"} round trips, answered by FRAME_PONG ahead of any
+    queued frames, and show every frame `present_delay` seconds after its host time. A host
+    that shows part of the world itself holds its screen back by as much (PresentQueue),
+    so all screens change on the same tick (see stream_clock).
+
+    Recording: start_recording(path) appends every packet sent, as sent, to a file
+    (stream_record); stream_replay serves such a file to viewers without a game.
+
+    Metrics: encode time, frame size and compression ratio per channel and codec, send
+    latency, and frames sent / dropped / discarded / queued per viewer are kept in
+    `metrics` (see stream_metrics) and returned by metrics_snapshot(). With `metrics_port`
+    they are also served as Prometheus text on http://127.0.0.1:<metrics_port>/metrics.
     """
 
-    def __init__(self, host: str = "0.0.0.0", port: int = 9999, max_clients: int = 3, target_fps: int = 20):
+    def __init__(self, host: str = "0.0.0.0", port: int = 9999, max_clients: int = 3, target_fps: int = 20,
+                 delta: bool = True, tile_size: int = 64, send_queue: int = 2,
+                 encode_workers: int = 2, max_inflight: int = 4, default_channel: str = ALL_CHANNELS,
+                 codec: str = DEFAULT_CODEC, codec_params: dict | None = None,
+                 latency_budget: float | None = None, allow_udp: bool = True,
+                 keyframe_interval: float | None = 2.0, allow_shm: bool = True,
+                 multicast_group: str | None = None, multicast_ttl: int = 1,
+                 zdict: bytes | None = None, metrics_port: int | None = None,
+                 present_delay: float | None = None):
         self.host = host
         self.port = port
         self.max_clients = max_clients
         self.target_fps = max(1, int(target_fps))
-        self._min_frame_interval = 1.0 / float(self.target_fps)
 
         self._server_sock: socket.socket | None = None
+        self.allow_udp = allow_udp
+        self.allow_shm = allow_shm
+        self.multicast_group = multicast_group
+        self.multicast_ttl = multicast_ttl
+        self._mcast_sock: socket.socket | None = None
+        self._mcast_ports: Dict[str, int] = {}   # channel -> group port, assigned on first viewer
+        self._mcast_groups: Dict[str, _MulticastGroup] = {}
+        self._udp_sock: socket.socket | None = None
         self._accept_thread: threading.Thread | None = None
         self._stop_flag = threading.Event()
-        self._clients: List[socket.socket] = []
+        self._clients: List[_ClientConn] = []
+        self.send_queue = max(1, int(send_queue))
         self._clients_lock = threading.Lock()
-        self._last_sent_time = 0.0
+        self.default_channel = default_channel
+        self._streams: Dict[tuple, _Stream] = {}
+        self._pacers: Dict[str, FramePacer] = {}   # per channel, on the monotonic clock
+        self._scene_grid = None   # level grid the cached FRAME_SCENE packets were built from
+        self._scene_packets: Dict[tuple, bytes] = {}
+
+        # codec per channel; channels not listed use the default
+        self._default_codec = self._spec(codec, codec_params or {})
+        self._channel_codecs: Dict[str, CodecSpec] = {}
+        self.latency_budget = latency_budget
+        # fixed for the server's lifetime: every viewer gets it once, in its hello reply
+        self.zdict = zdict[-ZDICT_SIZE:] if zdict else None
+        # viewers show each frame this long after its host time (None: as soon as it arrives)
+        self.present_delay = present_delay
+
+        # delta encoding state
+        self.delta = delta
+        self.tile_size = max(8, int(tile_size))
+        self._full_frame_ratio = 0.6   # above this fraction of dirty tiles a full frame is cheaper
+        self.keyframe_interval = keyframe_interval
+
+        # encoder pipeline
+        self.encode_workers = max(1, int(encode_workers))
+        self.max_inflight = max(1, int(max_inflight))
+        self.skipped_frames = 0   # frames not encoded because the pipeline was full
+        self._encode_pool: ThreadPoolExecutor | None = None
+        self._dispatch_thread: threading.Thread | None = None
+        self._pending: "queue.Queue[tuple[_Stream, Future] | None]" = queue.Queue()
+
+        # metrics: always kept, served over HTTP only with metrics_port
+        self.metrics_port = metrics_port
+        self._metrics_server: MetricsServer | None = None
+        self._init_metrics()
+
+        self._recorder: StreamRecorder | None = None
 
     @property
     def client_count(self) -> int:
         with self._clients_lock:
             return len(self._clients)
 
+    @property
+    def dropped_frames(self) -> Dict[str, int]:
+        """Frames dropped per client (ip:port) because its send queue was full."""
+        with self._clients_lock:
+            return {c.name: c.dropped_frames for c in self._clients}
+
+    @property
+    def discarded_frames(self) -> Dict[str, int]:
+        """Frames left out per client on purpose: superseded by a keyframe, or unpatchable tiles."""
+        with self._clients_lock:
+            return {c.name: c.discarded_frames for c in self._clients}
+
+    def client_stats(self) -> List[dict]:
+        """Per-client measurements plus the quality step its stream is currently on."""
+        now = time.monotonic()
+        with self._clients_lock:
+            clients = self._clients[:]
+        stats = []
+        for c in clients:
+            st = self._streams.get(c.base_stream) if c.base_stream else None
+            stats.append({
+                "client": c.name,
+                "channel": c.channel,
+                "latency_ms": round(c.queue_latency(now) * 1000.0, 1),
+                "throughput_kbps": round(c.throughput * 8 / 1000.0, 1),
+                "frames_sent": c.frames_sent,
+                "dropped_frames": c.dropped_frames,
+                "discarded_frames": c.discarded_frames,
+                "quality_step": st.controller.step if st and st.controller else 0,
+            })
+        return stats
+
+    def pacing_stats(self) -> Dict[str, dict]:
+        """
+        Target vs achieved frames per second for each channel streamed so far. The target
+        is the channel's fastest stream pacer, i.e. target_fps as lowered by adaptive quality.
+        """
+        now = time.monotonic()
+        targets: Dict[str, float] = {}
+        for st in list(self._streams.values()):
+            targets[st.channel] = max(targets.get(st.channel, 0.0), st.pacer.rate)
+        return {
+            channel: {"target_fps": round(targets.get(channel, self.target_fps), 1),
+                      "achieved_fps": round(p.achieved_fps(now), 1)}
+            for channel, p in list(self._pacers.items())
+        }
+
+    def start_recording(self, path: str) -> None:
+        """
+        Append every packet sent from now on to a new file at `path` (see stream_record;
+        play it back with stream_replay). Each stream starts at its next keyframe, which
+        is requested right away.
+        """
+        self.stop_recording()
+        meta = {
+            "started": time.time(), "target_fps": self.target_fps, "default_channel": self.default_channel,
+            "present_delay": self.present_delay,
+            "zdict": base64.b64encode(self.zdict).decode("ascii") if self.zdict else None,
+        }
+        recorder = StreamRecorder(path, meta)
+        recorder.start()
+        self._recorder = recorder
+        with self._clients_lock:
+            clients = self._clients[:]
+        for c in clients + list(self._mcast_groups.values()):
+            c.request_full()
+
+    def stop_recording(self) -> None:
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            recorder.close()
+            print(f"[StreamGame] Recorded {recorder.written} bytes to {recorder.path}"
+                  + (f" ({recorder.dropped} packets dropped)" if recorder.dropped else ""))
+
+    def metrics_snapshot(self) -> Dict[str, dict]:
+        """Every stream metric as plain data (see stream_metrics.MetricsRegistry.snapshot)."""
+        return self.metrics.snapshot()
+
+    def needs_keyframe(self, channel: str = ALL_CHANNELS) -> bool:
+        """
+        True if a pixel viewer of `channel` has nothing to show yet (just joined, or asked
+        for a keyframe). Callers that only stream on change use it to send one promptly.
+        """
+        for c in self._subscribers(channel):
+            if c.mode != "pixels":
+                continue
+            if c.transport == "multicast":
+                c = self._multicast_sink(c)
+            if c.needs_full:
+                return True
+        return False
+
+    def remote_keys(self, controls: Dict[str, int]) -> Set[int]:
+        """
+        Keys held on any viewer this tick, with controllers mapped onto `controls`
+        (a Player's). Merge with the local keys via stream_input.MergedKeys.
+        """
+        keys: Set[int] = set()
+        for held, buttons, axes, hats in self.input_samples():
+            keys |= held
+            keys |= controller_keys(buttons, axes, hats, controls)
+        return keys
+
+    def input_samples(self) -> List[tuple]:
+        """(keys, buttons, axes, hats) of every viewer for this tick (see InputState.sample)."""
+        with self._clients_lock:
+            clients = [c for c in self._clients if c.alive]
+        return [c.input.sample() for c in clients]
+
+    # ---- codecs ----
+    @staticmethod
+    def _spec(codec: str, params: dict) -> CodecSpec:
+        make_codec(codec, **params)   # fail fast on unknown names / bad params
+        return codec, tuple(sorted(params.items()))
+
+    def set_codec(self, channel: str, codec: str, **params) -> None:
+        """Switch `channel` to e.g. set_codec("green", "jpeg", quality=70) from the next frame."""
+        self._channel_codecs[channel] = self._spec(codec, params)
+
+    def _spec_for(self, channel: str, client: _ClientConn) -> CodecSpec:
+        if client.transport == "shm":
+            return "raw", ()   # a memcpy on each side beats any compression
+        spec = self._channel_codecs.get(channel, self._default_codec)
+        if spec[0] in client.codecs and spec[0] in available_codecs():
+            return spec
+        return DEFAULT_CODEC, ()
+
+    def _hello_reply(self, client: _ClientConn) -> dict:
+        reply = {}
+        spec = self._channel_codecs.get(client.channel, self._default_codec)
+        if (client.requested_transport == "multicast" and self._mcast_sock is not None
+                and spec[0] in client.codecs and client.mode == "pixels"):
+            client.transport = "multicast"
+            reply.update(group=self.multicast_group, mcast_port=self._multicast_port(client.channel))
+        reply.update({
+            "codec": self._spec_for(client.channel, client)[0],
+            "channel": client.channel,
+            "transport": client.transport,
+            "mode": client.mode,
+        })
+        if self.zdict and client.mode == "pixels":
+            reply["zdict"] = base64.b64encode(self.zdict).decode("ascii")
+        if self.present_delay is not None:
+            reply["present_delay"] = self.present_delay
+        return reply
+
+    # ---- multicast ----
+    def _multicast_port(self, channel: str) -> int:
+        with self._clients_lock:
+            port = self._mcast_ports.get(channel)
+            if port is None:
+                # one group port per channel, just above the TCP/UDP port
+                port = self._mcast_ports[channel] = self.port + 1 + len(self._mcast_ports)
+            return port
+
+    def _multicast_sink(self, client: _ClientConn) -> _MulticastGroup:
+        """The group sender for a multicast viewer's channel; passes its keyframe requests on."""
+        group = self._mcast_groups.get(client.channel)
+        if group is None or not group.alive:
+            group = self._mcast_groups[client.channel] = self._track(_MulticastGroup(
+                self._mcast_sock, self.multicast_group, self._multicast_port(client.channel),
+                client.channel, self.send_queue))
+        if client.needs_full:
+            # a spectator joined or lost a fragment: the whole group gets the keyframe
+            client.needs_full = False
+            group.request_full()
+        return group
+
+    # ---- metrics ----
+    def _init_metrics(self) -> None:
+        m = self.metrics = MetricsRegistry()
+        frame = ("channel", "codec", "kind")
+        client = ("client", "channel", "transport")
+        self._m_encode = m.histogram("stream_encode_seconds", "Time to diff and compress one frame.", frame)
+        self._m_bytes = m.histogram("stream_frame_bytes", "Encoded frame size, header included.", frame,
+                                    BYTES_BUCKETS)
+        self._m_ratio = m.histogram("stream_compression_ratio", "Uncompressed over compressed size.", frame,
+                                    RATIO_BUCKETS)
+        self._m_skipped = m.counter("stream_frames_skipped_total",
+                                    "Frames not encoded because the encoders were busy.", ("channel",))
+        self._m_send_latency = m.histogram("stream_send_latency_seconds",
+                                           "Time from queueing a frame to it leaving the socket.",
+                                           ("channel", "transport"))
+        self._m_sent = m.counter("stream_client_frames_sent_total", "Frames sent to a viewer.", client)
+        self._m_dropped = m.counter("stream_client_frames_dropped_total",
+                                    "Frames dropped because a viewer's queue was full.", client)
+        self._m_discarded = m.counter("stream_client_frames_discarded_total",
+                                      "Frames superseded by a keyframe or unusable by a viewer.", client)
+        self._m_sent_bytes = m.counter("stream_client_bytes_sent_total", "Bytes sent to a viewer.", client)
+        self._m_queue = m.gauge("stream_client_queue_depth", "Frames waiting in a viewer's send queue.", client)
+        self._m_clients = m.gauge("stream_clients", "Connected viewers.")
+        self._m_fps = m.gauge("stream_achieved_fps", "Frames per second actually streamed.", ("channel",))
+        m.add_collector(self._collect_metrics)
+
+    def _observe_encode(self, st: _Stream, kind: int, packet: bytes, raw: int, elapsed: float) -> None:
+        labels = {"channel": st.channel, "codec": st.spec[0], "kind": "full" if kind == FRAME_FULL else "tiles"}
+        self._m_encode.observe(elapsed, **labels)
+        self._m_bytes.observe(len(packet), **labels)
+        if raw:
+            self._m_ratio.observe(raw / len(packet), **labels)
+
+    def _collect_metrics(self) -> None:
+        """Copy what the clients and pacers already count into the registry (runs per scrape)."""
+        with self._clients_lock:
+            clients = self._clients[:]
+        clients += list(self._mcast_groups.values())
+        for metric in (self._m_sent, self._m_dropped, self._m_discarded, self._m_sent_bytes, self._m_queue):
+            metric.clear()
+        for c in clients:
+            labels = {"client": c.name, "channel": c.channel or "", "transport": c.transport}
+            self._m_sent.set_total(c.frames_sent, **labels)
+            self._m_dropped.set_total(c.dropped_frames, **labels)
+            self._m_discarded.set_total(c.discarded_frames, **labels)
+            self._m_sent_bytes.set_total(c.bytes_sent, **labels)
+            self._m_queue.set(c.queue_depth, **labels)
+        self._m_clients.set(self.client_count)
+        now = time.monotonic()
+        for channel, pacer in list(self._pacers.items()):
+            self._m_fps.set(pacer.achieved_fps(now), channel=channel)
+
+    def _track(self, client: _ClientConn) -> _ClientConn:
+        client.send_latency_metric = self._m_send_latency
+        return client
+
+    def _open_metrics(self) -> None:
+        if self.metrics_port is None or self._metrics_server is not None:
+            return
+        try:
+            server = MetricsServer(self.metrics, self.metrics_port)
+            server.start()
+            self._metrics_server = server
+            print(f"[StreamGame] Metrics on http://127.0.0.1:{server.port}/metrics")
+        except OSError as e:
+            print(f"[StreamGame] Metrics endpoint unavailable: {e}")
+
+    def _close_metrics(self) -> None:
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+
+    def _open_multicast(self) -> None:
+        if not self.multicast_group:
+            return
+        try:
+            m = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            m.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicast_ttl)
+            m.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)   # spectators on this machine too
+            m.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+            self._mcast_sock = m
+        except OSError as e:
+            print(f"[StreamGame] Multicast unavailable: {e}")
+            self._mcast_sock = None
+
+    def _close_multicast(self) -> None:
+        groups = list(self._mcast_groups.values())
+        self._mcast_groups = {}
+        for g in groups:
+            g.close()
+        for g in groups:
+            g.join(timeout=1.0)
+        if self._mcast_sock is not None:
+            try:
+                self._mcast_sock.close()
+            except Exception:
+                pass
+            self._mcast_sock = None
+
     # ---- lifecycle ----
     def start_server(self) -> None:
         if self._server_sock is not None:
@@ -51,6 +1066,10 @@ class StreamGame:
         s.bind((self.host, self.port))
         s.listen(self.max_clients)
         self._server_sock = s
+        self._udp_sock = self._bind_udp()
+        self._open_multicast()
+        self._open_metrics()
+        self._start_pipeline()
 
         t = threading.Thread(target=self._accept_loop, name="StreamGameAccept", daemon=True)
         t.start()
@@ -64,29 +1083,69 @@ class StreamGame:
             except Exception:
                 pass
             self._server_sock = None
+        if self._udp_sock:
+            try:
+                self._udp_sock.close()
+            except Exception:
+                pass
+            self._udp_sock = None
 
-        with self._clients_lock:
-            for c in self._clients[:]:
-                try:
-                    c.shutdown(socket.SHUT_RDWR)
-                except Exception:
-                    pass
-                try:
-                    c.close()
-                except Exception:
-                    pass
-            self._clients.clear()
+        self._stop_pipeline()
+        self.stop_recording()
+        self._close_clients()
+        self._close_multicast()
+        self._close_metrics()
 
         if self._accept_thread and self._accept_thread.is_alive():
             self._accept_thread.join(timeout=1.0)
         self._accept_thread = None
 
+    def _bind_udp(self) -> socket.socket | None:
+        if not self.allow_udp:
+            return None
+        try:
+            u = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            u.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+            u.bind((self.host, self.port))
+            return u
+        except OSError as e:
+            print(f"[StreamGame] UDP transport unavailable: {e}")
+            return None
+
+    def _start_pipeline(self) -> None:
+        self._encode_pool = ThreadPoolExecutor(max_workers=self.encode_workers, thread_name_prefix="StreamGameEncode")
+        d = threading.Thread(target=self._dispatch_loop, name="StreamGameDispatch", daemon=True)
+        d.start()
+        self._dispatch_thread = d
+
+    def _stop_pipeline(self) -> None:
+        # drain the pipeline before tearing the clients down
+        if self._dispatch_thread and self._dispatch_thread.is_alive():
+            self._pending.put(None)
+            self._dispatch_thread.join(timeout=1.0)
+        self._dispatch_thread = None
+        if self._encode_pool:
+            self._encode_pool.shutdown(wait=False, cancel_futures=True)
+            self._encode_pool = None
+        self._pending = queue.Queue()
+        self._streams = {}
+        self._pacers = {}
+
+    def _close_clients(self) -> None:
+        with self._clients_lock:
+            clients = self._clients[:]
+            self._clients.clear()
+        for c in clients:
+            c.close()
+        for c in clients:
+            c.join(timeout=1.0)
+
     # ---- internals ----
     def _accept_loop(self) -> None:
         while not self._stop_flag.is_set():
             try:
                 self._server_sock.settimeout(0.5)
-                client, _ = self._server_sock.accept()
+                client, addr = self._server_sock.accept()
             except socket.timeout:
                 continue
             except Exception:
@@ -103,45 +1162,284 @@ class StreamGame:
                         pass
                     continue
                 client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                self._clients.append(client)
+                limit_unsent(client)
+                self._clients.append(self._track(_ClientConn(client, addr, self.send_queue, self.default_channel,
+                                                             self._hello_reply, self._udp_sock, self.allow_shm)))
 
-    # ---- streaming ----
-    def stream_surface(self, surface: "pygame.Surface") -> None:
+    def _subscribers(self, channel: str) -> List[_ClientConn]:
+        with self._clients_lock:
+            dead = [c for c in self._clients if not c.alive]
+            for c in dead:
+                self._clients.remove(c)
+            clients = [c for c in self._clients if c.wants(channel)]
+        for c in dead:
+            c.close()
+        return clients
 
-        # control the rate of streaming
-        now = time.time()
-        if now - self._last_sent_time < self._min_frame_interval:
-            return
-        self._last_sent_time = now
+    def _encode_frame(self, codec, prev: np.ndarray | None, frame: np.ndarray, force_full: bool,
+                      decimation: int = 1, stamp: tuple[int, int] = (0, 0)) -> tuple[int, bytes, int, float]:
+        """
+        Runs on the encode pool. `prev` and `frame` are snapshots nobody else writes to;
+        `stamp` is the (host microseconds, tick) the frame was rendered at.
+        Returns (kind, packet, uncompressed bytes, encode seconds).
+        """
+        started = time.perf_counter()
+        if decimation > 1:
+            # strided views: prev only feeds the tile compare, frame gets compressed
+            frame = np.ascontiguousarray(frame[::decimation, ::decimation])
+            if prev is not None:
+                prev = prev[::decimation, ::decimation]
+        h, w = frame.shape[:2]
+        kind = FRAME_FULL
+        raw = frame.nbytes
+        if not codec.byte_stream:
+            payload = codec.encode_image(frame)
+        elif not self.delta or force_full or prev is None or prev.shape != frame.shape:
+            payload = codec.compress(frame)
+        else:
+            rects = dirty_tiles(prev, frame, self.tile_size)
+            total = -(-w // self.tile_size) * -(-h // self.tile_size)
+            if len(rects) > total * self._full_frame_ratio:
+                payload = codec.compress(frame)
+            else:
+                # an empty tile frame still goes out so the viewer keeps pumping its event loop
+                kind = FRAME_TILES
+                raw = sum(rw * rh for _, _, rw, rh in rects) * frame.shape[2]
+                if hasattr(codec, "compress_tiles"):
+                    payload = codec.compress_tiles(frame, rects)   # works from the pixels (palette)
+                else:
+                    payload = codec.compress(pack_tiles(frame, rects))
+
+        header = struct.pack(_HEADER_FMT, kind, codec.codec_id, w, h, len(payload), *stamp)
+        return kind, header + payload, raw, time.perf_counter() - started
+
+    def _dispatch_loop(self) -> None:
+        # futures arrive in submission order, so waiting on each in turn keeps frames ordered
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            st, fut, members = item
+            try:
+                kind, packet, raw, elapsed = fut.result()
+            except Exception as e:
+                # nobody got this frame, so nothing may patch against it: restart from a keyframe
+                print(f"[Stream] Encoding a frame of {st.channel!r} failed: {e}")
+                st.prev_frame = None
+                for c in members:
+                    c.request_full()
+                continue
+            finally:
+                st.inflight.release()
+            self._observe_encode(st, kind, packet, raw, elapsed)
+            st.count_bytes(len(packet), time.monotonic())
+            recorder = self._recorder
+            if recorder is not None:
+                recorder.record(st.key, {"channel": st.channel, "mode": "pixels", "codec": st.spec[0],
+                                         "size": list(st.size)}, packet)
+            if kind == FRAME_FULL:
+                # the encoder chose a full frame on its own; restart the keyframe interval
+                st.last_keyframe = time.monotonic()
 
+            for c in members:
+                c.offer(st.key, kind, packet)
+
+    # ---- streaming ----
+    def stream_surface(self, surface: "pygame.Surface", channel: str = ALL_CHANNELS, tick: int = 0,
+                       host_time: float | None = None) -> bool:
+        """
+        Stream `surface` to the viewers subscribed to `channel` (default: every viewer).
+        The frame is stamped with the game `tick` and `host_time` (time.monotonic() when
+        it was rendered, default now). Returns False if it was paced out or the encoders
+        were busy.
+        """
+        # control the rate of streaming: evenly spaced game ticks at target_fps
+        mono = time.monotonic()
+        stamp = (int((mono if host_time is None else host_time) * 1_000_000), tick & 0xFFFFFFFF)
+        pacer = self._pacers.get(channel)
+        if pacer is None:
+            pacer = self._pacers[channel] = FramePacer(self.target_fps)
+        if not pacer.ready(mono):
+            return False
 
-        # extract pygame surface
+        clients = [c for c in self._subscribers(channel) if c.mode == "pixels"]
         w, h = surface.get_size()
-        #24 bit rgb format
-        rgb_surface = surface.convert(24)
+        groups: Dict[tuple, List[_ClientConn]] = {}
+        for c in clients:
+            if c.transport == "multicast":
+                c = self._multicast_sink(c)
+            members = groups.setdefault((channel, self._spec_for(channel, c), self._output_size(c, w, h)), [])
+            if c not in members:
+                members.append(c)
 
-        # [R,G,B][R,G,B]    
-        raw_bytes = pygame.image.tostring(rgb_surface, "RGB")
-        # compress (lvl 3 - good balance between speed and size)
-        payload = zlib.compress(raw_bytes, level=3)
+        for key, st in list(self._streams.items()):
+            if st.channel == channel and key not in groups:
+                # nobody to patch against; the next viewer starts from a full frame anyway
+                del self._streams[key]
 
+        staged: Dict[tuple[int, int], np.ndarray] = {}   # this frame, once per output size
+        sent = False
+        for key, members in groups.items():
+            st = self._streams.get(key)
+            if st is None:
+                st = self._streams[key] = _Stream(channel, key[1], key[2], self.max_inflight,
+                                                  self.latency_budget, self.target_fps)
+                if self.zdict and hasattr(st.codec, "set_zdict"):
+                    st.codec.set_zdict(self.zdict)
+            st.adapt(members, mono)
+            if not st.pacer.ready(mono):
+                continue
+            # a viewer new to this stream (joined, or its channel switched codec) needs a full frame
+            force_full = any(c.needs_full or c.base_stream != st.key for c in members)
+            if self.keyframe_interval and mono - st.last_keyframe >= self.keyframe_interval:
+                force_full = True
+            sent |= self._encode_stream(st, surface, force_full, members, staged, stamp)
+        if sent:
+            pacer.mark_sent(mono)
+        return sent
 
-        header = struct.pack(_HEADER_FMT, w, h, len(payload))
-        packet = header + payload
+    def _output_size(self, client: _ClientConn, w: int, h: int) -> tuple[int, int]:
+        """
+        Size to stream a (w, h) channel at for `client`: fitted to its display, never
+        upscaled. The scale is rounded up to 1/8 steps so similar screens share a stream.
+        """
+        if client.display is None:
+            return w, h
+        dw, dh = client.display
+        scale = min(dw / w, dh / h)
+        if scale >= 1.0:
+            return w, h
+        scale = math.ceil(scale * 8) / 8
+        return max(1, round(w * scale)), max(1, round(h * scale))
 
-        dead = []
-        with self._clients_lock:
-            for c in self._clients:
-                try:
-                    c.sendall(packet)
-                except Exception:
-                    dead.append(c)
-            for c in dead:
-                try:
-                    self._clients.remove(c)
-                except ValueError:
-                    pass
+    def _encode_stream(self, st: _Stream, surface: "pygame.Surface", force_full: bool,
+                       members: List[_ClientConn], staged: Dict[tuple[int, int], np.ndarray],
+                       stamp: tuple[int, int]) -> bool:
+        if not st.inflight.acquire(blocking=False):
+            self.skipped_frames += 1
+            self._m_skipped.inc(channel=st.channel)
+            return False
+
+        # [R,G,B][R,G,B] - the one copy the game thread pays for; the encoder works from it.
+        # Another codec at the same size reuses the resampled pixels instead of redoing them.
+        if st.size in staged:
+            frame = st.capture.copy(staged[st.size])
+        else:
+            frame = staged[st.size] = st.capture.capture(surface, st.size)
+
+        decimation = st.decimation
+        if decimation != st.last_decimation:
+            # viewers hold a picture at the old resolution; tiles can't patch it
+            force_full = True
+            st.last_decimation = decimation
+        if force_full:
+            st.last_keyframe = time.monotonic()
+
+        prev = st.prev_frame
+        st.prev_frame = frame
+        try:
+            fut = self._submit_encode(st, prev, frame, force_full, decimation, stamp)
+        except Exception:
+            # server is shutting down
+            st.inflight.release()
+            return False
+        self._pending.put((st, fut, members))
+        return True
+
+    def _submit_encode(self, st: _Stream, *args) -> Future:
+        """
+        Put one frame of `st` on the encode pool. Frames of a stateful codec's stream go
+        strictly one after another: each is only submitted once the one before has
+        finished, so a later frame can't add palette slots (or start an epoch) under an
+        earlier frame still being encoded. Other streams keep the pool to themselves meanwhile.
+        """
+        pool = self._encode_pool
+        before = st.last_encode
+        if not st.codec.stateful:
+            return pool.submit(self._encode_frame, st.codec, *args)
+        if before is None or before.done():
+            fut = pool.submit(self._encode_frame, st.codec, *args)
+        else:
+            fut = Future()
+
+            def start(_):
                 try:
-                    c.close()
-                except Exception:
-                    pass
+                    inner = pool.submit(self._encode_frame, st.codec, *args)
+                except Exception as e:   # shut down meanwhile
+                    fut.set_exception(e)
+                    return
+                inner.add_done_callback(lambda f: _pass_result(f, fut))
+
+            before.add_done_callback(start)
+        st.last_encode = fut
+        return fut
+
+    def stream_scene(self, level, players: list, rects: Dict[str, "pygame.Rect"] | None = None,
+                     tick: int = 0, host_time: float | None = None) -> None:
+        """
+        Scene-state streaming for viewers that said {"mode": "scene"}: the level grid,
+        block size and the viewer's screen rect once (FRAME_SCENE), then every call just
+        the players' snapshots (FRAME_ENTITIES, a few hundred bytes). Call once per tick.
+        """
+        with self._clients_lock:
+            clients = [c for c in self._clients if c.alive and c.mode == "scene" and c.channel]
+        if not clients:
+            return
+        if self._scene_grid is not level.level:
+            # new level: every scene viewer needs the new grid
+            self._scene_grid = level.level
+            self._scene_packets = {}
+        entities = pack_entities(tick, [p.snapshot() for p in players])
+        stamp = int((time.monotonic() if host_time is None else host_time) * 1_000_000)
+        entity_packet = struct.pack(_HEADER_FMT, FRAME_ENTITIES, CODEC_RAW, 0, 0, len(entities),
+                                    stamp, tick & 0xFFFFFFFF) + entities
+
+        def scene_packet(rect):
+            packet = self._scene_packets.get(rect)
+            if packet is None:
+                payload = pack_scene(level.level, level.block_width, level.world_size, rect)
+                packet = self._scene_packets[rect] = struct.pack(
+                    _HEADER_FMT, FRAME_SCENE, CODEC_ZLIB, rect[2], rect[3], len(payload), 0, 0) + payload
+            return packet
+
+        world = pygame.Rect(0, 0, int(level.world_size[0]), int(level.world_size[1]))
+        recorder = self._recorder
+        recorded = set()
+        for c in clients:
+            rect = (rects or {}).get(c.channel) or parse_rect_channel(c.channel) or world
+            rect = tuple(pygame.Rect(rect))
+            key = ("scene", rect, id(level.level))
+            if c.needs_full or c.base_stream != key:
+                c.offer(key, FRAME_SCENE, scene_packet(rect))
+            c.offer(key, FRAME_ENTITIES, entity_packet, absolute=True)
+            if recorder is not None and key not in recorded:
+                recorded.add(key)
+                describe = {"channel": c.channel, "mode": "scene", "rect": list(rect)}
+                if recorder.needs_keyframe(key):
+                    recorder.record(key, describe, scene_packet(rect))
+                recorder.record(key, describe, entity_packet)
+
+    def stream_world(self, world: "pygame.Surface", rects: Dict[str, "pygame.Rect"] | None = None,
+                     tick: int = 0, host_time: float | None = None) -> None:
+        """
+        Stream each named rect of `world` to its channel, plus every "x,y,w,h" channel
+        a viewer has subscribed to. Channels nobody watches cost nothing. Every channel's
+        frame carries the same tick and host time, so viewers can show them together.
+        """
+        if host_time is None:
+            host_time = time.monotonic()
+        for name, rect in (rects or {}).items():
+            self.stream_surface(world.subsurface(rect), channel=name, tick=tick, host_time=host_time)
+
+        with self._clients_lock:
+            wanted = {c.channel for c in self._clients if c.channel}
+        bounds = world.get_rect()
+        for name in wanted:
+            if rects and name in rects:
+                continue
+            rect = parse_rect_channel(name)
+            if rect is None:
+                continue
+            clipped = bounds.clip(pygame.Rect(rect))
+            if clipped.width and clipped.height:
+                self.stream_surface(world.subsurface(clipped), channel=name, tick=tick, host_time=host_time)
@@ -0,0 +1,158 @@
+# stream_input.py
+# Reverse input channel: viewers send their keyboard / controller changes to the host,
+# which merges them into the keys the game loop hands to Player.update.
+import threading
+import time
+from typing import Dict, List, Set, Tuple
+
+import pygame
+
+# viewer -> host control message, changes only:
+#   {"type": "input", "t": ms, "k": [[key, down]], "b": [[button, down]],
+#    "a": [[axis, value]], "h": [[hat, x, y]]}
+MSG_INPUT = "input"
+
+# same feel as a local controller (see Game/controller.py)
+AXIS_DEADZONE = 0.30
+BTN_JUMP = (0,)      # A (Xbox) / Cross (PS)
+BTN_DASH = (1, 5)    # B / Circle, or RB / R1
+
+
+class InputState:
+    """
+    What one viewer is currently holding, updated from its control messages by the
+    connection's reader as they arrive. A key pressed and released again between two
+    game ticks still shows up in the next sample(), so quick taps aren't lost.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.keys: Set[int] = set()
+        self.buttons: Set[int] = set()
+        self.axes: Dict[int, float] = {}
+        self.hats: Dict[int, Tuple[int, int]] = {}
+        self._tapped_keys: Set[int] = set()
+        self._tapped_buttons: Set[int] = set()
+        self.last_event_ms = 0    # viewer timestamp of the latest change
+        self.last_arrival = 0.0   # host monotonic time it arrived
+
+    def apply(self, msg: dict) -> None:
+        try:
+            with self._lock:
+                for key, down in msg.get("k", ()):
+                    self._press(self.keys, self._tapped_keys, int(key), down)
+                for button, down in msg.get("b", ()):
+                    self._press(self.buttons, self._tapped_buttons, int(button), down)
+                for axis, value in msg.get("a", ()):
+                    self.axes[int(axis)] = max(-1.0, min(1.0, float(value)))
+                for hat, x, y in msg.get("h", ()):
+                    self.hats[int(hat)] = (int(x), int(y))
+                self.last_event_ms = int(msg.get("t", self.last_event_ms))
+                self.last_arrival = time.monotonic()
+        except (TypeError, ValueError):
+            pass   # malformed message from a viewer; keep what we had
+
+    @staticmethod
+    def _press(held: Set[int], tapped: Set[int], code: int, down) -> None:
+        if down:
+            held.add(code)
+            tapped.add(code)
+        else:
+            held.discard(code)
+
+    def sample(self) -> Tuple[Set[int], Set[int], Dict[int, float], Dict[int, Tuple[int, int]]]:
+        """(keys, buttons, axes, hats) for this tick; clears the taps."""
+        with self._lock:
+            keys = self.keys | self._tapped_keys
+            buttons = self.buttons | self._tapped_buttons
+            self._tapped_keys.clear()
+            self._tapped_buttons.clear()
+            return keys, buttons, dict(self.axes), dict(self.hats)
+
+    def clear(self) -> None:
+        """Release everything, e.g. when the viewer disconnects mid-press."""
+        with self._lock:
+            self.keys.clear()
+            self.buttons.clear()
+            self.axes.clear()
+            self.hats.clear()
+            self._tapped_keys.clear()
+            self._tapped_buttons.clear()
+
+
+class MergedKeys:
+    """
+    Stands in for pygame.key.get_pressed(): a key is down if it is down locally or on
+    any remote viewer. Player.update only indexes it by key constant.
+    """
+
+    def __init__(self, local, remote: Set[int]):
+        self.local = local
+        self.remote = remote
+
+    def __getitem__(self, key: int) -> bool:
+        return bool(self.local[key]) or key in self.remote
+
+    def __len__(self) -> int:
+        return len(self.local)
+
+
+def controller_keys(buttons: Set[int], axes: Dict[int, float], hats: Dict[int, Tuple[int, int]],
+                    controls: Dict[str, int]) -> Set[int]:
+    """Map a remote controller onto a Player's `controls` keys: left stick / d-pad move."""
+    keys = set()
+    lx, ly = axes.get(0, 0.0), axes.get(1, 0.0)
+    hx, hy = hats.get(0, (0, 0))
+    if lx < -AXIS_DEADZONE or hx < 0:
+        keys.add(controls["left"])
+    if lx > AXIS_DEADZONE or hx > 0:
+        keys.add(controls["right"])
+    if ly > AXIS_DEADZONE or hy < 0:   # pygame hats report down as -1
+        keys.add(controls["down"])
+    if buttons.intersection(BTN_JUMP):
+        keys.add(controls["jump"])
+    if buttons.intersection(BTN_DASH):
+        keys.add(controls["dash"])
+    return keys
+
+
+class InputSender:
+    """
+    Viewer side: turns pygame events into change-only input messages. feed() every event,
+    then flush() once per loop iteration to send whatever changed as one message.
+    """
+
+    def __init__(self, axis_step: float = 0.02):
+        self.axis_step = axis_step
+        self._joysticks: Dict[int, "pygame.joystick.Joystick"] = {}
+        self._axes: Dict[int, float] = {}
+        self._changes: Dict[str, List[list]] = {}
+
+    def feed(self, event: "pygame.event.Event") -> None:
+        if event.type == pygame.JOYDEVICEADDED:
+            js = pygame.joystick.Joystick(event.device_index)
+            self._joysticks[js.get_instance_id()] = js   # events only arrive for opened pads
+        elif event.type == pygame.JOYDEVICEREMOVED:
+            self._joysticks.pop(event.instance_id, None)
+        elif event.type in (pygame.KEYDOWN, pygame.KEYUP):
+            if event.key != pygame.K_ESCAPE:   # the viewer's own quit key
+                self._changes.setdefault("k", []).append([event.key, int(event.type == pygame.KEYDOWN)])
+        elif event.type in (pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP):
+            self._changes.setdefault("b", []).append([event.button, int(event.type == pygame.JOYBUTTONDOWN)])
+        elif event.type == pygame.JOYAXISMOTION:
+            value = round(event.value, 2)
+            last = self._axes.get(event.axis, 0.0)
+            # sticks jitter; small moves wait, but returning to centre always goes out
+            if value != last and (abs(value - last) >= self.axis_step or value == 0.0):
+                self._axes[event.axis] = value
+                self._changes.setdefault("a", []).append([event.axis, value])
+        elif event.type == pygame.JOYHATMOTION:
+            self._changes.setdefault("h", []).append([event.hat, *event.value])
+
+    def flush(self) -> dict | None:
+        """The pending changes as one message, or None if nothing changed."""
+        if not self._changes:
+            return None
+        msg = {"type": MSG_INPUT, "t": int(time.monotonic() * 1000), **self._changes}
+        self._changes = {}
+        return msg
@@ -0,0 +1,244 @@
+# stream_metrics.py
+# Counters and histograms for StreamGame, readable from Python (snapshot()) or scraped as
+# Prometheus text from a small HTTP server on a local port.
+import math
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# bucket upper bounds (le) for the histograms StreamGame keeps
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+RATIO_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, object] = {}
+
+    def _key(self, labels: dict) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def clear(self) -> None:
+        """Forget every label set, e.g. before a collector copies in the viewers still connected."""
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            items = list(self._values.items())
+        return {"type": self.kind, "help": self.help,
+                "samples": [{"labels": dict(zip(self.labels, k)), "value": v} for k, v in items]}
+
+
+class Counter(_Metric):
+    """Only goes up (frames, bytes, drops)."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        """For collectors that copy a total the server already keeps."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    """A current value (queue depth, viewers)."""
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, plus their sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = SECONDS_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)   # first bucket with le >= value (len() is +Inf)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _items(self):
+        with self._lock:
+            return [(k, list(counts), total, n) for k, (counts, total, n) in sorted(self._values.items())]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for key, counts, total, n in self._items():
+            running = 0
+            for le, c in zip(self.buckets + (math.inf,), counts):
+                running += c
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(le),))} {running}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {n}")
+        return lines
+
+    def snapshot(self) -> dict:
+        samples = []
+        for key, counts, total, n in self._items():
+            running, cumulative = 0, {}
+            for le, c in zip(self.buckets + (math.inf,), counts):
+                running += c
+                cumulative[le] = running
+            samples.append({"labels": dict(zip(self.labels, key)), "buckets": cumulative,
+                            "sum": total, "count": n, "mean": total / n if n else 0.0})
+        return {"type": "histogram", "help": self.help, "samples": samples}
+
+
+class MetricsRegistry:
+    """
+    The metrics of one server. Collectors run before every render() / snapshot(), so
+    values the server already tracks (per-client counts, queue depths) are copied in at
+    read time instead of on the hot path.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()   # one reader at a time: collectors clear and refill
+
+    def _add(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name!r} already registered.")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = SECONDS_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        self._collectors.append(collect)
+
+    def _collect(self) -> List[_Metric]:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"[Metrics] Collector failed: {e}")
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        lines = []
+        with self._read_lock:
+            for metric in self._collect():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, dict]:
+        """{name: {"type", "help", "samples": [{"labels": {...}, "value" | "buckets"/"sum"/"count"/"mean"}]}}"""
+        with self._read_lock:
+            return {m.name: m.snapshot() for m in self._collect()}
+
+
+class MetricsServer:
+    """Serves a registry's render() on GET /metrics (Prometheus scrape target) from a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._httpd: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._httpd is not None:
+            return
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass   # one line per scrape would drown the game's console
+
+        httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        httpd.daemon_threads = True
+        self._httpd = httpd
+        self.port = httpd.server_address[1]   # the real one when asked for port 0
+        self._thread = threading.Thread(target=httpd.serve_forever, name="StreamMetrics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        httpd = self._httpd
+        if httpd is None:
+            return
+        self._httpd = None
+        httpd.shutdown()
+        httpd.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
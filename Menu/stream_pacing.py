@@ -0,0 +1,55 @@
+# stream_pacing.py
+# Output pacing for StreamGame: a token bucket on the monotonic clock that lets frames
+# through on the game ticks nearest to an even spacing at the target rate.
+from collections import deque
+
+
+class FramePacer:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most one frame's worth
+    so an idle channel doesn't burst when it wakes up.
+
+    ready() is called once per game tick. A frame goes out on the tick nearest to when the
+    next token is due (within half the measured tick interval), and the bucket may dip
+    below zero to allow that, so the long-run rate stays exact: at 60 ticks/s a 20 fps
+    target sends every third tick instead of alternating 3 and 4 when tick timing jitters.
+    """
+
+    def __init__(self, rate: float, window: float = 2.0):
+        self.rate = float(rate)
+        self.window = window
+        self._tokens = 1.0
+        self._last: float | None = None
+        self._tick: float | None = None   # EMA of the interval between ready() calls
+        self._sent = deque()
+
+    def set_rate(self, rate: float) -> None:
+        self.rate = float(rate)
+
+    def ready(self, now: float) -> bool:
+        """Take a token if this tick is the one to send on; `now` is time.monotonic()."""
+        if self._last is not None:
+            dt = max(0.0, now - self._last)
+            self._tick = dt if self._tick is None else self._tick + 0.1 * (dt - self._tick)
+            # refill by the smoothed tick, not this tick's dt: jitter in individual ticks then
+            # can't push a send to the neighbouring tick, while the rate still follows time
+            self._tokens = min(1.0 + self._tick * self.rate, self._tokens + self._tick * self.rate)
+        self._last = now
+        slack = 0.5 * (self._tick or 0.0) * self.rate
+        if self._tokens + slack >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    def mark_sent(self, now: float) -> None:
+        """Count a frame that actually went out (for achieved_fps)."""
+        self._sent.append(now)
+        self._trim(now)
+
+    def achieved_fps(self, now: float) -> float:
+        self._trim(now)
+        return len(self._sent) / self.window
+
+    def _trim(self, now: float) -> None:
+        while self._sent and self._sent[0] <= now - self.window:
+            self._sent.popleft()
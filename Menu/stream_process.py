@@ -0,0 +1,345 @@
+# stream_process.py
+# ProcessStreamGame: the whole streaming server (sockets, encoders, viewers) in a child
+# process. The game process only copies each frame into a shared-memory ring.
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Set
+
+import numpy as np
+import pygame
+
+from Menu.stream_input import controller_keys
+from Menu.stream_pacing import FramePacer
+from Menu.stream_protocol import ALL_CHANNELS
+from Menu.stream_shm import ShmRing, shm_available
+
+_AUTHKEY_ENV = "STREAM_PROCESS_AUTHKEY"
+
+
+def _surface_format(surface: "pygame.Surface") -> str | None:
+    """pygame.image.frombuffer format of a surface's raw bytes, if it has one."""
+    if surface.get_bytesize() != 4 or sys.byteorder != "little":
+        return None
+    return {(16, 8, 0): "BGRA", (0, 8, 16): "RGBA"}.get(tuple(surface.get_shifts()[:3]))
+
+
+class ProcessStreamGame:
+    """
+    Same game-loop API as StreamGame (start_server / stream_surface / stream_world /
+    stream_scene / remote_keys / stop_server), but the server runs as
+    `python -m Menu.stream_process` and the game process never touches a socket or a codec.
+
+    Per streamed frame the game loop pays one memcpy of the surface's pixels into a slot
+    of a shared-memory ring (see stream_shm) and a ~100 byte notice over a local
+    connection, however many channels and viewers the child is serving. The copy is
+    skipped while nobody is connected and paced to target_fps otherwise. Input and the
+    viewer count come back over the same connection. Metrics live in the child: pass
+    metrics_port to scrape them, or call metrics_snapshot().
+
+    Keyword arguments not used here go to the child's AsyncStreamGame and must pickle.
+    """
+
+    def __init__(self, target_fps: int = 20, ring_slots: int = 3, **kwargs):
+        self.target_fps = max(1, int(target_fps))
+        self.ring_slots = max(2, int(ring_slots))
+        self._options = dict(kwargs, target_fps=self.target_fps)
+        self._proc: subprocess.Popen | None = None
+        self._conn = None
+        self._ring: ShmRing | None = None
+        self._seq = 0
+        self._pacers: Dict[tuple, FramePacer] = {}
+        self._scene_grid = None   # level grid the child already has
+        self._clients = 0
+        self._samples: List[list] = []   # input reports since the last remote_keys()
+        self._last_sample: list = []
+        self._metrics: dict | None = None   # reply to the last ("metrics",) request
+
+    # ---- lifecycle ----
+    def start_server(self) -> None:
+        if self._proc is not None:
+            return
+        if not shm_available():
+            raise RuntimeError("ProcessStreamGame needs multiprocessing.shared_memory.")
+        authkey = os.urandom(16)
+        listener = Listener(("127.0.0.1", 0), authkey=authkey)
+        host, port = listener.address
+        env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+        env[_AUTHKEY_ENV] = authkey.hex()
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self._proc = subprocess.Popen([sys.executable, "-m", "Menu.stream_process", f"{host}:{port}"],
+                                      cwd=root, env=env)
+
+        # Listener.accept() has no timeout; closing the listener unblocks it
+        accepted = []
+        t = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+        t.start()
+        t.join(timeout=10.0)
+        listener.close()
+        if not accepted:
+            self._kill()
+            raise RuntimeError("Stream process did not connect.")
+        self._conn = accepted[0]
+        try:
+            self._conn.send(self._options)
+            if not self._conn.poll(10.0):
+                raise RuntimeError("Stream process did not start its server.")
+            _, error = self._conn.recv()
+        except Exception:
+            self._kill()
+            raise
+        if error:
+            self._kill()
+            raise RuntimeError(f"Stream process failed to start: {error}")
+
+    def stop_server(self) -> None:
+        if self._proc is None:
+            return
+        self._send(("stop",))
+        try:
+            self._proc.wait(timeout=3.0)
+        except subprocess.TimeoutExpired:
+            pass
+        self._kill()
+
+    def _kill(self) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        self._scene_grid = None
+        self._clients = 0
+
+    # ---- game loop ----
+    @property
+    def client_count(self) -> int:
+        self._poll()
+        return self._clients
+
+    def stream_surface(self, surface: "pygame.Surface", channel: str = ALL_CHANNELS, tick: int = 0,
+                       host_time: float | None = None) -> bool:
+        return self._post("surface", surface, channel, tick, host_time)
+
+    def stream_world(self, world: "pygame.Surface", rects: Dict[str, "pygame.Rect"] | None = None,
+                     tick: int = 0, host_time: float | None = None) -> None:
+        rects = {name: tuple(pygame.Rect(r)) for name, r in (rects or {}).items()}
+        self._post("world", world, rects, tick, host_time)
+
+    def stream_scene(self, level, players: list, rects: Dict[str, "pygame.Rect"] | None = None,
+                     tick: int = 0, host_time: float | None = None) -> None:
+        if not self.client_count:
+            return
+        if host_time is None:
+            host_time = time.monotonic()
+        grid = None
+        if level.level is not self._scene_grid:
+            # the grid crosses once per level; every tick after is just the snapshots
+            grid = self._scene_grid = level.level
+        rects = {name: tuple(pygame.Rect(r)) for name, r in (rects or {}).items()}
+        self._send(("scene", grid, level.block_width, tuple(level.world_size),
+                    [p.snapshot() for p in players], rects, tick, host_time))
+
+    def set_codec(self, channel: str, codec: str, **params) -> None:
+        self._send(("codec", channel, codec, params))
+
+    def start_recording(self, path: str) -> None:
+        """StreamGame.start_recording(), done by the child."""
+        self._send(("record", os.path.abspath(path)))
+
+    def stop_recording(self) -> None:
+        self._send(("record", None))
+
+    def metrics_snapshot(self, timeout: float = 1.0) -> Dict[str, dict]:
+        """StreamGame.metrics_snapshot() of the child's server ({} if it doesn't answer)."""
+        self._metrics = None
+        if not self._send(("metrics",)):
+            return {}
+        deadline = time.monotonic() + timeout
+        while self._metrics is None and self._conn is not None and time.monotonic() < deadline:
+            if self._conn.poll(max(0.0, deadline - time.monotonic())):
+                self._poll()
+        return self._metrics or {}
+
+    def remote_keys(self, controls: Dict[str, int]) -> Set[int]:
+        """StreamGame.remote_keys(): keys held on any viewer since the last call."""
+        self._poll()
+        reports = self._samples or [self._last_sample]
+        self._samples = []
+        keys: Set[int] = set()
+        for report in reports:
+            for held, buttons, axes, hats in report:
+                keys |= held
+                keys |= controller_keys(buttons, axes, hats, controls)
+        return keys
+
+    # ---- internals ----
+    def _post(self, kind: str, surface: "pygame.Surface", target, tick: int, host_time: float | None) -> bool:
+        if self._conn is None or not self.client_count:
+            return False
+        if host_time is None:
+            host_time = time.monotonic()   # one system-wide clock, so valid in the child too
+        pacer = self._pacers.get((kind, str(target)))
+        if pacer is None:
+            pacer = self._pacers[(kind, str(target))] = FramePacer(self.target_fps)
+        if not pacer.ready(time.monotonic()):
+            return False
+
+        w, h = surface.get_size()
+        fmt = _surface_format(surface)
+        view = None
+        if fmt is not None:
+            try:
+                view = memoryview(surface.get_view("0"))   # raw pixels, no conversion
+                pitch = surface.get_pitch()
+            except ValueError:
+                pass   # a subsurface isn't one contiguous block
+        if view is None:
+            view = memoryview(pygame.image.tobytes(surface, "RGB"))
+            fmt, pitch = "RGB", w * 3
+
+        try:
+            if self._ring is None or not self._ring.fits(view.nbytes):
+                # bigger frame (or the first): new ring, the child switches on the notice
+                old, self._ring = self._ring, ShmRing.create(view.nbytes, self.ring_slots)
+                self._send(("ring", self._ring.name))
+                if old is not None:
+                    old.close()
+            self._seq += 1
+            slot = self._ring.write(self._seq, view)   # the one copy the game loop pays for
+        finally:
+            view.release()
+        return self._send((kind, slot, self._seq, (w, h), fmt, pitch, target, tick, host_time))
+
+    def _send(self, msg: tuple) -> bool:
+        if self._conn is None:
+            return False
+        try:
+            self._conn.send(msg)
+            return True
+        except (OSError, EOFError):
+            print("[Stream] Stream process went away; streaming stopped.")
+            self._kill()
+            return False
+
+    def _poll(self) -> None:
+        try:
+            while self._conn is not None and self._conn.poll():
+                msg = self._conn.recv()
+                if msg[0] == "metrics":
+                    self._metrics = msg[1]
+                    continue
+                _, self._clients, report = msg
+                self._samples.append(report)
+                self._last_sample = report
+        except (OSError, EOFError):
+            self._kill()
+
+
+# ---- child process ----
+class _Snapshot:
+    """Stands in for a Player in StreamGame.stream_scene(): only snapshot() is used."""
+
+    def __init__(self, snap: dict):
+        self._snap = snap
+
+    def snapshot(self) -> dict:
+        return self._snap
+
+
+def _frame_surface(data: bytes, size: tuple, fmt: str, pitch: int) -> "pygame.Surface":
+    w, h = size
+    if fmt != "RGB" and pitch != w * 4:
+        # frombuffer can't skip row padding itself
+        data = np.frombuffer(data, dtype=np.uint8).reshape(h, pitch)[:, :w * 4].tobytes()
+    return pygame.image.frombuffer(data, size, fmt)
+
+
+def _serve(conn) -> None:
+    from Menu.stream_async import AsyncStreamGame
+
+    options = conn.recv()
+    try:
+        streamer = AsyncStreamGame(**options)
+        streamer.start_server()
+    except Exception as e:
+        conn.send(("ready", repr(e)))
+        return
+    conn.send(("ready", None))
+
+    ring: ShmRing | None = None
+    level = None
+    last_report = None
+    try:
+        while True:
+            msgs = []
+            if conn.poll(0.005):
+                while conn.poll():
+                    msgs.append(conn.recv())
+            for msg in msgs:
+                kind = msg[0]
+                if kind == "stop":
+                    return
+                if kind == "ring":
+                    if ring is not None:
+                        ring.close()
+                    try:
+                        ring = ShmRing.attach(msg[1])
+                    except FileNotFoundError:
+                        ring = None   # already replaced by a bigger one, its notice is queued
+                elif kind in ("surface", "world"):
+                    _, slot, seq, size, fmt, pitch, target, tick, host_time = msg
+                    data = ring.read(slot, seq) if ring is not None else None
+                    if data is None:
+                        continue   # lapped by the game; a newer frame is on its way
+                    surface = _frame_surface(data, size, fmt, pitch)
+                    if kind == "surface":
+                        streamer.stream_surface(surface, target, tick, host_time)
+                    else:
+                        streamer.stream_world(surface, {n: pygame.Rect(r) for n, r in target.items()},
+                                              tick, host_time)
+                elif kind == "scene":
+                    _, grid, block_width, world_size, snaps, rects, tick, host_time = msg
+                    if grid is not None or level is None:
+                        level = types.SimpleNamespace(level=grid, block_width=block_width, world_size=world_size)
+                    streamer.stream_scene(level, [_Snapshot(s) for s in snaps],
+                                          {n: pygame.Rect(r) for n, r in rects.items()}, tick, host_time)
+                elif kind == "codec":
+                    _, channel, codec, params = msg
+                    streamer.set_codec(channel, codec, **params)
+                elif kind == "metrics":
+                    conn.send(("metrics", streamer.metrics_snapshot()))
+                elif kind == "record":
+                    try:
+                        if msg[1]:
+                            streamer.start_recording(msg[1])
+                        else:
+                            streamer.stop_recording()
+                    except OSError as e:
+                        print(f"[Stream] Can't record to {msg[1]}: {e}")
+
+            # viewers' input and count back to the game, whenever they change
+            report = (streamer.client_count, streamer.input_samples())
+            if report != last_report:
+                conn.send(("input", *report))
+                last_report = report
+    except (OSError, EOFError):
+        pass   # the game process is gone
+    finally:
+        streamer.stop_server()
+        if ring is not None:
+            ring.close()
+
+
+if __name__ == "__main__":
+    address, port = sys.argv[1].rsplit(":", 1)
+    _serve(Client((address, int(port)), authkey=bytes.fromhex(os.environ.pop(_AUTHKEY_ENV))))
@@ -0,0 +1,153 @@
+# stream_protocol.py
+# Wire format shared by StreamGame (host) and the viewer.
+import asyncio
+import json
+import socket
+import struct
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+# kind, codec, width, height, payload_len, host time (monotonic microseconds), game tick
+# (network byte order); the last two let every screen show a frame at the same moment
+_HEADER_FMT = "!BBIIIQI"
+_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
+_HEADER_TIME_AT = struct.calcsize("!BBIII")   # offset of the host time, e.g. to restamp a replayed packet
+
+_TILE_FMT = "!HHHH"     # x, y, width, height of one patched tile
+_TILE_SIZE = struct.calcsize(_TILE_FMT)
+
+_MSG_FMT = "!I"         # length prefix of a JSON control message
+_MSG_SIZE = struct.calcsize(_MSG_FMT)
+_MAX_MSG_LEN = 64 * 1024
+
+# viewer -> host control messages (JSON, {"type": ...}) after the hello
+MSG_KEYFRAME = "keyframe"   # "my picture is broken, send a full frame"
+
+# channel every viewer receives, whatever it subscribed to (e.g. the lobby screen)
+ALL_CHANNELS = "*"
+
+# frame kinds (payload compressed with the codec named in the header, see stream_codecs)
+FRAME_FULL = 0    # keyframe - payload: RGB bytes of the whole frame (or an encoded image)
+FRAME_TILES = 1   # delta frame - payload: sequence of tile header + RGB bytes, patches the previous frame
+
+# scene-state mode: the viewer draws the level itself instead of receiving pixels
+FRAME_SCENE = 2      # keyframe - payload: zlib(meta length:uint32 + JSON meta + int8 level grid)
+FRAME_ENTITIES = 3   # payload: JSON {"tick": n, "entities": [Player.snapshot(), ...]}, absolute state
+
+FRAME_PONG = 4   # answer to a viewer's clock ping, not a picture (see stream_clock)
+
+KEY_FRAMES = (FRAME_FULL, FRAME_SCENE)   # frames a viewer can start from
+
+
+def recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Socket closed while receiving.")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def encode_msg(msg: dict) -> bytes:
+    data = json.dumps(msg).encode("utf-8")
+    return struct.pack(_MSG_FMT, len(data)) + data
+
+
+def send_msg(sock: socket.socket, msg: dict) -> None:
+    sock.sendall(encode_msg(msg))
+
+
+def _check_msg_len(n: int) -> None:
+    if n > _MAX_MSG_LEN:
+        raise ConnectionError(f"Control message too large ({n} bytes).")
+
+
+def recv_msg(sock: socket.socket) -> dict:
+    (n,) = struct.unpack(_MSG_FMT, recv_exact(sock, _MSG_SIZE))
+    _check_msg_len(n)
+    return json.loads(recv_exact(sock, n).decode("utf-8"))
+
+
+async def read_msg(reader: asyncio.StreamReader) -> dict:
+    """recv_msg() for an asyncio stream."""
+    (n,) = struct.unpack(_MSG_FMT, await reader.readexactly(_MSG_SIZE))
+    _check_msg_len(n)
+    return json.loads((await reader.readexactly(n)).decode("utf-8"))
+
+
+def pack_scene(grid: List[List[int]], block_width: float, world_size, rect) -> bytes:
+    """FRAME_SCENE payload: the level grid, its block size and the viewer's screen rect."""
+    meta = json.dumps({
+        "cols": len(grid[0]), "rows": len(grid), "block_width": block_width,
+        "world_size": [int(v) for v in world_size], "rect": [int(v) for v in rect],
+    }).encode("utf-8")
+    cells = np.asarray(grid, dtype=np.int8).tobytes()
+    return zlib.compress(struct.pack(_MSG_FMT, len(meta)) + meta + cells, level=6)
+
+
+def unpack_scene(payload: bytes) -> Tuple[dict, List[List[int]]]:
+    data = zlib.decompress(payload)
+    (n,) = struct.unpack_from(_MSG_FMT, data)
+    meta = json.loads(data[_MSG_SIZE:_MSG_SIZE + n].decode("utf-8"))
+    cells = np.frombuffer(data, dtype=np.int8, offset=_MSG_SIZE + n)
+    return meta, cells.reshape(meta["rows"], meta["cols"]).tolist()
+
+
+def pack_entities(tick: int, snapshots: List[dict]) -> bytes:
+    return json.dumps({"tick": tick, "entities": snapshots}, separators=(",", ":")).encode("utf-8")
+
+
+def parse_rect_channel(name: str) -> Tuple[int, int, int, int] | None:
+    """Channels named "x,y,w,h" stream that rectangle of the world surface."""
+    parts = name.split(",")
+    if len(parts) != 4:
+        return None
+    try:
+        x, y, w, h = (int(p) for p in parts)
+    except ValueError:
+        return None
+    if w <= 0 or h <= 0:
+        return None
+    return x, y, w, h
+
+
+def dirty_tiles(prev: np.ndarray, cur: np.ndarray, tile: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Compare two (h, w, 3) frames and return the (x, y, w, h) of every tile that changed.
+    Edge tiles are clipped to the frame, so they can be smaller than `tile`.
+    """
+    h, w = cur.shape[:2]
+    changed = np.any(prev != cur, axis=2)
+    # OR-reduce each tile row band, then each tile column band -> one bool per tile
+    rows = np.arange(0, h, tile)
+    cols = np.arange(0, w, tile)
+    per_tile = np.logical_or.reduceat(np.logical_or.reduceat(changed, rows, axis=0), cols, axis=1)
+    ty, tx = np.nonzero(per_tile)
+    return [
+        (int(x) * tile, int(y) * tile, min(tile, w - int(x) * tile), min(tile, h - int(y) * tile))
+        for y, x in zip(ty, tx)
+    ]
+
+
+def pack_tiles(frame: np.ndarray, rects: List[Tuple[int, int, int, int]]) -> bytes:
+    """Serialise the given tiles of an (h, w, 3) frame as header + RGB bytes, back to back."""
+    parts = []
+    for x, y, w, h in rects:
+        parts.append(struct.pack(_TILE_FMT, x, y, w, h))
+        parts.append(frame[y:y + h, x:x + w].tobytes())
+    return b"".join(parts)
+
+
+def iter_tiles(data: bytes, channels: int = 3):
+    """Yield (x, y, w, h, rgb_view) for every tile in a pack_tiles() buffer."""
+    view = memoryview(data)
+    off = 0
+    while off < len(view):
+        x, y, w, h = struct.unpack_from(_TILE_FMT, view, off)
+        off += _TILE_SIZE
+        n = w * h * channels
+        yield x, y, w, h, view[off:off + n]
+        off += n
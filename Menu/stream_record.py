@@ -0,0 +1,162 @@
+# stream_record.py
+# Recording of exactly what StreamGame sends (frame packets, header included, with the
+# time they went out) to an append-only file, written by a background thread.
+import json
+import queue
+import struct
+import threading
+import time
+from typing import Iterator, Tuple
+
+from Menu.stream_protocol import FRAME_TILES, KEY_FRAMES
+
+MAGIC = b"SGREC\x01"
+_META_FMT = "!I"        # length of the JSON meta block after MAGIC
+_REC_FMT = "!BQHI"      # record type, microseconds since recording start, stream index, body length
+_REC_SIZE = struct.calcsize(_REC_FMT)
+
+REC_STREAM = 0   # body: JSON describing stream `index` ({"channel", "mode", ...}); precedes its packets
+REC_PACKET = 1   # body: one stream packet exactly as sent (header + payload)
+
+
+class StreamRecorder:
+    """
+    Appends packets to `path` from a writer thread. record() only queues, so neither the
+    game loop nor the encode dispatcher ever waits on the disk.
+
+    At most `max_buffer` bytes wait for the writer; past that packets are dropped and
+    counted. A dropped tile frame would corrupt everything after it, so the stream's
+    later tile frames are dropped too until its next keyframe, exactly as a viewer's
+    send queue does. Each record is self-contained: a file cut short by a crash reads
+    back up to its last whole record.
+    """
+
+    def __init__(self, path: str, meta: dict | None = None, max_buffer: int = 64 * 1024 * 1024,
+                 flush_interval: float = 1.0):
+        self.path = path
+        self.meta = dict(meta or {})
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0   # bytes on disk, header included
+        self._queue: "queue.Queue[tuple | None]" = queue.Queue()
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._broken = set()   # streams waiting for a keyframe before their tiles mean anything
+        self._started = 0.0
+        self._file = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        # "x": never clobber an earlier recording
+        self._file = open(self.path, "xb")
+        meta = json.dumps(self.meta).encode("utf-8")
+        self._file.write(MAGIC + struct.pack(_META_FMT, len(meta)) + meta)
+        self.written = self._file.tell()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._write_loop, name="StreamRecorder", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Write out what is queued and close the file."""
+        with self._lock:
+            if self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+        self._queue.put(None)
+        thread.join()
+
+    def needs_keyframe(self, key) -> bool:
+        """True until stream `key` has a keyframe on record (new, or broken by a drop)."""
+        with self._lock:
+            index = self._streams.get(key)
+            return index is None or index in self._broken
+
+    def record(self, key, describe: dict, packet: bytes) -> None:
+        """Queue `packet` of the stream `key` (any hashable); `describe` is stored once per stream."""
+        kind = packet[0]
+        with self._lock:
+            if self._thread is None:
+                return
+            index = self._streams.get(key)
+            if index is None:
+                index = len(self._streams)
+                if not self._put(REC_STREAM, index, json.dumps(describe).encode("utf-8")):
+                    self.dropped += 1
+                    return   # declared with a later packet
+                self._streams[key] = index
+                self._broken.add(index)
+            if kind in KEY_FRAMES:
+                self._broken.discard(index)
+            elif index in self._broken:
+                self.dropped += 1
+                return
+            if not self._put(REC_PACKET, index, packet):
+                self.dropped += 1
+                if kind == FRAME_TILES:
+                    self._broken.add(index)
+
+    def _put(self, rtype: int, index: int, body: bytes) -> bool:
+        """Called with _lock held."""
+        if self._buffered + len(body) > self.max_buffer:
+            return False
+        self._buffered += len(body)
+        t_us = int((time.monotonic() - self._started) * 1_000_000)
+        self._queue.put((struct.pack(_REC_FMT, rtype, t_us, index, len(body)), body))
+        return True
+
+    def _write_loop(self) -> None:
+        f = self._file
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    head, body = item
+                    f.write(head)
+                    f.write(body)
+                    self.written += len(head) + len(body)
+                    with self._lock:
+                        self._buffered -= len(body)
+                now = time.monotonic()
+                if now - last_flush >= self.flush_interval:
+                    # whatever is on disk survives the game crashing
+                    f.flush()
+                    last_flush = now
+        except OSError as e:
+            print(f"[StreamRecorder] Recording stopped: {e}")
+            with self._lock:
+                self._thread = None   # record() drops from here on
+        finally:
+            f.close()
+
+
+def read_recording(path: str) -> Tuple[dict, Iterator[Tuple[int, int, int, bytes]]]:
+    """(meta, records) of a recording; records yields (type, t_us, stream index, body)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a stream recording.")
+        (n,) = struct.unpack(_META_FMT, f.read(struct.calcsize(_META_FMT)))
+        meta = json.loads(f.read(n).decode("utf-8"))
+        start = f.tell()
+
+    def records():
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                head = f.read(_REC_SIZE)
+                if len(head) < _REC_SIZE:
+                    return
+                rtype, t_us, index, length = struct.unpack(_REC_FMT, head)
+                body = f.read(length)
+                if len(body) < length:
+                    return   # cut short while recording
+                yield rtype, t_us, index, body
+
+    return meta, records()
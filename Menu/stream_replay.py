@@ -0,0 +1,172 @@
+# stream_replay.py
+# ReplayServer: serves a stream recording (see stream_record) to viewers without a game,
+# for reproducible load when tuning viewers and codecs.
+import argparse
+import base64
+import json
+import struct
+import threading
+import time
+
+from Menu.stream_async import AsyncStreamGame
+from Menu.stream_clock import now_us
+from Menu.stream_game import _ClientConn
+from Menu.stream_protocol import _HEADER_TIME_AT, ALL_CHANNELS, FRAME_ENTITIES
+from Menu.stream_record import REC_PACKET, REC_STREAM, read_recording
+
+_TIME_FMT = "!Q"
+
+
+class ReplayServer(AsyncStreamGame):
+    """
+    Plays a recording to whoever connects the way the game would have: same hello,
+    channels, transports and clock pings, and every recorded packet goes to the viewers of
+    its channel and mode through the usual bounded send queues.
+
+    Playback starts once the first viewer has said hello. speed=1.0 keeps the original
+    timing (viewers that can't keep up drop frames, as at a live game), 2.0 plays twice as
+    fast, and None plays as fast as the slowest viewer takes the packets. Host times in
+    the headers are moved onto this machine's clock, original spacing kept, so
+    presentation sync still lines up. A viewer that joins mid-file or asks for a keyframe
+    waits for the next one in the file. Where a channel was recorded at several sizes or
+    codecs, the first one recorded is played.
+    """
+
+    def __init__(self, path: str, speed: float | None = 1.0, loop: bool = False, **kwargs):
+        meta, records = read_recording(path)
+        kwargs.setdefault("default_channel", meta.get("default_channel") or "*")
+        kwargs.setdefault("present_delay", meta.get("present_delay"))
+        if meta.get("zdict"):
+            kwargs.setdefault("zdict", base64.b64decode(meta["zdict"]))
+        super().__init__(**kwargs)
+        self.path = path
+        self.speed = speed if speed and speed > 0 else None
+        self.loop = loop
+        self.meta = meta
+        self.packets_played = 0
+        self._codecs = {}   # (channel, mode) -> codec of the stream played there
+        for rtype, _, _, body in records:
+            # known before anyone says hello, not only once playback reaches the stream
+            if rtype == REC_STREAM:
+                d = json.loads(body.decode("utf-8"))
+                self._codecs.setdefault((d.get("channel"), d.get("mode", "pixels")), d.get("codec"))
+        self._player: threading.Thread | None = None
+
+    # ---- lifecycle ----
+    def start_server(self) -> None:
+        super().start_server()
+        if self._player is None:
+            self._player = threading.Thread(target=self._play, name="StreamReplay", daemon=True)
+            self._player.start()
+
+    def stop_server(self) -> None:
+        self._stop_flag.set()
+        if self._player is not None:
+            self._player.join(timeout=2.0)
+            self._player = None
+        super().stop_server()
+
+    def wait(self) -> None:
+        """Block until the recording has played out (forever with loop=True)."""
+        while self._player is not None and self._player.is_alive():
+            self._player.join(timeout=0.5)
+
+    # ---- internals ----
+    def _hello_reply(self, client: _ClientConn) -> dict:
+        reply = super()._hello_reply(client)
+        codec = self._codecs.get((client.channel, client.mode))
+        if codec:
+            reply["codec"] = codec   # what the recording holds, not what we'd encode with
+        return reply
+
+    def _play(self) -> None:
+        while not self._subscribers(ALL_CHANNELS):
+            # from the top for the first viewer, however long it takes to connect
+            if self._stop_flag.wait(0.05):
+                return
+        while not self._stop_flag.is_set():
+            self._play_once()
+            if not self.loop:
+                print(f"[Replay] {self.path} played out ({self.packets_played} packets).")
+                return
+
+    def _play_once(self) -> None:
+        _, records = read_recording(self.path)
+        streams = {}   # index -> description
+        chosen = {}    # (channel, mode) -> index played there
+        start = time.monotonic()
+        base_us = now_us()
+        first_stamp = None
+        for rtype, t_us, index, body in records:
+            if self._stop_flag.is_set():
+                return
+            if rtype == REC_STREAM:
+                d = streams[index] = json.loads(body.decode("utf-8"))
+                place = (d.get("channel"), d.get("mode", "pixels"))
+                chosen.setdefault(place, index)
+                continue
+            d = streams.get(index)
+            if rtype != REC_PACKET or d is None:
+                continue
+            place = (d.get("channel"), d.get("mode", "pixels"))
+            if chosen.get(place) != index:
+                continue
+
+            if self.speed is not None:
+                wait = start + t_us / 1_000_000 / self.speed - time.monotonic()
+                if wait > 0 and self._stop_flag.wait(wait):
+                    return
+
+            packet = bytearray(body)
+            (stamp,) = struct.unpack_from(_TIME_FMT, packet, _HEADER_TIME_AT)
+            if stamp:
+                # same tick, same stamp on every channel, as the game sent them
+                if first_stamp is None:
+                    first_stamp = stamp
+                if self.speed is None:
+                    stamp = now_us()
+                else:
+                    stamp = base_us + int((stamp - first_stamp) / self.speed)
+                struct.pack_into(_TIME_FMT, packet, _HEADER_TIME_AT, stamp)
+            self._offer(place, index, bytes(packet))
+
+    def _offer(self, place: tuple, index: int, packet: bytes) -> None:
+        channel, mode = place
+        kind = packet[0]
+        sinks = []
+        for c in self._subscribers(channel):
+            if c.mode != mode:
+                continue
+            if c.transport == "multicast":
+                c = self._multicast_sink(c)
+            if c not in sinks:
+                sinks.append(c)
+        if self.speed is None:
+            # as fast as possible, not faster: wait for room rather than overflow a queue
+            while any(c.alive and c.queue_depth >= c.max_queue for c in sinks):
+                if self._stop_flag.wait(0.001):
+                    return
+        for c in sinks:
+            c.offer(("replay", index), kind, packet, absolute=kind == FRAME_ENTITIES)
+        self.packets_played += 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Serve a StreamGame recording to viewers.")
+    ap.add_argument("recording", help="file written by StreamGame.start_recording()")
+    ap.add_argument("--port", type=int, default=9999)
+    ap.add_argument("--speed", type=float, default=1.0, help="playback speed, 1.0 = original timing")
+    ap.add_argument("--fast", action="store_true", help="send as fast as the viewers take it")
+    ap.add_argument("--loop", action="store_true", help="start over at the end")
+    ap.add_argument("--multicast-group", type=str, default=None, help='e.g. "239.255.42.99"')
+    args = ap.parse_args()
+    server = ReplayServer(args.recording, speed=None if args.fast else args.speed, loop=args.loop,
+                          port=args.port, multicast_group=args.multicast_group)
+    server.start_server()
+    print(f"[Replay] Serving {args.recording} on port {args.port}.")
+    try:
+        server.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop_server()
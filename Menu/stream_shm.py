@@ -0,0 +1,100 @@
+# stream_shm.py
+# Shared-memory frame ring for viewers on the same machine as the host: frame packets are
+# written into slots of a multiprocessing.shared_memory block, and only a small notice
+# ({"type": "shm", "name", "slot", "seq"}) goes over the TCP connection.
+import struct
+from typing import Optional
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:   # e.g. platforms without POSIX/Windows shared memory
+    shared_memory = None
+    resource_tracker = None
+
+MSG_SHM_FRAME = "shm"   # host -> viewer notice: packet `seq` is in `slot` of ring `name`
+
+_SLOT_FMT = "!QI"       # seq (0 while the slot is being written), packet length
+_SLOT_HDR = struct.calcsize(_SLOT_FMT)
+
+
+def shm_available() -> bool:
+    return shared_memory is not None
+
+
+class ShmRing:
+    """
+    A fixed number of equally sized slots, each holding one frame packet (header + payload).
+
+    The host writes round-robin; a viewer that falls a whole ring behind finds its slot
+    overwritten. Each slot starts with its packet's seq, zeroed while it is rewritten, so
+    read() checks it before and after copying and returns None for a torn or stale slot.
+    """
+
+    def __init__(self, shm, slots: int, slot_size: int, owner: bool):
+        self._shm = shm
+        self.name = shm.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self._owner = owner
+        self._next = 0
+
+    @classmethod
+    def create(cls, slot_size: int, slots: int = 8) -> "ShmRing":
+        slot_size = _SLOT_HDR + int(slot_size)
+        # slots count and size up front, so a viewer only needs the name
+        shm = shared_memory.SharedMemory(create=True, size=8 + slots * slot_size)
+        struct.pack_into("!II", shm.buf, 0, slots, slot_size)
+        return cls(shm, slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "ShmRing":
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before 3.13 attaching registers the block too, and the tracker would
+            # unlink it under the host when this viewer exits
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        slots, slot_size = struct.unpack_from("!II", shm.buf, 0)
+        return cls(shm, slots, slot_size, owner=False)
+
+    def fits(self, n: int) -> bool:
+        return _SLOT_HDR + n <= self.slot_size
+
+    def write(self, seq: int, packet: bytes) -> int:
+        """Copy `packet` into the next slot; returns the slot index."""
+        slot = self._next
+        self._next = (slot + 1) % self.slots
+        off = 8 + slot * self.slot_size
+        buf = self._shm.buf
+        struct.pack_into(_SLOT_FMT, buf, off, 0, 0)
+        buf[off + _SLOT_HDR:off + _SLOT_HDR + len(packet)] = packet
+        struct.pack_into(_SLOT_FMT, buf, off, seq, len(packet))
+        return slot
+
+    def read(self, slot: int, seq: int) -> Optional[bytes]:
+        if not 0 <= slot < self.slots:
+            return None
+        off = 8 + slot * self.slot_size
+        buf = self._shm.buf
+        got, n = struct.unpack_from(_SLOT_FMT, buf, off)
+        if got != seq or _SLOT_HDR + n > self.slot_size:
+            return None
+        packet = bytes(buf[off + _SLOT_HDR:off + _SLOT_HDR + n])
+        if struct.unpack_from(_SLOT_FMT, buf, off)[0] != seq:
+            return None   # the host lapped us while we were copying
+        return packet
+
+    def close(self) -> None:
+        try:
+            self._shm.close()
+        except Exception:
+            pass
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except Exception:
+                pass
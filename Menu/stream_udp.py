@@ -0,0 +1,74 @@
+# stream_udp.py
+# Datagram framing for the UDP stream transport: one stream packet (header + payload)
+# is split into MTU-sized fragments and put back together on the viewer.
+import struct
+import time
+from typing import Dict, Iterator, List, Tuple
+
+_FRAG_FMT = "!IHH"      # frame seq, fragment index, fragment count
+_FRAG_SIZE = struct.calcsize(_FRAG_FMT)
+
+# stays under a 1500-byte Ethernet MTU with IP/UDP headers and some slack for tunnels
+DATAGRAM_SIZE = 1200
+_CHUNK = DATAGRAM_SIZE - _FRAG_SIZE
+
+
+def fragment(seq: int, packet: bytes) -> Iterator[bytes]:
+    """Yield the datagrams carrying `packet` as frame number `seq`."""
+    view = memoryview(packet)
+    count = max(1, -(-len(view) // _CHUNK))
+    if count > 0xFFFF:
+        raise ValueError(f"Frame too large for UDP transport ({len(view)} bytes).")
+    seq &= 0xFFFFFFFF
+    for i in range(count):
+        yield struct.pack(_FRAG_FMT, seq, i, count) + view[i * _CHUNK:(i + 1) * _CHUNK]
+
+
+class Reassembler:
+    """
+    Collects fragments and hands back whole packets. A frame that is still incomplete
+    once a frame `max_behind` newer has started, or after `timeout` seconds, is dropped:
+    waiting for it would only hold up everything behind it.
+    """
+
+    def __init__(self, max_behind: int = 2, timeout: float = 0.25):
+        self.max_behind = max_behind
+        self.timeout = timeout
+        self.incomplete_frames = 0
+        self._partial: Dict[int, Tuple[float, List[bytes | None], int]] = {}
+        self._newest = -1
+
+    def feed(self, datagram: bytes) -> Tuple[int, bytes] | None:
+        """Returns (seq, packet) when `datagram` completes a frame, else None."""
+        if len(datagram) < _FRAG_SIZE:
+            return None
+        seq, index, count = struct.unpack_from(_FRAG_FMT, datagram)
+        if index >= count:
+            return None
+        now = time.monotonic()
+        self._newest = max(self._newest, seq)
+
+        entry = self._partial.get(seq)
+        if entry is None:
+            entry = (now, [None] * count, 0)
+        started, chunks, have = entry
+        if len(chunks) != count:
+            return None
+        if chunks[index] is None:
+            chunks[index] = datagram[_FRAG_SIZE:]
+            have += 1
+        self._partial[seq] = (started, chunks, have)
+
+        result = None
+        if have == count:
+            del self._partial[seq]
+            result = (seq, b"".join(chunks))
+        self._expire(now)
+        return result
+
+    def _expire(self, now: float) -> None:
+        for seq in list(self._partial):
+            started = self._partial[seq][0]
+            if seq < self._newest - self.max_behind or now - started > self.timeout:
+                del self._partial[seq]
+                self.incomplete_frames += 1
@@ -1,30 +1,252 @@
 # viewer.py
 # Standalone viewer for StreamGame streams.
 import argparse
+import base64
+import json
+import math
+import random
+import select
 import socket
 import struct
-import zlib
+import time
 
 import pygame
 
-_HEADER_FMT = "!III"   # width, height, payload_len
-_HEADER_SIZE = struct.calcsize(_HEADER_FMT) 
+from Menu.stream_clock import ClockSync, PresentQueue, now_us, unpack_pong
+from Menu.stream_codecs import available_codecs, decoder_for, use_zdict
+from Menu.stream_input import InputSender
+from Menu.stream_protocol import (
+    _HEADER_FMT, _HEADER_SIZE, FRAME_ENTITIES, FRAME_FULL, FRAME_PONG, FRAME_SCENE, FRAME_TILES, KEY_FRAMES,
+    MSG_KEYFRAME, iter_tiles, recv_msg, send_msg, unpack_scene,
+)
+from Menu.stream_protocol import recv_exact as _recv_exact
+from Menu.stream_shm import MSG_SHM_FRAME, ShmRing, shm_available
+from Menu.stream_udp import Reassembler
 
-def _recv_exact(sock: socket.socket, n: int) -> bytes:
-    buf = bytearray()
-    while len(buf) < n:
-        chunk = sock.recv(n - len(buf))
-        if not chunk:
-            raise ConnectionError("Socket closed while receiving.")
-        buf.extend(chunk)
-    return bytes(buf)
 
-def run_viewer(host: str, port: int, title: str = "StreamGame Viewer") -> None:
+def _wait_readable(sock: socket.socket, timeout: float) -> bool:
+    return bool(select.select([sock], [], [], timeout)[0])
+
+
+class _TcpFrames:
+    """Frames read straight off the TCP connection."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    def read(self, timeout: float = 0.1):
+        # wait briefly for the next frame so the caller keeps pumping events (and input)
+        if not _wait_readable(self.sock, timeout):
+            return None
+        header = struct.unpack(_HEADER_FMT, _recv_exact(self.sock, _HEADER_SIZE))
+        return False, header, _recv_exact(self.sock, header[4])
+
+    def close(self) -> None:
+        pass
+
+
+class _UdpFrames:
+    """
+    Frames reassembled from datagrams. read() returns None when nothing completed within
+    `timeout`, so the window stays responsive, and flags a gap when frames went missing.
+    `loss` randomly discards datagrams to try the stream on a bad network.
+    """
+
+    def __init__(self, ctrl: socket.socket, udp: socket.socket, loss: float = 0.0):
+        self.ctrl = ctrl
+        self.udp = udp
+        self.loss = loss
+        self._reasm = Reassembler()
+        self._last_seq = -1
+
+    def read(self, timeout: float = 0.1):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([self.udp, self.ctrl], [], [], remaining)
+            if self.ctrl in readable:
+                # a multicast group only carries frames; our own clock pongs come over TCP
+                header = struct.unpack(_HEADER_FMT, _recv_exact(self.ctrl, _HEADER_SIZE))
+                return False, header, _recv_exact(self.ctrl, header[4])
+            if self.udp not in readable:
+                continue
+            dgram = self.udp.recv(65536)
+            if self.loss and random.random() < self.loss:
+                continue
+            done = self._reasm.feed(dgram)
+            if done is None:
+                continue
+            seq, packet = done
+            if seq <= self._last_seq:
+                continue   # late straggler, we've already shown something newer
+            gap = seq != self._last_seq + 1
+            self._last_seq = seq
+            header = struct.unpack_from(_HEADER_FMT, packet)
+            return gap, header, packet[_HEADER_SIZE:]
+
+    def close(self) -> None:
+        try:
+            self.udp.close()
+        except Exception:
+            pass
+
+
+class _ShmUnreachable(Exception):
+    """The host's first ring can't be opened from here (another machine or container)."""
+
+
+class _ShmFrames:
+    """
+    Frames the host leaves in a shared-memory ring (same machine only); the TCP connection
+    carries one notice per frame. A slot the host already reused counts as a lost frame.
+    If the very first ring can't be found, read() raises _ShmUnreachable.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._ring: ShmRing | None = None
+        self._attached = False
+        self._last_seq = 0
+        self._lost = False
+
+    def read(self, timeout: float = 0.1):
+        if not _wait_readable(self.sock, timeout):
+            return None
+        msg = recv_msg(self.sock)
+        if msg.get("type") != MSG_SHM_FRAME:
+            return None
+        try:
+            if self._ring is None or self._ring.name != msg["name"]:
+                # first frame, or the host grew the ring for bigger frames
+                self.close()
+                self._ring = self._attach(msg["name"])
+            seq = int(msg["seq"])
+            packet = self._ring.read(int(msg["slot"]), seq)
+        except (FileNotFoundError, KeyError, TypeError, ValueError):
+            packet = None
+        if packet is None:
+            self._lost = True
+            return None
+        gap = self._lost or seq != self._last_seq + 1
+        self._lost = False
+        self._last_seq = seq
+        header = struct.unpack_from(_HEADER_FMT, packet)
+        return gap, header, packet[_HEADER_SIZE:]
+
+    def _attach(self, name: str) -> ShmRing:
+        try:
+            ring = ShmRing.attach(name)
+        except FileNotFoundError:
+            if self._attached:
+                raise   # a ring the host has already replaced: one lost frame
+            raise _ShmUnreachable(name) from None
+        self._attached = True
+        return ring
+
+    def close(self) -> None:
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+
+class _SceneView:
+    """
+    Scene-state mode: the level arrives once as a grid and is drawn here with the game's
+    own Level / TileSprites at the window's scale; players are drawn with PlayerSprites
+    from each tick's snapshots. Nothing is ever upscaled from a smaller picture.
+    """
+
+    _MAX_WORLD_PIXELS = 40_000_000   # Level renders the whole world; cap its scaled size
+
+    def __init__(self, screen: "pygame.Surface"):
+        self.screen = screen
+        self.background: pygame.Surface | None = None
+        self.rect = (0, 0, 1, 1)
+        self.scale = 1.0
+        self.block_width = 1.0
+        self.players = {}
+
+    def load(self, payload: bytes) -> None:
+        from game import level_manager   # only scene viewers need the game code
+        meta, grid = unpack_scene(payload)
+        x, y, w, h = meta["rect"]
+        world_w, world_h = meta["world_size"]
+        win_w, win_h = self.screen.get_size()
+        self.scale = min(win_w / w, win_h / h, math.sqrt(self._MAX_WORLD_PIXELS / (world_w * world_h)))
+        self.rect = (x, y, w, h)
+        self.block_width = meta["block_width"] * self.scale
+
+        level = level_manager.Level()
+        level.load_level(grid, self.block_width,
+                         (math.ceil(world_w * self.scale), math.ceil(world_h * self.scale)))
+        view = pygame.Rect(round(x * self.scale), round(y * self.scale),
+                           max(1, round(w * self.scale)), max(1, round(h * self.scale)))
+        # keep only this screen's part of the world
+        self.background = level.rendered_level.subsurface(view.clip(level.rendered_level.get_rect())).copy()
+        self.players = {}
+
+    def update(self, payload: bytes) -> None:
+        from game import player as player_module
+        for snap in json.loads(payload)["entities"]:
+            p = self.players.get(snap["name"])
+            if p is None:
+                p = self.players[snap["name"]] = player_module.Player((0, 0), self.block_width, [], snap["name"])
+                p.width *= self.scale
+                p.height *= self.scale
+            p.apply_snapshot(snap, offset=self.rect[:2], scale=self.scale)
+
+    def draw(self) -> None:
+        if self.background is None:
+            return
+        view = self.background.copy()
+        for p in self.players.values():
+            p.draw(view)
+        win_w, win_h = self.screen.get_size()
+        vw, vh = view.get_size()
+        fit = min(win_w / vw, win_h / vh)
+        if fit > 1.01:
+            # only when the world was too big to render at full window scale
+            view = pygame.transform.scale(view, (int(vw * fit), int(vh * fit)))
+            vw, vh = view.get_size()
+        self.screen.fill((10, 10, 12))
+        self.screen.blit(view, ((win_w - vw) // 2, (win_h - vh) // 2))
+        pygame.display.flip()
+
+
+def _join_multicast(group: str, port: int) -> socket.socket:
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # several spectator windows on one machine share the group port
+    udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    udp.bind(("", port))
+    mreq = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0"))
+    udp.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    return udp
+
+
+def run_viewer(host: str, port: int, title: str = "StreamGame Viewer", channel: str = "",
+               transport: str = "tcp", udp_loss: float = 0.0, send_input: bool = True,
+               mode: str = "pixels") -> None:
+    """
+    Show the frames the host streams to `channel` ("" lets the host pick its default).
+    transport="udp" receives frames as datagrams, so a lost packet drops one frame
+    instead of stalling the stream; the TCP connection stays up for control messages.
+    transport="shm" (viewer on the host's machine) reads raw frames from shared memory.
+    transport="multicast" joins the channel's LAN multicast group (host permitting).
+    With send_input the viewer's keys and controllers drive the host's player.
+    mode="scene" receives the level and player state instead of pixels and draws them locally.
+    If the host sets a present_delay, frames are shown at their host time plus that delay
+    (clock offset from ping round trips), in step with the host's other screens.
+    """
     pygame.init()
     info = pygame.display.Info()
     screen = pygame.display.set_mode((info.current_w, info.current_h), pygame.FULLSCREEN)
     pygame.display.set_caption(title)
+    pygame.joystick.init()
     clock = pygame.time.Clock()
+    inputs = InputSender()
 
     running = True
     first_size = True
@@ -41,10 +263,29 @@ def run_viewer(host: str, port: int, title: str = "StreamGame Viewer") -> None:
         # screen.blit(sub, rect2)
         pygame.display.flip()
 
+    def present(kind, item):
+        if kind == "entities":
+            scene.update(item)
+            scene.draw()
+            return
+        win_w, win_h = screen.get_size()
+        screen.fill((10, 10, 12))
+        screen.blit(item, ((win_w - item.get_width()) // 2, (win_h - item.get_height()) // 2))
+        pygame.display.flip()
+
+    def present_time(host_us):
+        """Local time to show a frame stamped `host_us`, or None to show it right away."""
+        if clock_sync is None or not clock_sync.synced or not host_us:
+            return None
+        at = clock_sync.local_time(host_us) + present_delay
+        # a wild estimate (clock jump) must not freeze the picture
+        return at if at - time.monotonic() < 2 * present_delay + 1.0 else None
+
     while running:
         # ---- WAIT & CONNECT PHASE ----
         # show waiting screen and keep trying to connect
         connected_sock = None
+        source = None
         while running and connected_sock is None:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -54,16 +295,53 @@ def run_viewer(host: str, port: int, title: str = "StreamGame Viewer") -> None:
 
             draw_waiting()
 
+            udp = None
             try:
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 sock.settimeout(2.5)  # quick retry cadence
                 sock.connect((host, port))
+                hello = {"channel": channel, "codecs": available_codecs(), "display": list(screen.get_size())}
+                if mode == "scene":
+                    hello["mode"] = "scene"
+                if transport == "udp":
+                    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+                    udp.bind(("", 0))
+                    hello.update(transport="udp", udp_port=udp.getsockname()[1])
+                elif transport == "shm" and shm_available():
+                    hello["transport"] = "shm"
+                elif transport == "multicast":
+                    hello["transport"] = "multicast"
+                send_msg(sock, hello)
+                reply = recv_msg(sock)
                 sock.settimeout(None)
                 connected_sock = sock
-                print(f"[Viewer] Connected to {host}:{port}")
+                # the host's preset dictionary, if it uses one, for every frame from here on
+                use_zdict(base64.b64decode(reply["zdict"]) if reply.get("zdict") else None)
+                if reply.get("transport") == "udp" and udp is not None:
+                    source = _UdpFrames(sock, udp, loss=udp_loss)
+                elif reply.get("transport") == "shm":
+                    source = _ShmFrames(sock)
+                elif reply.get("transport") == "multicast":
+                    udp = _join_multicast(reply["group"], int(reply["mcast_port"]))
+                    source = _UdpFrames(sock, udp, loss=udp_loss)
+                else:
+                    source = _TcpFrames(sock)
+                print(f"[Viewer] Connected to {host}:{port} (channel: {reply.get('channel')}, "
+                      f"codec: {reply.get('codec')}, transport: {reply.get('transport', 'tcp')})")
                 first_size = True
+                frame = None   # persistent framebuffer, patched by tile frames
+                scene = _SceneView(screen)
+                chain_ok = False   # False after a lost frame until the next full frame
+                last_key_request = 0.0
+                # with a present_delay from the host, frames wait for their shared target time
+                present_delay = reply.get("present_delay")
+                clock_sync = ClockSync() if present_delay is not None else None
+                pending = PresentQueue()
             except Exception:
+                if udp is not None:
+                    udp.close()
                 pygame.time.delay(500)
                 continue
 
@@ -78,16 +356,82 @@ def run_viewer(host: str, port: int, title: str = "StreamGame Viewer") -> None:
                         running = False
                     if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
                         running = False
+                    inputs.feed(event)
+                changes = inputs.flush()
+                if changes and send_input:
+                    # sent as soon as it happens, not with the next frame
+                    send_msg(connected_sock, changes)
+                if clock_sync is not None:
+                    ping = clock_sync.ping(now_us())
+                    if ping:
+                        send_msg(connected_sock, ping)
+
+                # short wait: a pending key press never sits behind a slow frame,
+                # and a frame due sooner than that is shown on time
+                timeout = 0.005
+                due = pending.next_due()
+                if due is not None:
+                    timeout = max(0.0, min(timeout, due - time.monotonic()))
+                got = source.read(timeout=timeout)
+                shown = pending.take(time.monotonic())
+                if shown is not None:
+                    present(*shown)
+                if got is None:
+                    continue
+                gap, (kind, codec_id, w, h, payload_len, host_us, tick), payload = got
+                if kind == FRAME_PONG:
+                    if clock_sync is not None:
+                        clock_sync.on_pong(unpack_pong(payload), host_us, now_us())
+                    continue
+                codec = decoder_for(codec_id)
 
-                header = _recv_exact(connected_sock, _HEADER_SIZE)
-                w, h, payload_len = struct.unpack(_HEADER_FMT, header)
-                payload = _recv_exact(connected_sock, payload_len)
-                raw = zlib.decompress(payload)
+                if gap:
+                    chain_ok = False
+                if kind in KEY_FRAMES:
+                    chain_ok = True
+                elif not chain_ok:
+                    # tiles (or players) on top of a picture that missed a frame would be garbage
+                    now = time.monotonic()
+                    if now - last_key_request > 0.2:
+                        send_msg(connected_sock, {"type": MSG_KEYFRAME})
+                        last_key_request = now
+                    continue
 
-                try:
-                    frame = pygame.image.frombuffer(raw, (w, h), "RGB")
-                except Exception:
-                    frame = pygame.image.fromstring(raw, (w, h), "RGB")
+                if kind == FRAME_SCENE:
+                    pending.clear()   # player states of the old scene
+                    scene.load(payload)
+                    continue   # drawn with the first entity update
+                if kind == FRAME_ENTITIES:
+                    at = present_time(host_us)
+                    if at is not None:
+                        pending.push(at, ("entities", payload))
+                    else:
+                        present("entities", payload)
+                        clock.tick(120)
+                    continue
+
+                if not codec.byte_stream:
+                    # whole-frame image codecs; the decoded array is ours to patch later
+                    frame = pygame.image.frombuffer(codec.decode_image(payload), (w, h), "RGB")
+                elif kind == FRAME_FULL:
+                    data = codec.decompress(payload)
+                    if data is None:
+                        chain_ok = False   # palette slot we never got; wait for a keyframe
+                        continue
+                    # copy: tile frames blit into this surface later
+                    frame = pygame.image.fromstring(data, (w, h), "RGB")
+                elif kind == FRAME_TILES:
+                    # nothing to patch until the first full frame arrives
+                    if frame is None or frame.get_size() != (w, h):
+                        continue
+                    data = codec.decompress(payload)
+                    if data is None:
+                        chain_ok = False
+                        continue
+                    for tx, ty, tw, th, rgb in iter_tiles(data):
+                        frame.blit(pygame.image.frombuffer(rgb, (tw, th), "RGB"), (tx, ty))
+                else:
+                    continue
 
                 # Keep fullscreen; first frame just adjusts internal scaling
                 if first_size:
@@ -96,15 +440,23 @@ def run_viewer(host: str, port: int, title: str = "StreamGame Viewer") -> None:
                 win_w, win_h = screen.get_size()
                 scale = min(win_w / w, win_h / h)
                 disp_w, disp_h = max(1, int(w * scale)), max(1, int(h * scale))
+                # a new surface, so it can wait in `pending` while tiles patch `frame`
                 scaled = pygame.transform.smoothscale(frame, (disp_w, disp_h))
 
-                screen.fill((10, 10, 12))
-                screen.blit(scaled, ((win_w - disp_w) // 2, (win_h - disp_h) // 2))
-                pygame.display.flip()
-                clock.tick(120)
+                at = present_time(host_us)
+                if at is not None:
+                    pending.push(at, ("pixels", scaled))
+                else:
+                    present("pixels", scaled)
+                    clock.tick(120)
 
-        except Exception:
+        except Exception as e:
+            if isinstance(e, _ShmUnreachable):
+                # the host took us for a local viewer; say hello again over plain TCP
+                print("[Viewer] Host's shared memory isn't reachable from here; reconnecting over TCP.")
+                transport = "tcp"
             # Lost connection — loop back to waiting
+            source.close()
             try:
                 connected_sock.close()
             except Exception:
@@ -118,5 +470,15 @@ if __name__ == "__main__":
     ap = argparse.ArgumentParser(description="Viewer for StreamGame streams.")
     ap.add_argument("--host", type=str, default="127.0.0.1")
     ap.add_argument("--port", type=int, default=9999)
+    ap.add_argument("--channel", type=str, default="", help='screen to show, e.g. "green" or "x,y,w,h"')
+    ap.add_argument("--udp", action="store_true", help="receive frames over UDP")
+    ap.add_argument("--shm", action="store_true", help="read frames from shared memory (viewer on the host machine)")
+    ap.add_argument("--multicast", action="store_true", help="join the host's multicast group (spectators)")
+    ap.add_argument("--udp-loss", type=float, default=0.0, help="drop this fraction of datagrams (testing)")
+    ap.add_argument("--no-input", action="store_true", help="don't send keys / controller input to the host")
+    ap.add_argument("--scene", action="store_true", help="receive level + player state and draw it locally")
     args = ap.parse_args()
-    run_viewer(args.host, args.port)
+    run_viewer(args.host, args.port, channel=args.channel,
+               transport="udp" if args.udp else "shm" if args.shm else "multicast" if args.multicast else "tcp",
+               udp_loss=args.udp_loss,
+               send_input=not args.no_input, mode="scene" if args.scene else "pixels")
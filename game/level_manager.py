@@ -490,6 +490,16 @@ class Level:
         self.render_level()
 
 
+    def load_level(self, level, block_width, world_size):
+        """Take a grid built elsewhere (e.g. streamed from the host) and render it"""
+        self.level = level
+        self.block_width = block_width
+        self.world_size = world_size
+        self.level_size = [len(level[0]), len(level)]
+        self.generate_border_walls()
+        self.render_level()
+
+
     #Danial you lazy fuck
     #Thanks gpt
     def generate_border_walls(self):
@@ -567,6 +577,25 @@ class Level:
         print(f"Total border walls: {border_wall_count}")
         self.rendered_level = rendered_level
     
+    def tile_samples(self):
+        """One rendered block per distinct wall tile, most used first (stream zdict)"""
+        counts = {}
+        for r, row in enumerate(self.level):
+            for c, cell in enumerate(row):
+                if cell == 1:
+                    key = id(self._get_wall_tile(c, r))
+                    n, pos = counts.get(key, (0, (c, r)))
+                    counts[key] = (n + 1, pos)
+
+        size = int(self.block_width)
+        bounds = self.rendered_level.get_rect()
+        samples = []
+        for n, (c, r) in sorted(counts.values(), reverse=True):
+            rect = pygame.Rect(int(c * self.block_width), int(r * self.block_width), size, size).clip(bounds)
+            if rect.width and rect.height:
+                samples.append(self.rendered_level.subsurface(rect))
+        return samples
+
     def _get_wall_tile(self, c, r):
         """
         Simple 4x4 autotiling system using the basic 16 tiles
@@ -6,166 +6,19 @@ import sys
 import json
 import subprocess
 import os
-from Menu.stream_game import StreamGame
-from typing import List
-from Coord.find2 import coords
-import socket
-import struct
-import threading
 import time
-import zlib
-
-_HEADER_FMT = "!III"   # width, height, payload_len (u32, network byte order)
-_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
-
-class StreamGame:
-
-    """
-    Stream Pygame surfaces (frames) to multiple TCP clients.
-
-    Protocol per frame:
-      header (12 bytes): width:uint32, height:uint32, payload_len:uint32 (big-endian)
-      payload: zlib-compressed RGB bytes (len = w*h*3 before compression)
-    """
-
-    def __init__(self, host: str = "0.0.0.0", port: int = 9999, max_clients: int = 3, target_fps: int = 20):
-        self.host = host
-        self.port = port
-        self.max_clients = max_clients
-        self.target_fps = max(1, int(target_fps))
-        self._min_frame_interval = 1.0 / float(self.target_fps)
-
-        self._server_sock: socket.socket | None = None
-        self._accept_thread: threading.Thread | None = None
-        self._stop_flag = threading.Event()
-        self._clients: List[socket.socket] = []
-        self._clients_lock = threading.Lock()
-        self._last_sent_time = 0.0
-
-    @property
-    def client_count(self) -> int:
-        with self._clients_lock:
-            return len(self._clients)
-
-    # ---- lifecycle ----
-    def start_server(self) -> None:
-        if self._server_sock is not None:
-            return
-        self._stop_flag.clear()
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((self.host, self.port))
-        s.listen(self.max_clients)
-        self._server_sock = s
-
-        t = threading.Thread(target=self._accept_loop, name="StreamGameAccept", daemon=True)
-        t.start()
-        self._accept_thread = t
-
-    def stop_server(self) -> None:
-        self._stop_flag.set()
-        if self._server_sock:
-            try:
-                self._server_sock.close()
-            except Exception:
-                pass
-            self._server_sock = None
-
-        with self._clients_lock:
-            for c in self._clients[:]:
-                try:
-                    c.shutdown(socket.SHUT_RDWR)
-                except Exception:
-                    pass
-                try:
-                    c.close()
-                except Exception:
-                    pass
-            self._clients.clear()
-
-        if self._accept_thread and self._accept_thread.is_alive():
-            self._accept_thread.join(timeout=1.0)
-        self._accept_thread = None
-
-    # ---- internals ----
-    def _accept_loop(self) -> None:
-        while not self._stop_flag.is_set():
-            try:
-                self._server_sock.settimeout(0.5)
-                client, _ = self._server_sock.accept()
-            except socket.timeout:
-                continue
-            except Exception:
-                if self._stop_flag.is_set():
-                    break
-                else:
-                    continue
-
-            with self._clients_lock:
-                if len(self._clients) >= self.max_clients:
-                    try:
-                        client.close()
-                    except Exception:
-                        pass
-                    continue
-                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                self._clients.append(client)
-
-    # ---- streaming ----
-    def stream_surface(self, surface: "pygame.Surface") -> None:
-
-        # control the rate of streaming
-        now = time.time()
-        if now - self._last_sent_time < self._min_frame_interval:
-            return
-        self._last_sent_time = now
-
-
-        # extract pygame surface
-        w, h = surface.get_size()
-        #24 bit rgb format
-        rgb_surface = surface.convert(24)
-
-        # [R,G,B][R,G,B]    
-        raw_bytes = pygame.image.tostring(rgb_surface, "RGB")
-        # compress (lvl 3 - good balance between speed and size)
-        payload = zlib.compress(raw_bytes, level=3)
-
-
-        header = struct.pack(_HEADER_FMT, w, h, len(payload))
-        packet = header + payload
-
-        dead = []
-        with self._clients_lock:
-            for c in self._clients:
-                try:
-                    c.sendall(packet)
-                except Exception:
-                    dead.append(c)
-            for c in dead:
-                try:
-                    self._clients.remove(c)
-                except ValueError:
-                    pass
-                try:
-                    c.close()
-                except Exception:
-                    pass
+from Menu.stream_async import AsyncStreamGame
+from Menu.stream_clock import PresentQueue
+from Menu.stream_game import build_zdict
+from Menu.stream_process import ProcessStreamGame
+from Menu.stream_shm import shm_available
+from Menu.stream_input import MergedKeys
+from Coord.find2 import coords
 
 def game_loop(screen, is_streaming=False, controllers={}):
-    streamer1 = None
-    streamer2 = None
-    if is_streaming:
-        streamer1 = StreamGame(port=9999)
-        streamer1.start_server()
-        print("[Game] Streaming server 1 started on port 9999.")
-
-        streamer2 = StreamGame(port=10000)
-        streamer2.start_server()
-        print("[Game] Streaming server 2 started on port 10000.")
-
     WIDTH, HEIGHT = screen.get_size()
     FPS = 60
+    PRESENT_DELAY = 4 / FPS   # every screen shows a tick this long after it's rendered
     clock = pygame.time.Clock()
 
     def corners_to_pygame_rect(corner1, corner2, corner3, corner4):
@@ -225,8 +78,39 @@ def game_loop(screen, is_streaming=False, controllers={}):
                            screen_rects[i][2],
                            screen_rects[i][3]]
 
+    # stream channel name -> world rect of that physical screen
+    channel_rects = dict(zip(colours, screen_rects))
+
     player_instance = player_module.Player(level.start_pos, level.block_width, level.border_walls, "SteamMan")
 
+    streamer = None
+    if is_streaming:
+        # one server for every screen: viewers subscribe to a colour (or any "x,y,w,h" of the world)
+        # viewers that don't name one get "blue", which is what port 9999 used to show.
+        # Started once the level exists: frames are deflated against its rendered tiles.
+        # Encoding runs in its own process where shared memory exists, off the game's GIL.
+        # Prometheus can scrape http://127.0.0.1:9998/metrics while it runs.
+        zdict = build_zdict(level.tile_samples() + player_instance.sprite_samples())
+        server = ProcessStreamGame if shm_available() else AsyncStreamGame
+        streamer = server(port=9999, max_clients=32, default_channel="blue", latency_budget=0.15,
+                          codec="palette", zdict=zdict, metrics_port=9998, present_delay=PRESENT_DELAY)
+        streamer.start_server()
+        print("[Game] Streaming server started on port 9999.")
+        if os.environ.get("STREAM_RECORD"):
+            # STREAM_RECORD=session.sgrec; serve it again with `python -m Menu.stream_replay session.sgrec`
+            try:
+                streamer.start_recording(os.environ["STREAM_RECORD"])
+            except OSError as e:
+                print(f"[Game] Not recording: {e}")
+
+    # the "red" screen's frames, waiting for their present time: copied into a few reused
+    # surfaces, one more than the queue holds, so the next one written is never still queued
+    local_frames = PresentQueue(max_frames=round(PRESENT_DELAY * FPS) + 2)
+    local_ring = []
+    local_next = 0
+    if streamer and "red" in channel_rects:
+        red_size = pygame.Rect(channel_rects["red"]).size
+        local_ring = [pygame.Surface(red_size) for _ in range(local_frames.max_frames + 1)]
     overview = False
     tick = 0
     running = True
@@ -240,32 +124,41 @@ def game_loop(screen, is_streaming=False, controllers={}):
         level_surface.fill((0, 0, 0))
 
         level.draw(level_surface)
-        player_instance.update(tick, keys, gravity)
+        player_keys = keys
+        if streamer:
+            # viewers' keys / controllers, received since the last tick
+            player_keys = MergedKeys(keys, streamer.remote_keys(player_instance.controls))
+        player_instance.update(tick, player_keys, gravity)
         player_instance.draw(level_surface)
         pygame.draw.rect(level_surface, (255, 255, 0), player_instance.hitbox, 2)
-
-        for colour, rect in zip(colours, screen_rects):
-            extracted_surface = level_surface.subsurface(rect)
-
-            if is_streaming:
-                if streamer1 and colour == "blue":
-                    streamer1.stream_surface(extracted_surface)
-
-                if streamer2 and colour == "green":
-                    streamer2.stream_surface(extracted_surface)
-            if colour == "red":
-                screen.blit(extracted_surface, (0,0))
+        rendered_at = time.monotonic()
+
+        if streamer:
+            # each channel is encoded once and only if someone is watching it
+            streamer.stream_world(level_surface, channel_rects, tick, rendered_at)
+            # scene-mode viewers draw the level themselves: just the player state per tick
+            streamer.stream_scene(level, [player_instance], channel_rects, tick, rendered_at)
+
+        if "red" in channel_rects:
+            red = level_surface.subsurface(channel_rects["red"])
+            if streamer and streamer.client_count:
+                # held back like the viewers' screens, so a player crossing a seam doesn't jump
+                held = local_ring[local_next]
+                local_next = (local_next + 1) % len(local_ring)
+                held.blit(red, (0, 0))
+                local_frames.push(rendered_at + PRESENT_DELAY, held)
+                red = local_frames.take(time.monotonic(), slack=0.5 / FPS)
+            else:
+                local_frames.clear()
+            if red is not None:
+                screen.blit(red, (0,0))
 
         pygame.display.flip()
         tick += 1
 
-    if is_streaming:
-        if streamer1:
-            streamer1.stop_server()
-            print("[Game] Streaming server 1 stopped.")
-        if streamer2:
-            streamer2.stop_server()
-            print("[Game] Streaming server 2 stopped.")
+    if streamer:
+        streamer.stop_server()
+        print("[Game] Streaming server stopped.")
 
 # This part is for testing the game module directly
 if __name__ == "__main__":
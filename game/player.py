@@ -140,6 +140,7 @@ class Player:
         self.animation_timer = 0
         self.facing_right = True
         self.current_state = "idle"  # idle, run, jump, hurt, death
+        self.mirror = False  # True on a viewer: state comes from the host, not physics
         
         # Preload specific animation sprites
         self._preload_animations()
@@ -292,6 +293,21 @@ class Player:
             # Fallback to colored rectangle
             self._draw_fallback_rectangle(screen)
     
+    def sprite_samples(self, background=(50, 50, 50)):
+        """Idle and run frames as draw() puts them on screen, over `background` (stream zdict)"""
+        if not self.player_sprites.sprites_loaded or not hasattr(self, 'animations'):
+            return []
+        target_height = int(self.height * 1.5)
+        samples = []
+        for state in ("idle", "run"):
+            for sprite in self.animations.get(state, [])[:1]:
+                width = int(target_height * sprite.get_width() / sprite.get_height())
+                sample = pygame.Surface((width, target_height))
+                sample.fill(background)
+                sample.blit(self.player_sprites.scale_sprite(sprite, width, target_height), (0, 0))
+                samples.append(sample)
+        return samples
+
     def _draw_fallback_rectangle(self, screen):
         """Fallback drawing method using colored rectangles"""
         if self.collide:
@@ -327,7 +343,10 @@ class Player:
             return None
         
         # Update current state based on player conditions (simplified)
-        if self.current_state == "hurt" or self.current_state == "death":
+        if self.mirror:
+            # the host already decided the state
+            pass
+        elif self.current_state == "hurt" or self.current_state == "death":
             # Keep current state until animation completes
             pass
         elif not self.grounded:
@@ -356,6 +375,26 @@ class Player:
             
         return sprite
     
+    def snapshot(self):
+        """What a viewer needs to draw this player (scene-state streaming)"""
+        return {
+            "name": self.name,
+            "pos": [round(self.pos[0], 1), round(self.pos[1], 1)],
+            "state": self.current_state,
+            "frame": self.current_frame,
+            "facing_right": self.facing_right,
+        }
+
+    def apply_snapshot(self, snap, offset=(0, 0), scale=1.0):
+        """Mirror a host snapshot, drawn at `scale` relative to `offset` (world pixels)"""
+        self.mirror = True
+        self.collide = False
+        self.pos = [(snap["pos"][0] - offset[0]) * scale, (snap["pos"][1] - offset[1]) * scale]
+        self.current_state = snap["state"]
+        self.current_frame = snap["frame"]
+        self.facing_right = snap["facing_right"]
+        self.hitbox = pygame.Rect(self.pos[0] - self.width/2, self.pos[1] - self.height/2, self.width, self.height)
+
     def set_state(self, new_state):
         """Manually set player animation state (for hurt, death, etc.)"""
         if new_state in ["idle", "run", "jump", "hurt", "death"]:
@@ -64,10 +64,10 @@ def main():
                 continue
 
             if isinstance(result, tuple) and result and result[0] == "connect":
-                _, ip, port_str = result
+                _, ip, port_str, channel = result
                 try:
                     port = int(port_str)
-                    run_viewer(host=ip, port=port)
+                    run_viewer(host=ip, port=port, channel=channel)
                 except ValueError:
                     print(f"Invalid port: {port_str}. Must be a number.")
                 except Exception as e:
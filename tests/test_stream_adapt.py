@@ -0,0 +1,90 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pygame
+import pytest
+
+from Menu.stream_adapt import QualityController
+from Menu.stream_game import StreamGame
+from Menu.stream_protocol import recv_msg, send_msg
+
+RATE = 300_000   # bytes/second the slow viewer reads
+W, H = 80, 60    # noise, so every frame is a raw full frame: 14.4 kB, 432 kB/s at 30 fps
+
+
+def test_steps_down_when_saturated_and_only_up_with_headroom():
+    c = QualityController(0.15, recover_after=1.0)
+    assert c.update(0.01, False, 1.0, byte_rate=200_000, throughput=150_000)   # over the link: down
+    assert c.step == 1
+    # between headroom and the link rate: no reason to go either way
+    for t in range(2, 10):
+        assert not c.update(0.01, False, float(t), byte_rate=130_000, throughput=150_000)
+    assert c.step == 1
+    # well inside the link again: back up once it would fit
+    assert c.update(0.01, False, 10.0, byte_rate=50_000, throughput=150_000)
+    assert c.step == 0
+
+
+@pytest.fixture
+def slow_viewer():
+    pygame.init()
+    server = StreamGame(port=_free_port(), target_fps=30, latency_budget=0.15, codec="raw")
+    server.start_server()
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32 * 1024)
+    sock.connect(("127.0.0.1", server.port))
+    sock.settimeout(5)
+    send_msg(sock, {"codecs": ["raw"]})
+    assert recv_msg(sock)["codec"] == "raw"
+    stop = threading.Event()
+
+    def read():
+        # a link that carries RATE bytes/second
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                n = len(sock.recv(4096))
+            except OSError:
+                return
+            time.sleep(max(0.0, n / RATE - (time.monotonic() - started)))
+
+    threading.Thread(target=read, daemon=True).start()
+    yield server
+    stop.set()
+    server.stop_server()
+    sock.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_throughput_is_the_link_rate_and_quality_settles(slow_viewer):
+    server = slow_viewer
+    rng = np.random.default_rng(0)
+    steps = []
+    started = time.monotonic()
+    tick = 0
+    while time.monotonic() - started < 6.0:
+        frame = rng.integers(0, 256, (H, W, 3), dtype=np.uint8)
+        server.stream_surface(pygame.image.frombuffer(frame.tobytes(), (W, H), "RGB"), tick=tick)
+        tick += 1
+        st = next(iter(server._streams.values()), None)
+        if st is not None:
+            st.controller.recover_after = 1.0   # climb back within the test's few seconds
+            if not steps or steps[-1] != st.controller.step:
+                steps.append(st.controller.step)
+        time.sleep(1 / 60)
+
+    client = server._clients[0]
+    # what the link carries, not how fast a send copies into the socket buffer
+    assert 0.6 * RATE < client.throughput < 1.2 * RATE
+    # down to something that fits, then up while it still fits: never back down again
+    lowest = steps.index(max(steps))
+    assert steps[:lowest + 1] == sorted(steps[:lowest + 1])
+    assert steps[lowest:] == sorted(steps[lowest:], reverse=True)
+    assert st.byte_rate < RATE
@@ -0,0 +1,179 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from Menu.stream_codecs import (
+    _PAL_FMT, MIN_BAND_BYTES, PALETTE_SIZE, available_codecs, cv2, decoder_for, make_codec,
+)
+from Menu.stream_protocol import dirty_tiles, iter_tiles, pack_tiles
+
+
+def _tile_art(w=96, h=64, colours=12, seed=0):
+    """A frame of solid 8x8 blocks in a few colours, like the game's tiles."""
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(0, 256, (colours, 3), dtype=np.uint8)
+    blocks = rng.integers(0, colours, (-(-h // 8), -(-w // 8)))
+    return np.ascontiguousarray(palette[blocks].repeat(8, axis=0).repeat(8, axis=1)[:h, :w])
+
+
+def _changed(frame, seed=1):
+    """`frame` with a few 8x8 blocks recoloured from colours already in it."""
+    out = frame.copy()
+    rng = np.random.default_rng(seed)
+    for _ in range(4):
+        by, bx = rng.integers(0, frame.shape[0] // 8), rng.integers(0, frame.shape[1] // 8)
+        src = frame[rng.integers(0, frame.shape[0]), rng.integers(0, frame.shape[1])]
+        out[by * 8:by * 8 + 8, bx * 8:bx * 8 + 8] = src
+    return out
+
+
+def _full(enc, dec, frame):
+    data = dec.decompress(enc.compress(frame))
+    return None if data is None else np.frombuffer(data, dtype=np.uint8).reshape(frame.shape)
+
+
+def _tiles(enc, dec, prev, frame, tile=16):
+    rects = dirty_tiles(prev, frame, tile)
+    if hasattr(enc, "compress_tiles"):
+        payload = enc.compress_tiles(frame, rects)
+    else:
+        payload = enc.compress(pack_tiles(frame, rects))
+    data = dec.decompress(payload)
+    if data is None:
+        return None
+    out = prev.copy()
+    for x, y, w, h, rgb in iter_tiles(data):
+        out[y:y + h, x:x + w] = np.frombuffer(rgb, dtype=np.uint8).reshape(h, w, 3)
+    return out
+
+
+@pytest.mark.parametrize("name", ["raw", "zlib", "palette"])
+def test_lossless_round_trip(name):
+    enc, dec = make_codec(name), make_codec(name)
+    a = _tile_art()
+    b = _changed(a)
+    assert np.array_equal(_full(enc, dec, a), a)
+    assert np.array_equal(_tiles(enc, dec, a, b), b)
+
+
+def test_every_available_codec_is_known():
+    for name in available_codecs():
+        codec = make_codec(name)
+        assert decoder_for(codec.codec_id).name == name
+    with pytest.raises(ValueError):
+        make_codec("gif")
+    with pytest.raises(ValueError):
+        decoder_for(250)
+
+
+def test_zlib_bands():
+    enc, dec = make_codec("zlib", threads=4), make_codec("zlib")
+    frame = np.random.default_rng(3).integers(0, 4, (MIN_BAND_BYTES, 3), dtype=np.uint8)
+    payload = enc.compress(frame)
+    assert payload[0] == 0   # band table, not a single zlib stream
+    assert dec.decompress(payload) == frame.tobytes()
+    # small buffers stay one ordinary stream
+    assert zlib.decompress(enc.compress(frame[:100])) == frame[:100].tobytes()
+
+
+def test_zlib_quality_scale_raises_level():
+    codec = make_codec("zlib", level=3)
+    codec.set_quality_scale(0.5)
+    assert codec.level > 3
+    codec.set_quality_scale(1.0)
+    assert codec.level == 3
+
+
+@pytest.mark.parametrize("name", ["zlib", "palette"])
+def test_zdict_round_trip(name):
+    art = _tile_art(seed=5)
+    enc, dec = make_codec(name), make_codec(name)
+    enc.set_zdict(art.tobytes())
+    dec.set_zdict(art.tobytes())
+    frame = _changed(art, seed=6)
+    assert np.array_equal(_full(enc, dec, frame), frame)
+    if name == "zlib":
+        with pytest.raises(zlib.error):
+            make_codec(name).decompress(enc.compress(frame))   # dictionary missing
+
+
+def test_palette_tiles_carry_only_new_slots():
+    enc, dec = make_codec("palette"), make_codec("palette")
+    slots = lambda payload: struct.unpack_from(_PAL_FMT, zlib.decompress(payload))[3]
+    a = _tile_art()
+    b = _changed(a)
+    c = b.copy()
+    c[:8, :8] = (1, 2, 3)   # one colour the palette doesn't have yet
+    key = enc.compress(a)
+    assert slots(key) == len(np.unique(a.reshape(-1, 3), axis=0))   # the whole palette
+    to_b = enc.compress_tiles(b, dirty_tiles(a, b, 16))
+    to_c = enc.compress_tiles(c, dirty_tiles(b, c, 16))
+    assert (slots(to_b), slots(to_c)) == (0, 1)
+
+    dec.decompress(key)
+    assert np.array_equal(_tiles_from(dec, a, to_b), b)
+    assert np.array_equal(_tiles_from(dec, b, to_c), c)
+
+
+def test_palette_epoch_reset():
+    enc, dec, late = make_codec("palette"), make_codec("palette"), make_codec("palette")
+    a = _tile_art(w=256, h=160, colours=200, seed=7)
+    b = _tile_art(w=256, h=160, colours=200, seed=8)   # together more colours than PALETTE_SIZE
+    assert len(np.unique(np.concatenate([a, b]).reshape(-1, 3), axis=0)) > PALETTE_SIZE
+    b2 = _changed(b, seed=9)
+
+    assert np.array_equal(_full(enc, dec, a), a)
+    _full(make_codec("palette"), late, a)   # same first frame, from its own encoder
+    assert np.array_equal(_full(enc, dec, b), b)   # new epoch
+    rects = dirty_tiles(b, b2, 16)
+    payload = enc.compress_tiles(b2, rects)
+    assert np.array_equal(_tiles_from(dec, b, payload), b2)
+    # a viewer that missed the new epoch's keyframe can't use its tiles
+    assert late.decompress(payload) is None
+
+
+def _tiles_from(dec, prev, payload):
+    out = prev.copy()
+    for x, y, w, h, rgb in iter_tiles(dec.decompress(payload)):
+        out[y:y + h, x:x + w] = np.frombuffer(rgb, dtype=np.uint8).reshape(h, w, 3)
+    return out
+
+
+def test_palette_overflow_goes_rgb():
+    enc, dec = make_codec("palette"), make_codec("palette")
+    noisy = np.random.default_rng(4).integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    assert np.array_equal(_full(enc, dec, noisy), noisy)
+    art = _tile_art()
+    assert np.array_equal(_full(enc, dec, art), art)
+    noisier = np.random.default_rng(5).integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    assert np.array_equal(_tiles(enc, dec, art, noisier), noisier)   # RGB tiles
+
+
+def test_palette_unknown_slot():
+    enc, dec = make_codec("palette"), make_codec("palette")
+    a = _tile_art()
+    enc.compress(a)   # the viewer never got this keyframe
+    assert dec.decompress(enc.compress_tiles(_changed(a), [(0, 0, 16, 16)])) is None
+
+
+def test_yuv420_round_trip():
+    enc, dec = make_codec("yuv420"), make_codec("yuv420")
+    a = _tile_art(w=90, h=62)   # odd chroma edge
+    b = _changed(a)
+    assert np.abs(_full(enc, dec, a).astype(int) - a).max() <= 3
+    assert np.abs(_tiles(enc, dec, a, b).astype(int) - b).max() <= 3
+
+
+@pytest.mark.skipif(cv2 is None, reason="needs opencv-python")
+@pytest.mark.parametrize("name,tolerance", [("png", 0), ("jpeg", 10), ("webp", 10)])
+def test_image_codecs(name, tolerance):
+    codec = make_codec(name)
+    assert not codec.byte_stream
+    a = _tile_art()
+    out = codec.decode_image(codec.encode_image(a))
+    assert out.shape == a.shape
+    assert np.abs(out.astype(int) - a).mean() <= tolerance   # lossy ones ring at block edges
+    codec.set_quality_scale(0.5)
+    assert codec.decode_image(codec.encode_image(a)).shape == a.shape
@@ -0,0 +1,44 @@
+import socket
+import threading
+import time
+
+import pygame
+import pytest
+
+from Menu.stream_game import StreamGame, _Stream
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server():
+    pygame.init()
+    server = StreamGame(port=_free_port(), encode_workers=4, max_inflight=4)
+    server.start_server()
+    yield server
+    server.stop_server()
+
+
+@pytest.mark.parametrize("codec,in_order", [("palette", True), ("zlib", False)])
+def test_stateful_codec_encodes_in_frame_order(server, codec, in_order):
+    finished = []
+    lock = threading.Lock()
+
+    def encode(codec, frame, delay):
+        time.sleep(delay)   # earlier frames take longer, so free workers would overtake them
+        with lock:
+            finished.append(frame)
+        return frame
+
+    server._encode_frame = encode
+    st = _Stream("*", (codec, ()), (16, 16), 4, None, 30)
+    futures = [server._submit_encode(st, i, 0.08 - 0.02 * i) for i in range(4)]
+    assert [f.result(timeout=2) for f in futures] == [0, 1, 2, 3]
+    if in_order:
+        assert finished == [0, 1, 2, 3]
+    else:
+        assert finished == [3, 2, 1, 0]   # stateless codecs still use the whole pool
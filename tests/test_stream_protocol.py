@@ -0,0 +1,34 @@
+import numpy as np
+
+from Menu.stream_protocol import dirty_tiles, iter_tiles, pack_tiles
+
+
+def _frame(w=100, h=70, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+def test_dirty_tiles_equal_frames():
+    a = _frame()
+    assert dirty_tiles(a, a.copy(), 32) == []
+
+
+def test_dirty_tiles_clips_edge_tiles():
+    a = _frame()
+    b = a.copy()
+    b[0, 0, 0] ^= 1
+    b[69, 99, 2] ^= 1   # bottom-right corner: a 4x6 edge tile
+    b[40, 50, 1] ^= 1
+    assert sorted(dirty_tiles(a, b, 32)) == [(0, 0, 32, 32), (32, 32, 32, 32), (96, 64, 4, 6)]
+
+
+def test_pack_iter_tiles_round_trip():
+    prev, cur = _frame(seed=1), _frame(seed=2)
+    rects = dirty_tiles(prev, cur, 16)
+    patched = prev.copy()
+    for x, y, w, h, rgb in iter_tiles(pack_tiles(cur, rects)):
+        patched[y:y + h, x:x + w] = np.frombuffer(rgb, dtype=np.uint8).reshape(h, w, 3)
+    assert np.array_equal(patched, cur)
+
+
+def test_iter_tiles_empty():
+    assert list(iter_tiles(pack_tiles(_frame(), []))) == []
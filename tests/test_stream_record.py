@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from Menu.stream_protocol import FRAME_FULL, FRAME_TILES
+from Menu.stream_record import REC_PACKET, REC_STREAM, StreamRecorder, read_recording
+
+
+def _packet(kind, size, fill=0):
+    return bytes([kind]) + bytes([fill]) * (size - 1)
+
+
+def _record_all(path, packets, **kwargs):
+    rec = StreamRecorder(str(path), {"target_fps": 20}, **kwargs)
+    rec.start()
+    for key, packet in packets:
+        rec.record(key, {"channel": key}, packet)
+    rec.close()
+    return rec
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "s.sgrec"
+    packets = [
+        ("blue", _packet(FRAME_TILES, 40)),   # before any keyframe: nothing to patch
+        ("blue", _packet(FRAME_FULL, 500, 1)),
+        ("red", _packet(FRAME_FULL, 300, 2)),
+        ("blue", _packet(FRAME_TILES, 50, 3)),
+        ("red", _packet(FRAME_TILES, 60, 4)),
+    ]
+    rec = _record_all(path, packets)
+    assert rec.written == os.path.getsize(path)
+    assert rec.dropped == 1
+
+    meta, records = read_recording(str(path))
+    assert meta == {"target_fps": 20}
+    records = list(records)
+    assert [(r[0], r[2]) for r in records] == [
+        (REC_STREAM, 0), (REC_PACKET, 0), (REC_STREAM, 1), (REC_PACKET, 1), (REC_PACKET, 0), (REC_PACKET, 1),
+    ]
+    assert records[0][3] == b'{"channel": "blue"}'
+    assert [r[3] for r in records if r[0] == REC_PACKET] == [p for _, p in packets[1:]]
+    times = [r[1] for r in records]
+    assert times == sorted(times)
+
+
+def test_needs_keyframe(tmp_path):
+    rec = StreamRecorder(str(tmp_path / "k.sgrec"))
+    rec.start()
+    assert rec.needs_keyframe("blue")
+    rec.record("blue", {}, _packet(FRAME_FULL, 10))
+    assert not rec.needs_keyframe("blue")
+    rec.close()
+
+
+def test_full_buffer_drops_until_keyframe(tmp_path):
+    path = tmp_path / "d.sgrec"
+    packets = [
+        ("blue", _packet(FRAME_FULL, 500, 1)),
+        ("blue", _packet(FRAME_TILES, 5000, 2)),   # never fits: breaks the tile chain
+        ("blue", _packet(FRAME_TILES, 50, 3)),     # fits, but patches a frame we don't have
+        ("blue", _packet(FRAME_FULL, 500, 4)),
+        ("blue", _packet(FRAME_TILES, 50, 5)),
+    ]
+    rec = _record_all(path, packets, max_buffer=2000)
+    assert rec.dropped == 2
+    _, records = read_recording(str(path))
+    assert [r[3][1] for r in records if r[0] == REC_PACKET] == [1, 4, 5]
+
+
+def test_truncated_file(tmp_path):
+    path = tmp_path / "t.sgrec"
+    _record_all(path, [("blue", _packet(FRAME_FULL, 100)), ("blue", _packet(FRAME_TILES, 100))])
+    os.truncate(path, os.path.getsize(path) - 10)   # crashed mid-write
+    _, records = read_recording(str(path))
+    assert [r[0] for r in records] == [REC_STREAM, REC_PACKET]
+
+
+def test_never_overwrites(tmp_path):
+    path = tmp_path / "x.sgrec"
+    path.write_bytes(b"keep")
+    with pytest.raises(FileExistsError):
+        StreamRecorder(str(path)).start()
+    assert path.read_bytes() == b"keep"
+    with pytest.raises(ValueError):
+        read_recording(str(path))
@@ -0,0 +1,51 @@
+import socket
+
+import pygame
+import pytest
+
+from Menu.stream_game import StreamGame, _ClientConn
+from Menu.stream_protocol import recv_msg, send_msg
+from Menu.stream_shm import MSG_SHM_FRAME, shm_available
+from Menu.viewer import _ShmFrames, _ShmUnreachable
+
+pytestmark = pytest.mark.skipif(not shm_available(), reason="needs multiprocessing.shared_memory")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_local_viewer_gets_shm():
+    pygame.init()
+    server = StreamGame(port=_free_port())
+    server.start_server()
+    try:
+        with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+            send_msg(sock, {"transport": "shm"})
+            assert recv_msg(sock)["transport"] == "shm"
+    finally:
+        server.stop_server()
+
+
+@pytest.mark.parametrize("peer,local,same", [
+    ("127.0.0.1", "127.0.0.1", True),
+    ("::1", "::1", True),
+    ("192.168.1.20", "192.168.1.20", True),    # connected to one of our own interfaces
+    ("192.168.1.31", "192.168.1.20", False),   # another machine on the LAN
+    ("203.0.113.5", None, False),
+])
+def test_shm_only_for_the_same_host(peer, local, same):
+    client = object.__new__(_ClientConn)   # no socket or threads needed to judge an address
+    client.addr = (peer, 50000)
+    client._local_address = lambda: local
+    assert client._same_host() == same
+
+
+def test_viewer_falls_back_when_first_ring_is_missing():
+    host, viewer = socket.socketpair()
+    with host, viewer:
+        send_msg(host, {"type": MSG_SHM_FRAME, "name": "no-such-stream-ring", "slot": 0, "seq": 1})
+        with pytest.raises(_ShmUnreachable):
+            _ShmFrames(viewer).read(timeout=1.0)
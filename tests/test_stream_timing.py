@@ -0,0 +1,88 @@
+import random
+
+from Menu.stream_clock import MSG_PING, ClockSync, PresentQueue
+from Menu.stream_pacing import FramePacer
+
+
+def _sent_ticks(pacer, ticks, tick_rate=60.0, jitter=0.0, seed=0):
+    rng = random.Random(seed)
+    sent = []
+    for i in range(ticks):
+        now = i / tick_rate + rng.uniform(-jitter, jitter)
+        if pacer.ready(now):
+            pacer.mark_sent(now)
+            sent.append(i)
+    return sent
+
+
+def test_pacer_even_spacing():
+    sent = _sent_ticks(FramePacer(20), 600)
+    assert abs(len(sent) - 200) <= 1
+    assert {b - a for a, b in zip(sent[10:], sent[11:])} == {3}
+
+
+def test_pacer_ignores_tick_jitter():
+    sent = _sent_ticks(FramePacer(20), 600, jitter=0.003)
+    gaps = [b - a for a, b in zip(sent[10:], sent[11:])]
+    assert abs(len(sent) - 200) <= 2
+    assert gaps.count(3) >= 0.95 * len(gaps)
+
+
+def test_pacer_set_rate_and_achieved_fps():
+    pacer = FramePacer(30)
+    pacer.set_rate(10)
+    sent = _sent_ticks(pacer, 300)
+    assert abs(len(sent) - 50) <= 1
+    assert abs(pacer.achieved_fps(300 / 60.0) - 10) <= 1
+
+
+def test_clock_ping_schedule():
+    clock = ClockSync(burst=3, burst_interval=0.05, interval=1.0)
+    pings = [t for t in range(0, 3_000_000, 10_000) if clock.ping(t)]
+    # three quick ones after connecting, then one a second
+    assert pings[:3] == [0, 50_000, 100_000]
+    assert pings[3:] == [1_100_000, 2_100_000]
+    assert ClockSync().ping(0) == {"type": MSG_PING, "t": 0}
+
+
+def test_clock_trusts_shortest_round_trip():
+    offset = 5_000_000   # host clock ahead by 5 s
+    rng = random.Random(1)
+    clock = ClockSync(window=16)
+    assert not clock.synced
+    t = 1_000_000
+    for i in range(12):
+        # queueing delays on either leg; one ping got through untouched
+        there, back = (150, 150) if i == 7 else (rng.randint(200, 20_000), rng.randint(200, 20_000))
+        clock.on_pong(t, t + there + offset, t + there + back)
+        t += 50_000
+    assert clock.synced
+    assert clock.offset_us == offset
+    assert clock.rtt_us == 300
+    assert clock.local_time(offset + 2_000_000) == 2.0
+
+
+def test_clock_ignores_foreign_pongs():
+    clock = ClockSync()
+    clock.on_pong(1_000, 5_000, 500)          # sent after it came back
+    clock.on_pong(0, 5_000, 10_000_000)       # ten seconds stale
+    assert clock.offset_us == 0 and not clock.synced
+
+
+def test_present_queue_takes_newest_due():
+    q = PresentQueue()
+    for at, item in ((0.3, "c"), (0.1, "a"), (0.2, "b"), (0.2, "b2")):
+        q.push(at, item)
+    assert q.take(0.05) is None
+    assert q.next_due() == 0.1
+    assert q.take(0.2) == "b2"   # a and b were late: skipped, not replayed
+    assert len(q) == 1
+    assert q.take(0.25, slack=0.05) == "c"
+    assert q.take(10.0) is None
+
+
+def test_present_queue_bounded():
+    q = PresentQueue(max_frames=3)
+    for i in range(5):
+        q.push(float(i), i)
+    assert len(q) == 3 and q.next_due() == 2.0
@@ -0,0 +1,161 @@
+import random
+import socket
+import statistics
+import threading
+import time
+
+import numpy as np
+import pygame
+import pytest
+
+from Menu.stream_clock import now_us
+from Menu.stream_codecs import make_codec
+from Menu.stream_game import StreamGame
+from Menu.stream_protocol import FRAME_FULL, FRAME_TILES, MSG_KEYFRAME, iter_tiles, recv_msg, send_msg
+from Menu.stream_udp import DATAGRAM_SIZE, Reassembler, fragment
+from Menu.viewer import _UdpFrames
+
+
+def _packet(n, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, n, dtype=np.uint8).tobytes()
+
+
+def test_fragments_fit_datagram():
+    dgrams = list(fragment(7, _packet(5000)))
+    assert len(dgrams) == 5
+    assert all(len(d) <= DATAGRAM_SIZE for d in dgrams)
+    assert len(list(fragment(8, b""))) == 1
+
+
+def test_reassemble_out_of_order():
+    packet = _packet(10_000)
+    dgrams = list(fragment(3, packet))
+    random.Random(0).shuffle(dgrams)
+    dgrams.append(dgrams[0])   # duplicates are harmless
+    reasm = Reassembler()
+    done = [r for r in map(reasm.feed, dgrams) if r is not None]
+    assert done == [(3, packet)]
+
+
+def test_lost_fragment_costs_one_frame():
+    reasm = Reassembler(max_behind=2)
+    frames = {seq: _packet(3000, seq) for seq in range(6)}
+    done = []
+    for seq, packet in frames.items():
+        for i, d in enumerate(fragment(seq, packet)):
+            if seq == 1 and i == 1:
+                continue   # lost
+            r = reasm.feed(d)
+            if r is not None:
+                done.append(r[0])
+    assert done == [0, 2, 3, 4, 5]
+    assert reasm.incomplete_frames == 1
+
+
+def test_incomplete_frame_times_out():
+    reasm = Reassembler(timeout=0.01)
+    first = next(fragment(0, _packet(3000)))
+    reasm.feed(first)
+    time.sleep(0.02)
+    assert reasm.feed(b"\x00" * 3) is None   # runt datagram: ignored
+    assert reasm.feed(next(fragment(1, _packet(3000)))) is None
+    assert reasm.incomplete_frames == 1
+
+
+# ---- loopback: UDP transport with datagrams dropped on the viewer side ----
+W, H = 320, 192
+
+
+def _render(tick: int) -> np.ndarray:
+    """Frame `tick` of a moving block over a noise patch that changes every 10 ticks."""
+    frame = np.full((H, W, 3), 30, dtype=np.uint8)
+    x = (tick * 7) % (W - 32)
+    frame[40:72, x:x + 32] = (200, tick % 256, 40)
+    rng = np.random.default_rng(tick // 10)
+    frame[128:192, 0:64] = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    return frame
+
+
+@pytest.fixture
+def lossy_viewer():
+    pygame.init()
+    server = StreamGame(port=_free_port(), target_fps=30, keyframe_interval=None, allow_udp=True)
+    server.start_server()
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+    udp.bind(("127.0.0.1", 0))
+    ctrl = socket.create_connection(("127.0.0.1", server.port))
+    ctrl.settimeout(5)
+    send_msg(ctrl, {"codecs": ["zlib"], "transport": "udp", "udp_port": udp.getsockname()[1]})
+    reply = recv_msg(ctrl)
+    assert reply["transport"] == "udp"
+    random.seed(8)   # _UdpFrames drops with the random module
+    yield server, ctrl, _UdpFrames(ctrl, udp, loss=0.05)
+    server.stop_server()
+    ctrl.close()
+    udp.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_udp_loss_recovers_with_bounded_latency(lossy_viewer):
+    server, ctrl, source = lossy_viewer
+    stop = threading.Event()
+
+    def game():
+        tick = 0
+        while not stop.is_set():
+            frame = _render(tick)
+            surface = pygame.image.frombuffer(frame.tobytes(), (W, H), "RGB")
+            server.stream_surface(surface, tick=tick)
+            tick += 1
+            time.sleep(1 / 60)
+
+    threading.Thread(target=game, daemon=True).start()
+    codec = make_codec("zlib")
+    picture = None
+    chain = False
+    broken_at = None
+    latencies, recoveries = [], []
+    shown = gaps = 0
+    try:
+        deadline = time.monotonic() + 4.0
+        while time.monotonic() < deadline:
+            got = source.read()
+            if got is None:
+                continue
+            gap, (kind, _, w, h, _, host_us, tick), payload = got
+            latencies.append((now_us() - host_us) / 1e6)
+            if gap:
+                gaps += 1
+                chain = False
+            if kind == FRAME_FULL:
+                picture = np.frombuffer(codec.decompress(payload), dtype=np.uint8).reshape(h, w, 3).copy()
+                chain = True
+            elif kind != FRAME_TILES or not chain:
+                # as the viewer does: ask for a keyframe instead of patching a broken picture
+                if broken_at is None:
+                    broken_at = time.monotonic()
+                send_msg(ctrl, {"type": MSG_KEYFRAME})
+                continue
+            else:
+                for x, y, tw, th, rgb in iter_tiles(codec.decompress(payload)):
+                    picture[y:y + th, x:x + tw] = np.frombuffer(rgb, dtype=np.uint8).reshape(th, tw, 3)
+            if broken_at is not None:
+                recoveries.append(time.monotonic() - broken_at)
+                broken_at = None
+            # every picture shown is exactly the frame the game rendered at that tick
+            assert np.array_equal(picture, _render(tick))
+            shown += 1
+    finally:
+        stop.set()
+
+    assert gaps > 0, "no datagram was dropped; the test proves nothing"
+    assert recoveries and max(recoveries) < 0.5   # keyframe interval is off: requests did it
+    assert shown > 60
+    assert statistics.median(latencies) < 0.05
+    assert max(latencies) < 0.5